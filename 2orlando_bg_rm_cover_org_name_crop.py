@@ -1,69 +1,64 @@
 import os
+import threading
 import tkinter as tk
 from tkinter import filedialog, messagebox
-from PIL import Image
-from rembg import remove
-from io import BytesIO
+from rembg_session import get_session, timings
+from batch_segment import DEFAULT_BATCH_SIZE, iter_batches, load_image
+from mask_cache import segment_images, stats as cache_stats
+from image_jobs import crop_replace_jpg, crop_replace_output, save_cropped_jpg
+from parallel_runner import DEFAULT_WORKERS, RunResult, run_parallel
+from pipeline import PIPELINE_ENABLED, format_stage_report, run_pipeline
+from run_manifest import MANIFEST_NAME, RunManifest, scan_images
+from write_behind import start_writer, stop_writer
 
-# Custom function to get tight bounding box ignoring low alpha pixels
-def get_tight_bbox(img, threshold=10):
-    data = list(img.getdata())
-    width, height = img.size
-    left = width
-    top = height
-    right = 0
-    bottom = 0
-    for y in range(height):
-        for x in range(width):
-            a = data[y * width + x][3]
-            if a >= threshold:
-                left = min(left, x)
-                right = max(right, x)
-                top = min(top, y)
-                bottom = max(bottom, y)
-    if left > right:
-        return None
-    return (left, top, right + 1, bottom + 1)
+# Cancel flag and thread of the parallel run in progress
+cancel_event = threading.Event()
+run_thread = None
 
 # Function to remove the background from an image and crop to content
 def process_image(image_path):
     try:
-        # Open the image
-        with open(image_path, 'rb') as img_file:
-            input_image = img_file.read()
-        
-        # Process image to remove background
-        output_image_bytes = remove(input_image)
-        
-        # Load the output as a PIL Image
-        output_img = Image.open(BytesIO(output_image_bytes))
-        
-        # Ensure it's in RGBA mode for transparency
-        if output_img.mode != 'RGBA':
-            output_img = output_img.convert('RGBA')
-        
-        # Get the tight bounding box ignoring low alpha
-        bbox = get_tight_bbox(output_img)
-        
-        if bbox:
-            # Crop the image to the bounding box
-            cropped_img = output_img.crop(bbox)
-            
-            # Create a white background for JPG
-            white_bg = Image.new("RGB", cropped_img.size, (255, 255, 255))
-            white_bg.paste(cropped_img, mask=cropped_img.split()[3])  # Use alpha as mask
-            
-            # Save the image with the same name, overwriting the original, as JPG
-            output_image_path = os.path.splitext(image_path)[0] + '.jpg'
-            white_bg.save(output_image_path, 'JPEG')
-        else:
-            # If no non-transparent pixels, create an empty white image
-            white_bg = Image.new("RGB", (1, 1), (255, 255, 255))
-            output_image_path = os.path.splitext(image_path)[0] + '.jpg'
-            white_bg.save(output_image_path, 'JPEG')
+        crop_replace_jpg(image_path)
     except Exception as e:
         raise Exception(f"Failed to process {image_path}: {str(e)}")
 
+# Function to remove the background from a batch of images with one inference and crop each
+def process_batch(image_paths, on_result=None):
+    errors = []
+    images = []
+    loaded_paths = []
+    
+    def failed(image_path, e):
+        errors.append(f"Failed to process {image_path}: {str(e)}")
+        if on_result:
+            on_result(image_path, None, e)
+    
+    for image_path in image_paths:
+        try:
+            images.append(load_image(image_path))
+            loaded_paths.append(image_path)
+        except Exception as e:
+            failed(image_path, e)
+    
+    try:
+        masks = segment_images(loaded_paths, images)
+    except Exception as e:
+        for image_path in loaded_paths:
+            failed(image_path, e)
+        return errors
+    
+    for image_path, image, mask in zip(loaded_paths, images, masks):
+        try:
+            # Save the image with the same name, overwriting the original, as JPG
+            output_path = crop_replace_output(image_path)
+            save_cropped_jpg(image, mask, output_path)
+        except Exception as e:
+            failed(image_path, e)
+        else:
+            if on_result:
+                on_result(image_path, output_path, None)
+    return errors
+
 # Function to select source directory and process images
 def select_files():
     # Select source directory
@@ -75,32 +70,126 @@ def select_files():
         return
     
     image_extensions = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff')
-    processed_count = 0
-    
-    # Walk through source directory and subdirectories
-    for root_dir, _, files in os.walk(src_dir):
-        for file_name in files:
-            if file_name.lower().endswith(image_extensions):
-                file_path = os.path.join(root_dir, file_name)
-                try:
-                    process_image(file_path)
-                    processed_count += 1
-                except Exception as e:
-                    messagebox.showerror("Error", str(e))
-    
-    if processed_count > 0:
-        messagebox.showinfo("Success", f"Processed {processed_count} images successfully!")
+    
+    # Walk through source directory and subdirectories, skipping files finished by an earlier run
+    manifest = RunManifest(os.path.join(src_dir, MANIFEST_NAME))
+    scanned = scan_images(src_dir, image_extensions)
+    file_paths = manifest.pending(scanned)
+    if len(file_paths) < len(scanned):
+        print(f"Resuming: {len(scanned) - len(file_paths)} images unchanged since the last run")
+    if scanned and not file_paths:
+        manifest.close()
+        messagebox.showinfo("Up to date", f"All {len(scanned)} images are unchanged since the last run.")
+        return
+    
+    cache_stats.reset()
+    
+    # Overlap reading, inference and writing on threads of this process
+    if PIPELINE_ENABLED:
+        start_background_run(lambda: run_pipeline_with_report(file_paths, manifest), "pipeline", manifest)
+        return
+    
+    # Fan the files out to worker processes, each with its own warm session
+    if DEFAULT_WORKERS > 1 and len(file_paths) > 1:
+        start_background_run(lambda: run_parallel(crop_replace_jpg, file_paths, DEFAULT_WORKERS,
+                                                  cancel_event=cancel_event, on_result=manifest.record_result),
+                             f"{DEFAULT_WORKERS} workers", manifest)
+        return
+    
+    # Load and warm the segmentation model once for the whole run
+    timings.reset()
+    get_session()
+    result = RunResult()
+    
+    def on_result(path, output, error):
+        result.record(path, output, error, manifest.record_result)
+    
+    # Send the images to the model in batches, writing the JPGs on background threads
+    start_writer()
+    for batch in iter_batches(file_paths, DEFAULT_BATCH_SIZE):
+        errors = process_batch(batch, on_result)
+        for error in errors:
+            messagebox.showerror("Error", error)
+    
+    # Wait for every JPG to land before reporting
+    write_failures = stop_writer()
+    result.record_write_failures(write_failures, manifest.record_result)
+    for output_path, error in write_failures:
+        messagebox.showerror("Error", f"Failed to write {output_path}: {error}")
+    manifest.close()
+    print(timings.report())
+    print(f"Mask cache: {cache_stats.summary()}")
+    if result.processed > 0:
+        messagebox.showinfo("Success", f"Processed {result.processed} images successfully!")
     else:
         messagebox.showwarning("Warning", "No valid image files found in the selected directory or its subdirectories.")
 
-# Create the main window
-root = tk.Tk()
-root.title("Image Background Remover")
+# Function to run the staged pipeline and print how busy each stage was
+def run_pipeline_with_report(file_paths, manifest):
+    result, stages = run_pipeline(file_paths, crop_replace_output, save_cropped_jpg, cancel_event=cancel_event,
+                                  on_result=manifest.record_result)
+    print(format_stage_report(stages))
+    return result
 
-# Add a button to select directory
-select_button = tk.Button(root, text="Select Source Directory", command=select_files, padx=20, pady=10)
-select_button.pack(pady=20)
+# Function to run a directory job without blocking the window
+def start_background_run(run_job, description, manifest):
+    global run_thread
+    outcome = {}
+    
+    def run():
+        start_writer()
+        try:
+            result = run_job()
+            # Every output has landed before the run is reported as finished
+            result.record_write_failures(stop_writer(), manifest.record_result)
+            outcome['result'] = result.finish()
+        finally:
+            stop_writer()
+            manifest.close()
+    
+    def check_finished():
+        if run_thread.is_alive():
+            root.after(200, check_finished)
+            return
+        select_button.config(state=tk.NORMAL)
+        cancel_button.config(state=tk.DISABLED)
+        result = outcome['result']
+        print(f"Processed {result.processed} images with {description} in {result.elapsed:.1f} s")
+        print(f"Mask cache: {cache_stats.summary()}")
+        if result.failures:
+            shown = '\n'.join(f"Failed to process {path}: {error}" for path, error in result.failures[:10])
+            messagebox.showerror("Error", f"{len(result.failures)} images failed:\n{shown}")
+        if result.cancelled:
+            messagebox.showwarning("Cancelled", f"Run cancelled after {result.processed} images.")
+        elif result.processed > 0:
+            messagebox.showinfo("Success", f"Processed {result.processed} images successfully!")
+    
+    cancel_event.clear()
+    select_button.config(state=tk.DISABLED)
+    cancel_button.config(state=tk.NORMAL)
+    run_thread = threading.Thread(target=run, daemon=True)
+    run_thread.start()
+    root.after(200, check_finished)
 
-# Run the GUI
-root.geometry("300x150")
-root.mainloop()
\ No newline at end of file
+if __name__ == "__main__":
+    # Create the main window
+    root = tk.Tk()
+    root.title("Image Background Remover")
+    
+    # Add a button to select directory
+    select_button = tk.Button(root, text="Select Source Directory", command=select_files, padx=20, pady=10)
+    select_button.pack(pady=20)
+    
+    # Add a button to stop a parallel run after the files in progress
+    cancel_button = tk.Button(root, text="Cancel", command=cancel_event.set, state=tk.DISABLED, padx=20)
+    cancel_button.pack()
+    
+    # Run the GUI
+    root.geometry("300x180")
+    try:
+        root.mainloop()
+    except KeyboardInterrupt:
+        # Stop handing out files and let the workers finish cleanly
+        cancel_event.set()
+        if run_thread is not None:
+            run_thread.join()
\ No newline at end of file
@@ -1,54 +1,23 @@
 import os
 import tkinter as tk
 from tkinter import filedialog, messagebox
-from PIL import Image
+from image_jobs import resize_thumbnail
+from output_layout import get_layout
+from parallel_runner import RunResult
+from run_manifest import MANIFEST_NAME, RunManifest, scan_images
+from write_behind import start_writer, stop_writer
 
 # Function to process an image and save resized output
-def process_image(image_path, dest_dir):
-    # Get the base filename (without extension)
-    base_name = os.path.basename(os.path.splitext(image_path)[0])
-    
-    # Skip if filename is not numeric or has fewer than 13 digits
-    if not (base_name.isdigit() and len(base_name) >= 13):
-        return
-    
-    # Extract subdirectory names based on filename digits
-    first_level = base_name[:3]  # First 3 digits
-    second_level = base_name[3:8]  # 4th to 8th digits
-    third_level = base_name[-5:]  # Last 5 digits
-    
-    # Create three-level subdirectory structure in destination directory
-    first_dir = os.path.join(dest_dir, first_level)
-    second_dir = os.path.join(first_dir, second_level)
-    third_dir = os.path.join(second_dir, third_level)
-    
-    # Check if subdirectories exist before creating
-    if not os.path.exists(first_dir):
-        os.makedirs(first_dir, exist_ok=True)
-    if not os.path.exists(second_dir):
-        os.makedirs(second_dir, exist_ok=True)
-    if not os.path.exists(third_dir):
-        os.makedirs(third_dir, exist_ok=True)
-    
+def process_image(image_path, dest_dir, on_result=None):
     try:
-        # Open the image
-        with Image.open(image_path) as img:
-            # Ensure it's in RGBA mode for transparency
-            if img.mode != 'RGBA':
-                img = img.convert('RGBA')
-            
-            # Resize to 300x300 for JPG output while maintaining aspect ratio
-            img.thumbnail((300, 300), Image.Resampling.LANCZOS)
-            jpg_bg = Image.new("RGB", (300, 300), (255, 255, 255))
-            offset = ((300 - img.size[0]) // 2, (300 - img.size[1]) // 2)
-            jpg_bg.paste(img, offset, mask=img.split()[3])
-            
-            # Save the resized image in the third-level subdirectory
-            output_image_path = os.path.join(third_dir, f"{base_name}_MAIN_MAIN_THUMB.jpg")
-            jpg_bg.save(output_image_path, 'JPEG')
-    except Exception:
+        output_image_path = resize_thumbnail(image_path, dest_dir)
+    except Exception as e:
         # Skip any errors and continue processing the next file
+        if on_result:
+            on_result(image_path, None, e)
         return
+    if on_result:
+        on_result(image_path, output_image_path, None)
 
 # Function to select source and destination directories, then process images
 def select_files():
@@ -69,13 +38,38 @@ def select_files():
     image_extensions = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff')
     processed_count = 0
     
-    # Walk through source directory and subdirectories
-    for root_dir, _, files in os.walk(src_dir):
-        for file_name in files:
-            if file_name.lower().endswith(image_extensions):
-                file_path = os.path.join(root_dir, file_name)
-                process_image(file_path, dest_dir)
-                processed_count += 1
+    # Walk through source directory and subdirectories, skipping files finished by an earlier run
+    manifest = RunManifest(os.path.join(dest_dir, MANIFEST_NAME))
+    scanned = scan_images(src_dir, image_extensions)
+    file_paths = manifest.pending(scanned)
+    if scanned and not file_paths:
+        manifest.close()
+        messagebox.showinfo("Up to date", f"All {len(scanned)} images are unchanged since the last run.")
+        return
+    
+    # Create every UPC folder the run needs in one pass
+    get_layout(dest_dir).prepare(file_paths)
+    result = RunResult()
+    
+    def on_result(path, output, error):
+        result.record(path, output, error, manifest.record_result)
+    
+    # Write the thumbnails on background threads so resizing never waits on the share
+    start_writer()
+    try:
+        for file_path in file_paths:
+            process_image(file_path, dest_dir, on_result)
+            processed_count += 1
+        # Thumbnails that never landed count as failed so the next run retries them
+        write_failures = stop_writer()
+        result.record_write_failures(write_failures, manifest.record_result)
+    finally:
+        stop_writer()
+        manifest.close()
+    
+    if write_failures:
+        shown = '\n'.join(f"{output_path}: {error}" for output_path, error in write_failures[:10])
+        messagebox.showerror("Error", f"{len(write_failures)} thumbnails could not be written:\n{shown}")
     
     if processed_count > 0:
         messagebox.showinfo("Success", f"Processed {processed_count} images successfully!")
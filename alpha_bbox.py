@@ -0,0 +1,100 @@
+import numpy as np
+
+# Alpha level at or above which a pixel counts as part of the subject
+DEFAULT_THRESHOLD = 10
+
+# Function to get the alpha channel of an image as a 2-D uint8 array
+def alpha_array(img):
+    """Return the alpha channel as a (height, width) uint8 array.
+
+    'L' images are treated as a mask already; images without an alpha band
+    are treated as fully opaque.
+    """
+    if 'A' in img.getbands():
+        return np.asarray(img.getchannel('A'))
+    if img.mode == 'L':
+        return np.asarray(img)
+    width, height = img.size
+    return np.full((height, width), 255, dtype=np.uint8)
+
+class AlphaProfile:
+    """Per-row and per-column maximum alpha of an image.
+
+    The bounding box at any threshold can be read from the two profiles, so
+    trying another threshold does not touch the pixels again.
+    """
+
+    def __init__(self, alpha):
+        alpha = np.asarray(alpha, dtype=np.uint8)
+        self.height, self.width = alpha.shape
+        if alpha.size:
+            self.row_max = alpha.max(axis=1)
+            self.col_max = alpha.max(axis=0)
+        else:
+            self.row_max = np.zeros(self.height, dtype=np.uint8)
+            self.col_max = np.zeros(self.width, dtype=np.uint8)
+
+    @classmethod
+    def from_image(cls, img):
+        return cls(alpha_array(img))
+
+    def bbox(self, threshold=DEFAULT_THRESHOLD):
+        """Return (left, top, right, bottom) of pixels with alpha >= threshold, or None"""
+        rows = np.flatnonzero(self.row_max >= threshold)
+        if rows.size == 0:
+            return None
+        cols = np.flatnonzero(self.col_max >= threshold)
+        return (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+
+# Custom function to get tight bounding box ignoring low alpha pixels
+def get_tight_bbox(img, threshold=DEFAULT_THRESHOLD):
+    """Return (left, top, right, bottom) of pixels with alpha >= threshold, or None.
+
+    Gives the same box as the per-pixel loop the crop scripts used before,
+    kept as benchmark.legacy_get_tight_bbox; the examples run both.
+
+    >>> from PIL import Image
+    >>> from benchmark import legacy_get_tight_bbox
+    >>> def both(alpha, threshold=DEFAULT_THRESHOLD):
+    ...     rgba = np.zeros(alpha.shape + (4,), dtype=np.uint8)
+    ...     rgba[..., 3] = alpha
+    ...     img = Image.fromarray(rgba, 'RGBA')
+    ...     return get_tight_bbox(img, threshold), legacy_get_tight_bbox(img, threshold)
+
+    All transparent, and all opaque:
+
+    >>> both(np.zeros((4, 6), dtype=np.uint8))
+    (None, None)
+    >>> both(np.full((4, 6), 255, dtype=np.uint8))
+    ((0, 0, 6, 4), (0, 0, 6, 4))
+
+    A single pixel, and a single-pixel image:
+
+    >>> alpha = np.zeros((5, 7), dtype=np.uint8)
+    >>> alpha[2, 3] = 200
+    >>> both(alpha)
+    ((3, 2, 4, 3), (3, 2, 4, 3))
+    >>> both(np.full((1, 1), 255, dtype=np.uint8))
+    ((0, 0, 1, 1), (0, 0, 1, 1))
+
+    Pixels touching the edges of the frame:
+
+    >>> alpha = np.zeros((5, 7), dtype=np.uint8)
+    >>> alpha[0, 6] = alpha[4, 0] = 255
+    >>> both(alpha)
+    ((0, 0, 7, 5), (0, 0, 7, 5))
+
+    Alpha exactly at the threshold counts, one below does not:
+
+    >>> alpha = np.zeros((5, 7), dtype=np.uint8)
+    >>> alpha[1, 1], alpha[3, 5] = 10, 9
+    >>> both(alpha)
+    ((1, 1, 2, 2), (1, 1, 2, 2))
+    >>> both(alpha, threshold=9)
+    ((1, 1, 6, 4), (1, 1, 6, 4))
+    >>> both(alpha, threshold=11)
+    (None, None)
+    >>> both(alpha, threshold=0)
+    ((0, 0, 7, 5), (0, 0, 7, 5))
+    """
+    return AlphaProfile.from_image(img).bbox(threshold)
@@ -0,0 +1,78 @@
+import csv
+import os
+import sqlite3
+import threading
+import time
+
+# Set BG_REMOVER_BARCODE_INDEX=0 to decode every image on every run
+INDEX_ENABLED = os.environ.get('BG_REMOVER_BARCODE_INDEX', '1') != '0'
+INDEX_PATH = os.environ.get('BG_REMOVER_BARCODE_INDEX_PATH',
+                            os.path.join(os.path.expanduser('~'), '.cache', 'bg_remover', 'barcodes.sqlite3'))
+
+# Bump when detection improves, so images where no code was found are scanned again
+DETECTION_VERSION = '1'
+
+CSV_COLUMNS = ['digest', 'ean13', 'raw', 'symbology', 'stage', 'path', 'scanned', 'version']
+
+class BarcodeIndex:
+    """Barcode decode results keyed by the SHA-256 of the image file.
+
+    Keying by content means a result survives the rename it leads to. Images
+    where no code was found are stored too, with an empty ean13, and are
+    only trusted while DETECTION_VERSION is unchanged.
+    """
+
+    def __init__(self, index_path=INDEX_PATH):
+        self.index_path = index_path
+        os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(index_path, timeout=30, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS barcodes (digest TEXT PRIMARY KEY, ean13 TEXT, raw TEXT, "
+                         "symbology TEXT, stage TEXT, path TEXT, scanned REAL, version TEXT)")
+        self._db.commit()
+
+    def get(self, digest):
+        """Return (ean13, raw, symbology, stage) for a known image, ean13 None if it has no code, else None"""
+        with self._lock:
+            row = self._db.execute("SELECT ean13, raw, symbology, stage, version FROM barcodes WHERE digest = ?",
+                                   (digest,)).fetchone()
+            if row is None or (row[0] is None and row[4] != DETECTION_VERSION):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[:4]
+
+    def put(self, digest, path, ean13=None, raw=None, symbology=None, stage='none'):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO barcodes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             (digest, ean13, raw, symbology, stage, os.path.abspath(path), time.time(),
+                              DETECTION_VERSION))
+            self._db.commit()
+
+    def export_csv(self, out_file):
+        """Write every row to an open text file; returns the number of rows"""
+        writer = csv.writer(out_file)
+        writer.writerow(CSV_COLUMNS)
+        count = 0
+        with self._lock:
+            for row in self._db.execute(f"SELECT {', '.join(CSV_COLUMNS)} FROM barcodes ORDER BY path"):
+                writer.writerow(row)
+                count += 1
+        return count
+
+    def usage(self):
+        with self._lock:
+            total, found = self._db.execute("SELECT COUNT(*), COUNT(ean13) FROM barcodes").fetchone()
+        return {'images': total, 'with_code': found, 'hits': self.hits, 'misses': self.misses}
+
+# Index shared by the threads of this process
+_index = None
+
+# Function to get the process-wide index, or None when it is turned off
+def get_index():
+    global _index
+    if _index is None and INDEX_ENABLED:
+        _index = BarcodeIndex()
+    return _index
@@ -0,0 +1,72 @@
+import os
+import time
+import numpy as np
+from PIL import Image, ImageOps
+from rembg_session import base_model, get_session, resolve_model_name, timings
+
+# Preprocessing used by each rembg model: (mean, std, model input size)
+MODEL_INPUTS = {
+    'u2net': ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    'u2netp': ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    'silueta': ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    'isnet-general-use': ((0.485, 0.456, 0.406), (1.0, 1.0, 1.0), (1024, 1024)),
+}
+
+# Images sent to the model per inference; set BG_REMOVER_BATCH_SIZE to change it
+DEFAULT_BATCH_SIZE = int(os.environ.get('BG_REMOVER_BATCH_SIZE', '4'))
+
+# Function to open an image file the same way rembg does (EXIF orientation applied)
+def load_image(image_path):
+    with Image.open(image_path) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGB')
+        img.load()
+    return img
+
+# Function to split a list into consecutive batches
+def iter_batches(items, batch_size=DEFAULT_BATCH_SIZE):
+    batch_size = max(1, batch_size)
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+# Function to check whether the model accepts more than one image per run
+def supports_batching(session):
+    batch_dim = session.inner_session.get_inputs()[0].shape[0]
+    return not (isinstance(batch_dim, int) and batch_dim == 1)
+
+# Function to turn one raw model output into a mask at the image's own resolution
+def _to_mask(pred, size):
+    ma = np.max(pred)
+    mi = np.min(pred)
+    pred = (pred - mi) / (ma - mi) if ma > mi else np.zeros_like(pred)
+    mask = Image.fromarray((pred * 255).astype('uint8'), mode='L')
+    return mask.resize(size, Image.Resampling.LANCZOS)
+
+# Function to segment several decoded images with a single model inference
+def segment_batch(images, model_name=None, providers=None):
+    """Return one 'L' alpha mask per image, each at that image's original size"""
+    if not images:
+        return []
+    name = resolve_model_name(model_name)
+    # Local models are preprocessed like the built-in model they were exported from
+    if base_model(name) not in MODEL_INPUTS:
+        raise ValueError(f"Batched inference is not supported for model '{name}'")
+    mean, std, size = MODEL_INPUTS[base_model(name)]
+    session = get_session(name, providers)
+    input_name = session.inner_session.get_inputs()[0].name
+
+    start = time.perf_counter()
+    tensors = [session.normalize(img, mean, std, size)[input_name] for img in images]
+    if supports_batching(session):
+        chunks = [np.concatenate(tensors, axis=0)]
+    else:
+        # Model was exported with a fixed batch of 1; keep the shared preprocessing
+        chunks = tensors
+    preds = []
+    for chunk in chunks:
+        ort_outs = session.inner_session.run(None, {input_name: chunk})
+        preds.extend(ort_outs[0][:, 0, :, :])
+    masks = [_to_mask(pred, img.size) for pred, img in zip(preds, images)]
+    timings.add_inference(time.perf_counter() - start, count=len(images))
+    return masks
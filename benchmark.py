@@ -0,0 +1,639 @@
+import argparse
+import os
+import random
+import time
+from io import BytesIO
+import numpy as np
+from PIL import Image
+from alpha_bbox import AlphaProfile, get_tight_bbox
+
+# Previous per-pixel implementation, kept here as the reference for comparisons
+def legacy_get_tight_bbox(img, threshold=10):
+    data = list(img.getdata())
+    width, height = img.size
+    left = width
+    top = height
+    right = 0
+    bottom = 0
+    for y in range(height):
+        for x in range(width):
+            a = data[y * width + x][3]
+            if a >= threshold:
+                left = min(left, x)
+                right = max(right, x)
+                top = min(top, y)
+                bottom = max(bottom, y)
+    if left > right:
+        return None
+    return (left, top, right + 1, bottom + 1)
+
+# Function to build an RGBA frame with a soft-edged subject and faint background noise
+def make_cutout_frame(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    alpha = rng.integers(0, 10, size=(height, width), dtype=np.uint8)
+    top, left = height // 5, width // 4
+    bottom, right = height - height // 6, width - width // 3
+    alpha[top:bottom, left:right] = 255
+    alpha[top - 2:top, left:right] = 40  # Feathered edge above the subject
+    rgba = np.zeros((height, width, 4), dtype=np.uint8)
+    rgba[..., :3] = 128
+    rgba[..., 3] = alpha
+    return Image.fromarray(rgba, 'RGBA')
+
+# Function to time a callable and return (result, seconds)
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def bench_bbox(args):
+    # Check the vectorized bbox against the legacy loop on small random frames
+    rng = random.Random(args.seed)
+    for _ in range(args.checks):
+        width, height = rng.randint(1, 64), rng.randint(1, 64)
+        alpha = np.zeros((height, width), dtype=np.uint8)
+        for _ in range(rng.randint(0, 6)):
+            alpha[rng.randrange(height), rng.randrange(width)] = rng.randint(0, 255)
+        rgba = np.zeros((height, width, 4), dtype=np.uint8)
+        rgba[..., 3] = alpha
+        img = Image.fromarray(rgba, 'RGBA')
+        threshold = rng.choice([0, 1, 10, 128, 255])
+        expected = legacy_get_tight_bbox(img, threshold)
+        actual = get_tight_bbox(img, threshold)
+        if expected != actual:
+            raise SystemExit(f"Mismatch on {width}x{height} at threshold {threshold}: "
+                             f"legacy {expected}, vectorized {actual}")
+    print(f"bbox: {args.checks} random frames match the legacy implementation")
+
+    img = make_cutout_frame(args.width, args.height, args.seed)
+    print(f"bbox: full-size frame {args.width}x{args.height}")
+    for _ in range(args.repeat):
+        profile, t_profile = timed(AlphaProfile.from_image, img)
+        bbox, t_bbox = timed(profile.bbox, 10)
+        _, t_rethreshold = timed(profile.bbox, 128)
+        print(f"  vectorized: profile {t_profile * 1000:.1f} ms, bbox {t_bbox * 1000:.3f} ms, "
+              f"re-threshold {t_rethreshold * 1000:.3f} ms -> {bbox}")
+    if args.legacy:
+        legacy_bbox, t_legacy = timed(legacy_get_tight_bbox, img, 10)
+        print(f"  legacy: {t_legacy:.1f} s -> {legacy_bbox}")
+        if legacy_bbox != bbox:
+            raise SystemExit("Full-size frame bbox differs from the legacy implementation")
+
+# Function to list image files in a directory for the throughput benchmarks
+def list_images(image_dir, limit=None):
+    image_extensions = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff')
+    paths = sorted(os.path.join(image_dir, f) for f in os.listdir(image_dir)
+                   if f.lower().endswith(image_extensions))
+    return paths[:limit] if limit else paths
+
+def bench_segment(args):
+    from batch_segment import iter_batches, load_image, segment_batch
+    from rembg_session import get_session, remove_background
+
+    paths = list_images(args.image_dir, args.limit)
+    if not paths:
+        raise SystemExit(f"No images found in {args.image_dir}")
+    get_session(args.model)
+    print(f"segment: {len(paths)} images, model {args.model}")
+
+    # Current path: raw bytes in, PNG bytes out, one image per inference
+    start = time.perf_counter()
+    for path in paths:
+        with open(path, 'rb') as img_file:
+            remove_background(img_file.read(), model_name=args.model)
+    per_image = time.perf_counter() - start
+    print(f"  per-image: {len(paths) / per_image:.2f} images/sec")
+
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        for batch in iter_batches(paths, batch_size):
+            segment_batch([load_image(path) for path in batch], model_name=args.model)
+        batched = time.perf_counter() - start
+        print(f"  batched ({batch_size}): {len(paths) / batched:.2f} images/sec "
+              f"({per_image / batched:.2f}x)")
+
+def bench_composite(args):
+    from image_jobs import composite_on_white
+
+    frame = make_cutout_frame(args.width, args.height, args.seed)
+    mask = frame.getchannel('A')
+    rng = np.random.default_rng(args.seed)
+    image = Image.fromarray(rng.integers(0, 255, size=(args.height, args.width, 3), dtype=np.uint8), 'RGB')
+    print(f"composite: {args.width}x{args.height}, mean of {args.repeat} runs")
+
+    def previous_path():
+        # rembg.remove on bytes: cut out, encode PNG, then decode it again for the crop
+        cutout = Image.composite(image.convert('RGBA'), Image.new('RGBA', image.size, 0), mask)
+        buffer = BytesIO()
+        cutout.save(buffer, 'PNG')
+        output_img = Image.open(BytesIO(buffer.getvalue())).convert('RGBA')
+        bbox = get_tight_bbox(output_img)
+        cropped_img = output_img.crop(bbox)
+        white_bg = Image.new("RGB", cropped_img.size, (255, 255, 255))
+        white_bg.paste(cropped_img, mask=cropped_img.split()[3])
+        return white_bg
+
+    def in_memory_path():
+        return composite_on_white(image, mask)
+
+    results = {}
+    for name, func in (("PNG round trip", previous_path), ("in memory", in_memory_path)):
+        total = 0.0
+        for _ in range(args.repeat):
+            results[name], seconds = timed(func)
+            total += seconds
+        print(f"  {name}: {total / args.repeat * 1000:.0f} ms/image")
+    old, new = results.values()
+    diff = np.abs(np.asarray(old, dtype=np.int16) - np.asarray(new, dtype=np.int16)).max()
+    print(f"  max pixel difference between the two outputs: {diff}")
+
+def bench_derivatives(args):
+    from derivatives import MAIN_THUMB, parse_specs, render_derivatives
+
+    frame = make_cutout_frame(args.width, args.height, args.seed)
+    mask = frame.getchannel('A')
+    rng = np.random.default_rng(args.seed)
+    image = Image.fromarray(rng.integers(0, 255, size=(args.height, args.width, 3), dtype=np.uint8), 'RGB')
+    specs = parse_specs(args.specs)
+    print(f"derivatives: {args.width}x{args.height}, {len(specs)} sizes, mean of {args.repeat} runs")
+
+    def each_from_full():
+        # What re-running a script per size amounts to, minus the decode and inference
+        return [render_derivatives(image, mask, [spec])[0] for spec in specs]
+
+    runs = (("one thumbnail", lambda: render_derivatives(image, mask, [MAIN_THUMB])),
+            ("each size from the full crop", each_from_full),
+            ("cascaded single pass", lambda: render_derivatives(image, mask, specs)))
+    for name, func in runs:
+        total = 0.0
+        for _ in range(args.repeat):
+            _, seconds = timed(func)
+            total += seconds
+        print(f"  {name}: {total / args.repeat * 1000:.0f} ms/image")
+
+def bench_thumb(args):
+    from image_jobs import make_centered_thumbnail, open_for_thumbnail
+
+    paths = list_images(args.image_dir, args.limit)
+    if not paths:
+        raise SystemExit(f"No images found in {args.image_dir}")
+
+    def full_decode(path):
+        # The previous resize-only path: full decode, RGBA for every source, then resize
+        with Image.open(path) as img:
+            return make_centered_thumbnail(img.convert('RGBA'))
+
+    def reduced_decode(path):
+        return make_centered_thumbnail(open_for_thumbnail(path))
+
+    print(f"thumb: {len(paths)} images from {args.image_dir}")
+    outputs = {}
+    for name, func in (("full decode", full_decode), ("reduced-scale decode", reduced_decode)):
+        start = time.perf_counter()
+        outputs[name] = [func(path) for path in paths]
+        seconds = time.perf_counter() - start
+        print(f"  {name}: {seconds / len(paths) * 1000:.1f} ms/image")
+
+    # Quality check: PSNR of the new thumbnails against the full-decode ones
+    psnrs = []
+    for old, new in zip(*outputs.values()):
+        diff = np.asarray(old, dtype=np.float64) - np.asarray(new, dtype=np.float64)
+        mse = np.mean(diff ** 2)
+        psnrs.append(float('inf') if mse == 0 else 10 * np.log10(255 ** 2 / mse))
+    print(f"  PSNR vs full decode: min {min(psnrs):.1f} dB, median {np.median(psnrs):.1f} dB")
+    if min(psnrs) < args.min_psnr:
+        raise SystemExit(f"Thumbnail quality regressed below {args.min_psnr} dB")
+
+def bench_barcode(args):
+    from pyzbar.pyzbar import decode
+    import upc_barcode
+
+    paths = list_images(args.image_dir, args.limit)
+    if not paths:
+        raise SystemExit(f"No images found in {args.image_dir}")
+
+    def numeric(result):
+        data = result.data.decode('utf-8')
+        return data if result.type != 'QRCODE' and data.isdigit() else None
+
+    def single_full_res(path):
+        # The previous detection: one decode of the full-resolution RGB image
+        with Image.open(path) as img:
+            for result in decode(img):
+                code = numeric(result)
+                if code:
+                    return code
+        return None
+
+    def multi_scale_all_symbols(path):
+        return upc_barcode.find_barcode(path, numeric, symbols=None)[0]
+
+    def multi_scale(path):
+        return upc_barcode.find_barcode(path, numeric)[0]
+
+    print(f"barcode: {len(paths)} images from {args.image_dir}")
+    upc_barcode.stage_counts.clear()
+    found = {}
+    runs = (("single full-res decode", single_full_res), ("multi-scale, all symbologies", multi_scale_all_symbols),
+            ("multi-scale, retail symbologies", multi_scale))
+    for name, func in runs:
+        latencies = []
+        found[name] = []
+        for path in paths:
+            code, seconds = timed(func, path)
+            latencies.append(seconds * 1000)
+            found[name].append(code)
+        print(f"  {name}: median {np.median(latencies):.0f} ms, p95 {np.percentile(latencies, 95):.0f} ms, "
+              f"found {sum(code is not None for code in found[name])}/{len(paths)}")
+    print(f"  multi-scale stages (both runs): {dict(upc_barcode.stage_counts)}")
+    old, new = found["single full-res decode"], found["multi-scale, retail symbologies"]
+    disagree = [path for path, a, b in zip(paths, old, new) if a is not None and b is not None and a != b]
+    for path in disagree:
+        print(f"  different code in {path}")
+
+def bench_rename_scan(args):
+    import barcode_index
+    import rename_planner
+
+    # Decode every image on both runs; worker processes see the environment, this one the flag
+    os.environ['BG_REMOVER_BARCODE_INDEX'] = '0'
+    barcode_index.INDEX_ENABLED = False
+
+    folders = rename_planner.collect_folders(args.image_dir, args.recursive)
+    paths = [os.path.join(root, filename) for root, image_files in folders for filename in image_files]
+    if not paths:
+        raise SystemExit(f"No images found in {args.image_dir}")
+
+    print(f"rename-scan: {len(paths)} images from {args.image_dir}")
+    plans = {}
+    for name, workers in (("serial", 1), (f"{args.workers} processes", args.workers)):
+        barcodes, seconds = timed(rename_planner.scan_barcodes, paths, workers)
+        plans[name] = rename_planner.plan_renames(folders, barcodes, args.image_dir, args.recursive)
+        print(f"  {name}: {seconds:.2f}s, {len(paths) / seconds:.1f} images/s, "
+              f"found {sum(barcode is not None for barcode in barcodes.values())}/{len(paths)}")
+    serial, parallel = plans.values()
+    if serial != parallel:
+        raise SystemExit("  rename plans differ between serial and parallel scans")
+    print(f"  identical plans: {len(serial[0])} actions")
+
+def bench_storefront(args):
+    import shutil
+    import tempfile
+    import barcode_index
+    import mask_cache
+    from image_jobs import crop_replace_jpg, resize_thumbnail
+    from rename_planner import rename_by_barcode
+    from run_manifest import scan_images
+    from storefront import run_storefront
+    from write_behind import start_writer, stop_writer
+
+    # Both runs decode and segment every image
+    os.environ['BG_REMOVER_BARCODE_INDEX'] = '0'
+    os.environ['BG_REMOVER_CACHE'] = '0'
+    barcode_index.INDEX_ENABLED = False
+    mask_cache.CACHE_ENABLED = False
+    extensions = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff')
+
+    def listing(root):
+        return sorted(os.path.relpath(os.path.join(folder, name), root)
+                      for folder, _, names in os.walk(root) for name in names if not name.startswith('.'))
+
+    work_dir = tempfile.mkdtemp(prefix="storefront_bench_")
+    try:
+        chain_src, fused_src = os.path.join(work_dir, "chain"), os.path.join(work_dir, "fused")
+        chain_dest, fused_dest = os.path.join(work_dir, "chain_out"), os.path.join(work_dir, "fused_out")
+        shutil.copytree(args.image_dir, chain_src)
+        shutil.copytree(args.image_dir, fused_src)
+        print(f"storefront: {len(scan_images(chain_src, extensions))} images from {args.image_dir}")
+
+        # The three tools one after the other, as an operator runs them today
+        _, rename_seconds = timed(rename_by_barcode, chain_src, True, legacy=True)
+        start_writer()
+        _, crop_seconds = timed(lambda: [crop_replace_jpg(path) for path, _, _ in scan_images(chain_src, extensions)])
+        stop_writer()
+        start_writer()
+        _, thumb_seconds = timed(lambda: [resize_thumbnail(path, chain_dest)
+                                          for path, _, _ in scan_images(chain_src, extensions)])
+        stop_writer()
+        chain_seconds = rename_seconds + crop_seconds + thumb_seconds
+        print(f"  rename, crop, thumbnail: {chain_seconds:.1f}s (rename {rename_seconds:.1f}s, "
+              f"crop {crop_seconds:.1f}s, thumbnail {thumb_seconds:.1f}s)")
+
+        (result, _, summary), fused_seconds = timed(run_storefront, fused_src, fused_dest)
+        steps = ', '.join(f"{name} {seconds:.1f}s" for name, seconds in summary['steps'].items())
+        print(f"  storefront: {fused_seconds:.1f}s ({steps}), {chain_seconds / fused_seconds:.2f}x")
+
+        for name, chain_root, fused_root in (("source folder", chain_src, fused_src),
+                                             ("UPC tree", chain_dest, fused_dest)):
+            chain_files, fused_files = listing(chain_root), listing(fused_root)
+            if chain_files != fused_files:
+                print(f"  {name} differs: only after the chain {sorted(set(chain_files) - set(fused_files))}, "
+                      f"only after storefront {sorted(set(fused_files) - set(chain_files))}")
+            else:
+                print(f"  {name}: same {len(chain_files)} files")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def bench_ocr(args):
+    import tempfile
+    import ocr_cache
+    import ocr_engine
+    from text_extract import infer_product_name_from_text
+
+    # Leave out boxed_ copies written by earlier OCR runs
+    paths = [path for path in list_images(args.image_dir) if not os.path.basename(path).startswith("boxed_")]
+    paths = paths[:args.limit] if args.limit else paths
+    if not paths:
+        raise SystemExit(f"No images found in {args.image_dir}")
+
+    def run(name, workers, settings, boxes):
+        # Load the engine outside the clock, as a long run would amortise it
+        if workers == 1:
+            ocr_engine.get_engine(settings)
+        results, seconds = timed(ocr_engine.run_ocr, paths, workers, settings, boxes)
+        for result in results:
+            if result.get('boxed'):
+                os.remove(result['boxed'])
+        report = ocr_engine.ocr_report(results)
+        print(f"  {name}: {seconds:.1f}s, {len(paths) / seconds:.2f} images/s, "
+              f"failed {sum('error' in result for result in results)}, cache hit rate {report['cache_hit_rate']:.0%}")
+        return [result.get('text') or '' for result in results]
+
+    print(f"ocr: {len(paths)} images from {args.image_dir}")
+    # Every image is OCR'd in the mode comparisons; workers see the environment, this process the flag
+    os.environ['BG_REMOVER_OCR_CACHE'] = '0'
+    ocr_cache.OCR_CACHE_ENABLED = False
+    full = ocr_engine.DEFAULT_SETTINGS._replace(angle_cls=True, fast=False)
+    lean = full._replace(angle_cls=False)
+    fast = lean._replace(fast=True)
+    baseline = run("full, classifier and boxed copies", 1, full, True)
+    run("full, no classifier or boxed copies", 1, lean, False)
+    run(f"full, {args.workers} processes", args.workers, lean, False)
+    fast_texts = run("fast", 1, fast, False)
+    fast_pool_texts = run(f"fast, {args.workers} processes", args.workers, fast, False)
+    if fast_pool_texts != fast_texts:
+        print("  fast mode read different text on the pool")
+    print(f"  product name, full: {infer_product_name_from_text(baseline)!r}")
+    print(f"  product name, fast: {infer_product_name_from_text(fast_texts)!r}")
+
+    # A second pass over the same images is answered from the cache
+    with tempfile.TemporaryDirectory() as cache_dir:
+        os.environ['BG_REMOVER_OCR_CACHE'] = '1'
+        ocr_cache.OCR_CACHE_ENABLED = True
+        ocr_cache._cache = ocr_cache.OcrCache(os.path.join(cache_dir, "ocr.sqlite3"))
+        run("fast, filling the cache", 1, fast, False)
+        run("fast, from the cache", 1, fast, False)
+        ocr_cache._cache._db.close()
+        ocr_cache._cache = None
+
+# Previous edge recovery from the GPU tool: decode rembg's PNG, Canny and dilate the full frame, encode again
+def legacy_recover_edges(img_data, debug_dir):
+    import cv2
+    img = cv2.imdecode(np.frombuffer(img_data, np.uint8), cv2.IMREAD_UNCHANGED)
+    b, g, r, a = cv2.split(img)
+    gray = cv2.cvtColor(cv2.merge((r, g, b)), cv2.COLOR_RGB2GRAY)
+    edges_dilated = cv2.dilate(cv2.Canny(gray, 30, 100), np.ones((5, 5), np.uint8), iterations=2)
+    result = cv2.merge((b, g, r, cv2.bitwise_or(a, edges_dilated)))
+    _, encoded_img = cv2.imencode('.png', result, [cv2.IMWRITE_PNG_COMPRESSION, 0])
+    with open(os.path.join(debug_dir, "debug_recovered.png"), "wb") as debug_file:
+        debug_file.write(encoded_img.tobytes())
+    return encoded_img.tobytes()
+
+def bench_edges(args):
+    import tempfile
+    from edge_recovery import premultiplied_cutout, recover_edges, recover_mask, stats
+    from write_behind import encode_image
+
+    rng = np.random.default_rng(args.seed)
+    image = Image.fromarray(rng.integers(0, 255, size=(args.height, args.width, 3), dtype=np.uint8), 'RGB')
+    noisy = make_cutout_frame(args.width, args.height, args.seed).getchannel('A')
+    # The same mask with the faint background rembg often leaves cleared to zero
+    clean = noisy.point(lambda value: 0 if value < 10 else value)
+    print(f"edges: {args.width}x{args.height} ({args.width * args.height / 1e6:.0f} MP), mean of {args.repeat} runs")
+
+    with tempfile.TemporaryDirectory() as debug_dir:
+        for mask_name, mask in (("noisy background", noisy), ("clean background", clean)):
+            cutout_png = encode_image(premultiplied_cutout(image, mask), 'PNG')
+
+            def previous_path():
+                # What the GPU tool did per image after rembg: three debug writes and a PNG round trip
+                for name, data in (("debug_input.png", cutout_png), ("debug_rembg_output.png", cutout_png)):
+                    with open(os.path.join(debug_dir, name), "wb") as debug_file:
+                        debug_file.write(data)
+                decoded = Image.open(BytesIO(legacy_recover_edges(cutout_png, debug_dir)))
+                return decoded.getchannel('A')
+
+            def band_limited():
+                return recover_mask("frame.png", image, mask, debug_dir=None)
+
+            def band_limited_with_output():
+                output = premultiplied_cutout(image, mask)
+                output.putalpha(recover_edges(image, mask))
+                encode_image(output, 'PNG', compress_level=0)
+                return output.getchannel('A')
+
+            print(f"  {mask_name}:")
+            results = {}
+            stats.reset()
+            for name, func in (("full frame, PNG round trip, debug files", previous_path),
+                               ("band-limited on arrays", band_limited),
+                               ("band-limited + compose + uncompressed PNG", band_limited_with_output)):
+                total = 0.0
+                for _ in range(args.repeat):
+                    results[name], seconds = timed(func)
+                    total += seconds
+                print(f"    {name}: {total / args.repeat * 1000:.0f} ms/image")
+            print(f"    tiles computed: {stats.summary()['band_fraction']:.1%} of the frame")
+            old, new = (np.asarray(alpha) for alpha in list(results.values())[:2])
+            print(f"    alpha pixels differing from the full-frame result: {np.count_nonzero(old != new) / old.size:.4%}")
+
+# Function to get this process's peak resident memory in MB
+def peak_rss_mb():
+    if os.name == 'nt':
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        get_current_process = ctypes.windll.kernel32.GetCurrentProcess
+        get_current_process.restype = wintypes.HANDLE
+        get_memory_info = ctypes.windll.psapi.GetProcessMemoryInfo
+        get_memory_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(ProcessMemoryCounters), wintypes.DWORD]
+        get_memory_info(get_current_process(), ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize / 2**20
+    import resource
+    import sys
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 1024
+
+# Function to segment the sample images with one model, run in a fresh process; masks are saved as <index>.png
+def _measure_model(model_name, paths, batch_size, mask_dir):
+    from batch_segment import iter_batches, load_image, segment_batch
+    from rembg_session import get_session
+    images = [load_image(path) for path in paths]
+    get_session(model_name)
+    masks = []
+    start = time.perf_counter()
+    for batch in iter_batches(images, batch_size):
+        masks.extend(segment_batch(batch, model_name))
+    seconds = time.perf_counter() - start
+    for index, mask in enumerate(masks):
+        mask.save(os.path.join(mask_dir, f"{index}.png"))
+    return len(images) / seconds, peak_rss_mb()
+
+# Function to compare two masks as foreground sets (alpha >= 128), scaled to fit size x size when given
+def mask_iou(mask, reference, size=None):
+    if reference.size != mask.size:
+        reference = reference.resize(mask.size, Image.Resampling.NEAREST)
+    if size and max(mask.size) > size:
+        scale = size / max(mask.size)
+        fit = (max(1, round(mask.size[0] * scale)), max(1, round(mask.size[1] * scale)))
+        mask, reference = mask.resize(fit, Image.Resampling.BOX), reference.resize(fit, Image.Resampling.BOX)
+    foreground, expected = np.asarray(mask) >= 128, np.asarray(reference) >= 128
+    union = np.count_nonzero(foreground | expected)
+    return np.count_nonzero(foreground & expected) / union if union else 1.0
+
+def bench_models(args):
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+    from rembg_session import get_local_models
+
+    paths = list_images(args.image_dir, args.limit)
+    if not paths:
+        raise SystemExit(f"No images found in {args.image_dir}")
+    models = args.models or sorted(get_local_models())
+    models = [args.reference] + [model for model in models if model != args.reference]
+    size_note = f", compared at {args.iou_size}px" if args.iou_size else ""
+    print(f"models: {len(paths)} images from {args.image_dir}, IoU against {args.reference}{size_note}")
+
+    labels = {}
+    if args.labels:
+        # Hand-made masks named like the images they belong to
+        for index, path in enumerate(paths):
+            label_path = os.path.join(args.labels, os.path.splitext(os.path.basename(path))[0] + '.png')
+            if os.path.exists(label_path):
+                labels[index] = Image.open(label_path).convert('L')
+
+    with tempfile.TemporaryDirectory() as mask_root:
+        measured = {}
+        for model in models:
+            mask_dir = os.path.join(mask_root, model)
+            os.makedirs(mask_dir)
+            # A fresh process per model so each peak memory figure is that model's alone
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                measured[model] = executor.submit(_measure_model, model, paths, args.batch_size, mask_dir).result()
+
+        def load_masks(model):
+            return [Image.open(os.path.join(mask_root, model, f"{index}.png")) for index in range(len(paths))]
+
+        reference = load_masks(args.reference)
+        reference_rate = measured[args.reference][0]
+        for model in models:
+            masks = load_masks(model)
+            images_per_sec, peak = measured[model]
+            ious = [mask_iou(mask, expected, args.iou_size) for mask, expected in zip(masks, reference)]
+            line = (f"  {model}: {images_per_sec:.2f} images/s ({images_per_sec / reference_rate:.1f}x), "
+                    f"peak RSS {peak:.0f} MB, IoU mean {np.mean(ious):.4f} min {min(ious):.4f}")
+            if labels:
+                label_ious = [mask_iou(masks[index], label, args.iou_size) for index, label in labels.items()]
+                line += f", IoU vs {len(labels)} labels mean {np.mean(label_ious):.4f}"
+            print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the background-removal tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    bbox_parser = subparsers.add_parser("bbox", help="Alpha bounding box on full-size frames")
+    bbox_parser.add_argument("--width", type=int, default=6000)
+    bbox_parser.add_argument("--height", type=int, default=4000)
+    bbox_parser.add_argument("--repeat", type=int, default=3)
+    bbox_parser.add_argument("--checks", type=int, default=500)
+    bbox_parser.add_argument("--seed", type=int, default=0)
+    bbox_parser.add_argument("--legacy", action="store_true",
+                             help="Also time the old per-pixel loop (slow on full-size frames)")
+    bbox_parser.set_defaults(func=bench_bbox)
+
+    segment_parser = subparsers.add_parser("segment", help="Per-image vs batched segmentation throughput")
+    segment_parser.add_argument("image_dir")
+    segment_parser.add_argument("--model", default="u2net")
+    segment_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[2, 4, 8])
+    segment_parser.add_argument("--limit", type=int)
+    segment_parser.set_defaults(func=bench_segment)
+
+    composite_parser = subparsers.add_parser("composite",
+                                             help="PNG round trip vs in-memory mask compositing")
+    composite_parser.add_argument("--width", type=int, default=6000)
+    composite_parser.add_argument("--height", type=int, default=4000)
+    composite_parser.add_argument("--repeat", type=int, default=3)
+    composite_parser.add_argument("--seed", type=int, default=0)
+    composite_parser.set_defaults(func=bench_composite)
+
+    derivatives_parser = subparsers.add_parser("derivatives",
+                                               help="Several output sizes per cutout, cascaded vs each from full size")
+    derivatives_parser.add_argument("--width", type=int, default=6000)
+    derivatives_parser.add_argument("--height", type=int, default=4000)
+    derivatives_parser.add_argument("--repeat", type=int, default=3)
+    derivatives_parser.add_argument("--seed", type=int, default=0)
+    derivatives_parser.add_argument("--specs", default="_ZOOM:2000:40;_LISTING:1000:20;_MEDIUM:600:10;"
+                                                       "_MAIN_MAIN_THUMB:300;_SWATCH:80")
+    derivatives_parser.set_defaults(func=bench_derivatives)
+
+    thumb_parser = subparsers.add_parser("thumb", help="Resize-only thumbnails, full vs reduced-scale JPEG decode")
+    thumb_parser.add_argument("image_dir")
+    thumb_parser.add_argument("--limit", type=int)
+    thumb_parser.add_argument("--min-psnr", type=float, default=35.0,
+                              help="Fail if any thumbnail is further than this from the full-decode one")
+    thumb_parser.set_defaults(func=bench_thumb)
+
+    barcode_parser = subparsers.add_parser("barcode", help="Single full-res barcode decode vs multi-scale passes and restricted symbologies")
+    barcode_parser.add_argument("image_dir")
+    barcode_parser.add_argument("--limit", type=int)
+    barcode_parser.set_defaults(func=bench_barcode)
+
+    rename_parser = subparsers.add_parser("rename-scan", help="Serial vs process-pool barcode scan for the UPC rename, with plan check")
+    rename_parser.add_argument("image_dir")
+    rename_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    rename_parser.add_argument("--recursive", action="store_true")
+    rename_parser.set_defaults(func=bench_rename_scan)
+
+    storefront_parser = subparsers.add_parser("storefront", help="Rename, crop and thumbnail tools in turn vs the fused storefront run, on copies of a folder")
+    storefront_parser.add_argument("image_dir")
+    storefront_parser.set_defaults(func=bench_storefront)
+
+    ocr_parser = subparsers.add_parser("ocr", help="OCR with and without the direction classifier and boxed copies, serial vs process pool")
+    ocr_parser.add_argument("image_dir")
+    ocr_parser.add_argument("--limit", type=int)
+    ocr_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ocr_parser.set_defaults(func=bench_ocr)
+
+    edges_parser = subparsers.add_parser("edges", help="Full-frame edge recovery with PNG round trip vs band-limited recovery on arrays")
+    edges_parser.add_argument("--width", type=int, default=6000)
+    edges_parser.add_argument("--height", type=int, default=4000)
+    edges_parser.add_argument("--repeat", type=int, default=3)
+    edges_parser.add_argument("--seed", type=int, default=0)
+    edges_parser.set_defaults(func=bench_edges)
+
+    models_parser = subparsers.add_parser("models", help="Images/sec, peak RSS and mask IoU of local model variants against a reference model")
+    models_parser.add_argument("image_dir")
+    models_parser.add_argument("--model", dest="models", action="append",
+                               help="Model to compare; repeat for several (default: every model in BG_REMOVER_MODEL_DIR)")
+    models_parser.add_argument("--reference", default="u2net", help="Model the IoU is measured against")
+    models_parser.add_argument("--labels", help="Folder of hand-made masks named <image name>.png, also scored by IoU")
+    models_parser.add_argument("--iou-size", type=int,
+                               help="Compare masks scaled to fit this size, e.g. 300 for listing thumbnails")
+    models_parser.add_argument("--limit", type=int)
+    models_parser.add_argument("--batch-size", type=int, default=4)
+    models_parser.set_defaults(func=bench_models)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
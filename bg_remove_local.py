@@ -1,22 +1,9 @@
-import os
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from PIL import Image
-from rembg import remove
-
-# Function to remove the background from an image
-def process_image(image_path):
-    # Open the image
-    with open(image_path, 'rb') as img_file:
-        input_image = img_file.read()
-    
-    # Process image to remove background
-    output_image = remove(input_image)
-    
-    # Save the new image with "_bgr" appended to the name
-    new_image_path = os.path.splitext(image_path)[0] + '_bgr.png'
-    with open(new_image_path, 'wb') as out_file:
-        out_file.write(output_image)
+from rembg_session import get_session, timings
+from image_jobs import remove_to_png
+from write_behind import start_writer, stop_writer
 
 # Function to select images and process them
 def select_files():
@@ -26,12 +13,20 @@ def select_files():
         filetypes=[("Image Files", "*.png *.jpg *.jpeg *.bmp *.tiff")])
 
     if file_paths:
+        # Load and warm the segmentation model once for the whole run
+        timings.reset()
+        get_session()
+        # Write the PNGs on background threads while the next image is processed
+        start_writer()
         for file_path in file_paths:
             try:
-                process_image(file_path)
+                remove_to_png(file_path)
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to process {file_path}: {str(e)}")
+        for output_path, error in stop_writer():
+            messagebox.showerror("Error", f"Failed to write {output_path}: {str(error)}")
         
+        print(timings.report())
         messagebox.showinfo("Success", "Background removal completed successfully!")
     else:
         messagebox.showwarning("No File", "No file selected. Please select image files to process.")
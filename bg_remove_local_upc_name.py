@@ -9,19 +9,17 @@ except Exception as e:
 os.environ["PATH"] = r"C:\Windows\System32" + os.pathsep + os.environ["PATH"]
 import tkinter as tk
 from tkinter import filedialog, messagebox
-from PIL import Image
-from rembg import remove
+from rembg_session import get_session, remove_background, timings
 import cv2
-from pyzbar.pyzbar import decode
+from upc_barcode import scan_barcode
+from write_behind import start_writer, stop_writer, write_bytes
 
-# Function to extract barcode from an image
+# Function to extract the retail barcode (EAN-13, EAN-8, UPC-A, UPC-E) from an image
 def extract_barcode(image_path):
-    image = Image.open(image_path)
-    decoded_objects = decode(image)
-    for obj in decoded_objects:
-        barcode = obj.data.decode('utf-8')
-        print(f"Detected barcode data: {barcode}")
-        return barcode
+    result = scan_barcode(image_path)
+    if result is not None:
+        print(f"Detected barcode data: {result.raw} ({result.symbology}, found by the {result.stage} pass)")
+        return result.raw
     print("No barcode detected")
     return None
 
@@ -35,7 +33,7 @@ def process_image(image_path):
         input_image = img_file.read()
     
     # Process image to remove background
-    output_image = remove(input_image)
+    output_image = remove_background(input_image)
     
     # Determine the output filename
     if barcode:
@@ -46,8 +44,7 @@ def process_image(image_path):
         new_image_path = os.path.splitext(image_path)[0] + '_bgr.png'
     
     # Save the processed image
-    with open(new_image_path, 'wb') as out_file:
-        out_file.write(output_image)
+    write_bytes(output_image, new_image_path)
     
     print(f"Processed image saved as: {new_image_path}")
     return new_image_path
@@ -61,12 +58,20 @@ def select_files():
     )
 
     if file_paths:
+        # Load and warm the segmentation model once for the whole run
+        timings.reset()
+        get_session()
+        # Write the PNGs on background threads while the next image is processed
+        start_writer()
         for file_path in file_paths:
             try:
                 new_image_path = process_image(file_path)
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to process {file_path}: {str(e)}")
+        for output_path, error in stop_writer():
+            messagebox.showerror("Error", f"Failed to write {output_path}: {str(error)}")
         
+        print(timings.report())
         messagebox.showinfo("Success", "Background removal completed successfully!")
     else:
         messagebox.showwarning("No File", "No file selected. Please select image files to process.")
@@ -0,0 +1,460 @@
+import argparse
+import functools
+import json
+import os
+import sys
+import time
+import barcode_index
+import mask_store
+import session_profiles
+from derivatives import parse_spec
+from ocr_engine import OCR_ANGLE_CLS, OCR_BATCH_SIZE, OCR_BOXES, OCR_FAST, OCR_LANG, OCR_WORKERS
+from output_layout import get_layout
+from parallel_runner import DEFAULT_WORKERS, RunResult, run_files
+from rembg_session import DEFAULT_MODEL, available_models
+from run_manifest import RunManifest, stat_paths
+from write_behind import start_writer, stop_writer
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff')
+
+# Function to expand files and directories (walked recursively) into a list of image paths
+def collect_images(sources, extensions=IMAGE_EXTENSIONS):
+    image_paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            for root_dir, dirs, files in os.walk(source):
+                dirs.sort()
+                for file_name in sorted(files):
+                    if file_name.lower().endswith(extensions):
+                        image_paths.append(os.path.join(root_dir, file_name))
+        elif source.lower().endswith(extensions):
+            image_paths.append(source)
+    return image_paths
+
+# Function to print progress for each file as it finishes
+def print_progress(path, output, error):
+    if error is not None:
+        print(f"Failed to process {path}: {error}", file=sys.stderr)
+    elif output is not None:
+        print(f"{path} -> {output}", file=sys.stderr)
+
+# Function to drop inputs the manifest has already finished and return a result callback
+def apply_manifest(args, image_paths):
+    if not args.manifest:
+        return image_paths, print_progress, None
+    manifest = RunManifest(args.manifest)
+    pending = manifest.pending(stat_paths(image_paths))
+
+    def on_result(path, output, error):
+        manifest.record_result(path, output, error)
+        print_progress(path, output, error)
+    return pending, on_result, manifest
+
+def run_image_job(args, job, load_model=True, dest_dir=None):
+    image_paths = collect_images(args.sources)
+    pending, on_result, manifest = apply_manifest(args, image_paths)
+    if dest_dir:
+        # Create the UPC folders up front instead of checking them per file
+        get_layout(dest_dir).prepare(pending)
+    start_writer()
+    try:
+        result = run_files(job, pending, args.workers, args.model, on_result=on_result,
+                           load_model=load_model)
+        # Every output has landed before the summary is printed
+        result.record_write_failures(stop_writer(), on_result)
+        result.finish()
+    finally:
+        stop_writer()
+        if manifest:
+            manifest.close()
+    summary = result.summary()
+    summary['files'] = len(image_paths)
+    summary['unchanged'] = len(image_paths) - len(pending)
+    return summary
+
+def cmd_bg_remove(args):
+    from image_jobs import remove_to_png
+    return run_image_job(args, remove_to_png)
+
+def cmd_bg_remove_crop(args):
+    import edge_recovery
+    import mask_cache
+    resolve_edge_arguments(args)
+    if args.mask_store and not args.dest:
+        # The crop overwrites the image it was segmented from, so its mask could never be matched to it again
+        raise SystemExit("--mask-store needs --dest: crop-and-replace runs overwrite the originals, "
+                         "so their masks cannot be re-derived from")
+    if args.mask_store:
+        # Set in the environment too so spawned workers keep masks in the same store
+        os.environ['BG_REMOVER_MASK_STORE'] = args.mask_store
+        mask_store.MASK_STORE_DIR = args.mask_store
+    elif not args.dest and mask_store.MASK_STORE_DIR:
+        print("Not keeping masks from BG_REMOVER_MASK_STORE: crop-and-replace runs overwrite the originals",
+              file=sys.stderr)
+        os.environ.pop('BG_REMOVER_MASK_STORE', None)
+        mask_store.MASK_STORE_DIR = None
+    summary = run_bg_remove_crop(args)
+    summary['cache'] = mask_cache.stats.summary()
+    if args.recover_edges and args.pipeline:
+        summary['edges'] = edge_recovery.stats.summary()
+    return summary
+
+def run_bg_remove_crop(args):
+    from derivatives import save_derivatives
+    from edge_recovery import with_edge_recovery
+    from image_jobs import crop_derivatives, crop_replace_jpg, crop_replace_output, derivative_base, save_cropped_jpg
+    if args.pipeline:
+        from pipeline import format_stage_report, run_pipeline
+        image_paths = collect_images(args.sources)
+        pending, on_result, manifest = apply_manifest(args, image_paths)
+        if args.dest:
+            get_layout(args.dest).prepare(pending)
+            output_path_for = functools.partial(derivative_base, dest_dir=args.dest)
+            save_output = functools.partial(save_derivatives, specs=args.derivatives)
+        else:
+            output_path_for, save_output = crop_replace_output, save_cropped_jpg
+        if args.recover_edges:
+            save_output = with_edge_recovery(save_output, args.edge_debug)
+        start_writer()
+        try:
+            result, stages = run_pipeline(pending, output_path_for, save_output, args.model,
+                                          args.reader_threads, args.inference_threads, args.writer_threads,
+                                          args.queue_size, on_result=on_result)
+            result.record_write_failures(stop_writer(), on_result)
+            result.finish()
+        finally:
+            stop_writer()
+            if manifest:
+                manifest.close()
+        print(format_stage_report(stages), file=sys.stderr)
+        summary = result.summary()
+        summary['files'] = len(image_paths)
+        summary['unchanged'] = len(image_paths) - len(pending)
+        summary['stages'] = {stage.name: {'threads': stage.threads, 'busy_seconds': round(stage.busy, 3),
+                                          'idle_seconds': round(stage.idle, 3)} for stage in stages}
+        return summary
+    if args.dest:
+        return run_image_job(args, functools.partial(crop_derivatives, dest_dir=args.dest, specs=args.derivatives,
+                                                     recover=args.recover_edges, edge_debug_dir=args.edge_debug),
+                             dest_dir=args.dest)
+    return run_image_job(args, functools.partial(crop_replace_jpg, recover=args.recover_edges,
+                                                 edge_debug_dir=args.edge_debug))
+
+def cmd_thumb(args):
+    from image_jobs import resize_thumbnail
+    return run_image_job(args, functools.partial(resize_thumbnail, dest_dir=args.dest), load_model=False,
+                         dest_dir=args.dest)
+
+def cmd_upc_rename(args):
+    from rename_planner import rename_by_barcode, resume_renames, undo_renames
+    from upc_barcode import stage_counts
+    result = RunResult()
+    if args.resume or args.undo:
+        # Works from the journal alone; nothing is decoded
+        done_files, result.failures = (resume_renames if args.resume else undo_renames)(args.folder)
+        result.processed = len(done_files)
+        return result.finish().summary()
+    renamed_files, undetected_files, held_back = rename_by_barcode(args.folder, args.recursive, args.workers,
+                                                                   dry_run=args.dry_run, legacy=args.legacy_names)
+    result.processed = len(renamed_files)
+    result.failures = [(path, "No barcode detected") for path in undetected_files] + held_back
+    summary = result.finish().summary()
+    summary['files'] = result.processed + len(result.failures)
+    summary['dry_run'] = args.dry_run
+    # How many images each decode pass answered; 'index' ones were not decoded at all
+    summary['barcode_stages'] = dict(stage_counts)
+    return summary
+
+def cmd_storefront(args):
+    import edge_recovery
+    import mask_cache
+    from pipeline import format_stage_report
+    from storefront import run_storefront
+    from upc_barcode import stage_counts
+    resolve_edge_arguments(args)
+    result, stages, storefront_summary = run_storefront(args.folder, args.dest, not args.flat, args.derivatives,
+                                                        args.model, args.reader_threads, args.inference_threads,
+                                                        args.writer_threads, args.queue_size,
+                                                        on_result=print_progress, recover=args.recover_edges,
+                                                        edge_debug_dir=args.edge_debug)
+    print(format_stage_report(stages), file=sys.stderr)
+    print("Steps: " + ', '.join(f"{name} {seconds:.1f} s" for name, seconds in storefront_summary['steps'].items()),
+          file=sys.stderr)
+    summary = result.summary()
+    summary.update(storefront_summary)
+    # Images not renamed because another one already takes their UPC name
+    summary['held_back'] = [{'path': path, 'reason': reason} for path, reason in storefront_summary['held_back']]
+    summary['stages'] = {stage.name: {'threads': stage.threads, 'busy_seconds': round(stage.busy, 3),
+                                      'idle_seconds': round(stage.idle, 3)} for stage in stages}
+    summary['barcode_stages'] = dict(stage_counts)
+    summary['cache'] = mask_cache.stats.summary()
+    if args.recover_edges:
+        summary['edges'] = edge_recovery.stats.summary()
+    return summary
+
+def cmd_tune_session(args):
+    from batch_segment import load_image
+    image_paths = collect_images(args.sources)[:args.limit]
+    if not image_paths:
+        raise SystemExit("No sample images found")
+    images = [load_image(path) for path in image_paths]
+    profiles = [session_profiles.PROFILES[name] for name in (args.profiles or session_profiles.PROFILES)]
+
+    def print_profile(profile, images_per_sec):
+        print(f"{profile.name}: {images_per_sec:.2f} images/s", file=sys.stderr)
+
+    results = session_profiles.benchmark_profiles(images, profiles, args.model, args.repeat, print_profile)
+    fastest, images_per_sec = results[0]
+    if not args.no_save:
+        session_profiles.save_profile(fastest, images_per_sec)
+    return {'files': len(images), 'profiles': {profile.name: rate for profile, rate in results},
+            'fastest': fastest.name, 'saved': None if args.no_save else session_profiles.SESSION_PROFILE_PATH}
+
+def cmd_rederive(args):
+    from image_jobs import rederive_derivatives
+    if not args.store:
+        raise SystemExit("rederive needs --store or BG_REMOVER_MASK_STORE")
+    job = functools.partial(rederive_derivatives, dest_dir=args.dest, store_dir=args.store,
+                            specs=args.derivatives)
+    return run_image_job(args, job, load_model=False, dest_dir=args.dest)
+
+def cmd_cache(args):
+    import mask_cache
+    cache = mask_cache.MaskCache()
+    summary = {'processed': 0, 'failed': 0}
+    if args.action == 'invalidate':
+        summary['removed'] = cache.invalidate(args.model, keep_current=args.keep_current)
+    summary['usage'] = cache.usage()
+    return summary
+
+def cmd_barcodes(args):
+    index = barcode_index.BarcodeIndex(args.index)
+    summary = {'processed': 0, 'failed': 0}
+    if args.action == 'export':
+        if args.output:
+            with open(args.output, 'w', newline='', encoding='utf-8') as out_file:
+                summary['exported'] = index.export_csv(out_file)
+        else:
+            summary['exported'] = index.export_csv(sys.stdout)
+            # stdout holds the CSV, so the run summary goes with the other messages
+            args.summary_to_stderr = True
+    summary['usage'] = index.usage()
+    return summary
+
+def cmd_ocr(args):
+    from ocr_engine import OcrSettings, ocr_report, run_ocr
+    from text_extract import infer_product_name_from_text
+    image_paths = collect_images(args.sources, ('.png', '.jpg', '.jpeg'))
+    settings = OcrSettings(args.lang, not args.no_angle_cls, args.batch_size, args.fast)
+    result = RunResult()
+
+    def on_result(ocr_result):
+        # The boxed_ copy is the file written, if any; the text itself goes to --results
+        output = ocr_result.get('boxed') or f"{len(ocr_result.get('lines', []))} text lines"
+        result.record(ocr_result['path'], output, ocr_result.get('error'), print_progress)
+
+    if args.results:
+        with open(args.results, 'w', encoding='utf-8') as results_file:
+            ocr_results = run_ocr(image_paths, args.workers, settings, not args.no_boxes, on_result, results_file)
+    else:
+        ocr_results = run_ocr(image_paths, args.workers, settings, not args.no_boxes, on_result)
+    text_data = [ocr_result['text'] for ocr_result in ocr_results if 'error' not in ocr_result]
+    summary = result.finish().summary()
+    summary['files'] = len(image_paths)
+    summary['product_name'] = infer_product_name_from_text(text_data) if text_data else None
+    # Cache hit rate and seconds per image for each mode
+    summary['ocr'] = ocr_report(ocr_results)
+    return summary
+
+def add_image_arguments(parser, model=True):
+    parser.add_argument("sources", nargs="+", help="Image files or directories (walked recursively)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"Worker processes (default {DEFAULT_WORKERS}; 1 runs in this process)")
+    parser.add_argument("--manifest",
+                        help="Resumable run manifest; inputs it records as finished and unchanged are skipped")
+    if model:
+        parser.add_argument("--model", default=DEFAULT_MODEL, choices=available_models(),
+                            help=f"Segmentation model (default {DEFAULT_MODEL})")
+        add_session_arguments(parser)
+    else:
+        parser.set_defaults(model=None)
+
+def add_session_arguments(parser):
+    parser.add_argument("--session-profile", default=session_profiles.SESSION_PROFILE,
+                        choices=sorted(session_profiles.PROFILES) + ['saved', 'auto'],
+                        help="ONNX Runtime threads, execution mode, graph optimisation and memory arena settings; "
+                             "'auto' uses the profile tune-session saved for this machine if there is one "
+                             "(default BG_REMOVER_SESSION_PROFILE or auto)")
+
+def add_derivative_arguments(parser):
+    parser.add_argument("--derivative", dest="derivatives", action="append", type=parse_spec,
+                        metavar="SUFFIX:SIZE[:PADDING[:RRGGBB[:FORMAT[:QUALITY]]]]",
+                        help="Output size to write into the UPC tree; repeat for several sizes, all made "
+                             "from one decode and mask (default BG_REMOVER_DERIVATIVES or the 300x300 thumbnail)")
+
+def add_pipeline_arguments(parser):
+    parser.add_argument("--reader-threads", type=int)
+    parser.add_argument("--inference-threads", type=int)
+    parser.add_argument("--writer-threads", type=int)
+    parser.add_argument("--queue-size", type=int, help="Images held between stages")
+
+def add_edge_arguments(parser):
+    # Defaults are filled in by resolve_edge_arguments so parsing does not load the edge recovery module
+    parser.add_argument("--recover-edges", action="store_true", default=None,
+                        help="Add back alpha along edges found next to the mask boundary "
+                             "(default BG_REMOVER_EDGE_RECOVERY)")
+    parser.add_argument("--edge-debug", metavar="DIR",
+                        help="Write each image's input, rembg cutout and recovered cutout into this folder "
+                             "(default BG_REMOVER_EDGE_DEBUG_DIR)")
+
+# Function to fill in the edge recovery options not given on the command line from the environment
+def resolve_edge_arguments(args):
+    import edge_recovery
+    if args.recover_edges is None:
+        args.recover_edges = edge_recovery.EDGE_RECOVERY_ENABLED
+    if args.edge_debug is None:
+        args.edge_debug = edge_recovery.EDGE_DEBUG_DIR
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Headless batch runner for the background removal, thumbnail, UPC rename and OCR tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    bg_remove = subparsers.add_parser("bg-remove", help="Remove backgrounds and save <name>_bgr.png")
+    add_image_arguments(bg_remove)
+    bg_remove.set_defaults(func=cmd_bg_remove)
+
+    bg_remove_crop = subparsers.add_parser(
+        "bg-remove-crop", help="Remove backgrounds, crop to content and overwrite as JPG, "
+                               "or write thumbnails (300x300 or --derivative sizes) into the UPC tree with --dest")
+    add_image_arguments(bg_remove_crop)
+    bg_remove_crop.add_argument("--dest", help="Destination root for the three-level UPC folder tree")
+    add_derivative_arguments(bg_remove_crop)
+    bg_remove_crop.add_argument("--mask-store",
+                                help="Keep each mask in this folder so the --dest outputs can be re-derived later")
+    bg_remove_crop.add_argument("--pipeline", action="store_true",
+                                help="Overlap read/inference/write stages on threads instead of using --workers")
+    add_pipeline_arguments(bg_remove_crop)
+    add_edge_arguments(bg_remove_crop)
+    bg_remove_crop.set_defaults(func=cmd_bg_remove_crop)
+
+    thumb = subparsers.add_parser("thumb", help="Resize images into 300x300 thumbnails in the UPC tree")
+    add_image_arguments(thumb, model=False)
+    thumb.add_argument("--dest", required=True, help="Destination root for the three-level UPC folder tree")
+    thumb.set_defaults(func=cmd_thumb)
+
+    upc_rename = subparsers.add_parser("upc-rename", help="Rename product images to their decoded UPC")
+    upc_rename.add_argument("folder")
+    upc_rename.add_argument("--recursive", action="store_true",
+                            help="Walk subfolders and name back images back_<UPC> instead of <UPC>_back")
+    upc_rename.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                            help=f"Processes decoding barcodes (default {DEFAULT_WORKERS})")
+    upc_rename.add_argument("--legacy-names", action="store_true",
+                            help="Name files as the Orlando rename tools do: drop the last digit and pad to 13 digits")
+    rename_mode = upc_rename.add_mutually_exclusive_group()
+    rename_mode.add_argument("--dry-run", action="store_true",
+                             help="Decode and print the planned renames, moves and collisions without touching any file")
+    rename_mode.add_argument("--resume", action="store_true",
+                             help="Finish the run recorded in the folder's rename journal after a crash, without decoding")
+    rename_mode.add_argument("--undo", action="store_true",
+                             help="Put back every file the run recorded in the folder's rename journal renamed or moved")
+    upc_rename.set_defaults(func=cmd_upc_rename)
+
+    storefront = subparsers.add_parser(
+        "storefront", help="Rename to UPC, crop over the originals and write the UPC-tree thumbnails in one pass, "
+                           "reading each image once")
+    storefront.add_argument("folder", help="Shoot folder, walked recursively as the orlando rename tool does")
+    storefront.add_argument("--dest", required=True, help="Destination root for the three-level UPC folder tree")
+    storefront.add_argument("--flat", action="store_true",
+                            help="Only the folder itself, naming back images <UPC>_back instead of back_<UPC>")
+    storefront.add_argument("--model", default=DEFAULT_MODEL, choices=available_models(),
+                            help=f"Segmentation model (default {DEFAULT_MODEL})")
+    add_derivative_arguments(storefront)
+    add_pipeline_arguments(storefront)
+    add_edge_arguments(storefront)
+    add_session_arguments(storefront)
+    storefront.set_defaults(func=cmd_storefront)
+
+    tune_session = subparsers.add_parser(
+        "tune-session", help="Time segmentation under each session profile on sample images "
+                             "and save the fastest as this machine's profile")
+    tune_session.add_argument("sources", nargs="+", help="Sample image files or directories (walked recursively)")
+    tune_session.add_argument("--model", default=DEFAULT_MODEL, choices=available_models(),
+                              help=f"Segmentation model (default {DEFAULT_MODEL})")
+    tune_session.add_argument("--profile", dest="profiles", action="append",
+                              choices=sorted(session_profiles.PROFILES),
+                              help="Profile to try; repeat for several (default: every built-in profile)")
+    tune_session.add_argument("--limit", type=int, default=8, help="Sample images used (default 8)")
+    tune_session.add_argument("--repeat", type=int, default=3,
+                              help="Passes per profile; the fastest counts (default 3)")
+    tune_session.add_argument("--no-save", action="store_true", help="Only report the timings")
+    tune_session.set_defaults(func=cmd_tune_session)
+
+    rederive = subparsers.add_parser(
+        "rederive", help="Rebuild thumbnails and other derivatives from originals and stored masks without loading a model")
+    add_image_arguments(rederive, model=False)
+    rederive.add_argument("--dest", required=True, help="Destination root for the three-level UPC folder tree")
+    rederive.add_argument("--store", default=mask_store.MASK_STORE_DIR,
+                          help="Mask store folder (default BG_REMOVER_MASK_STORE)")
+    add_derivative_arguments(rederive)
+    rederive.set_defaults(func=cmd_rederive)
+
+    cache = subparsers.add_parser("cache", help="Show or invalidate the segmentation mask cache")
+    cache.add_argument("action", choices=["stats", "invalidate"])
+    cache.add_argument("--model", choices=available_models(),
+                       help="Only invalidate masks made by this model (default: all models)")
+    cache.add_argument("--keep-current", action="store_true",
+                       help="Only drop masks made by other versions of the model")
+    cache.set_defaults(func=cmd_cache)
+
+    barcodes = subparsers.add_parser("barcodes", help="Show or export the barcode index of scanned images")
+    barcodes.add_argument("action", choices=["stats", "export"])
+    barcodes.add_argument("--output", help="CSV file to export to (default: stdout, with the summary on stderr)")
+    barcodes.add_argument("--index", default=barcode_index.INDEX_PATH,
+                          help="Index database (default BG_REMOVER_BARCODE_INDEX_PATH)")
+    barcodes.set_defaults(func=cmd_barcodes)
+
+    ocr = subparsers.add_parser("ocr", help="Extract text and infer a product name")
+    ocr.add_argument("sources", nargs="+", help="Image files or directories (walked recursively)")
+    ocr.add_argument("--workers", type=int, default=OCR_WORKERS,
+                     help=f"Worker processes, each loading its own OCR models (default {OCR_WORKERS})")
+    ocr.add_argument("--batch-size", type=int, default=OCR_BATCH_SIZE,
+                     help=f"Text lines per recognition run (default {OCR_BATCH_SIZE})")
+    ocr.add_argument("--lang", default=OCR_LANG, help=f"OCR language (default {OCR_LANG})")
+    ocr.add_argument("--no-angle-cls", action="store_true", default=not OCR_ANGLE_CLS,
+                     help="Skip the text direction classifier; fine for upright pack shots")
+    ocr.add_argument("--no-boxes", action="store_true", default=not OCR_BOXES,
+                     help="Do not write a boxed_ copy of each image")
+    ocr.add_argument("--fast", action="store_true", default=OCR_FAST,
+                     help="Detect text on a downscaled copy and recognise only the largest, most central regions")
+    ocr.add_argument("--results", help="Write one JSON result per image to this JSON-lines file")
+    ocr.set_defaults(func=cmd_ocr)
+    return parser
+
+# Function to make every session of this run, including those in worker processes, use the chosen profile
+def apply_session_profile(name):
+    try:
+        profile = session_profiles.resolve_profile(name)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    os.environ['BG_REMOVER_SESSION_PROFILE'] = name
+    session_profiles.use_profile(profile)
+    return profile
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    start = time.perf_counter()
+    profile = apply_session_profile(args.session_profile) if getattr(args, 'session_profile', None) else None
+    summary = args.func(args)
+    summary = {'command': args.command, **summary}
+    if profile is not None:
+        summary['session_profile'] = profile._asdict()
+    summary['wall_seconds'] = round(time.perf_counter() - start, 3)
+    summary['images_per_sec'] = (round(summary.get('processed', 0) / summary['wall_seconds'], 3)
+                                 if summary['wall_seconds'] else 0.0)
+    # Last line of stdout is the machine-readable run summary, unless the command wrote its data there
+    print(json.dumps(summary), file=sys.stderr if getattr(args, 'summary_to_stderr', False) else sys.stdout)
+    return 1 if summary.get('failed') else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import os
+from collections import namedtuple
+from PIL import Image
+from alpha_bbox import get_tight_bbox
+from write_behind import save_image
+
+# One output size: file name suffix, square box in pixels, padding inside the box,
+# background RGB, Pillow format and quality
+DerivativeSpec = namedtuple('DerivativeSpec', 'suffix size padding background format quality')
+
+# The storefront thumbnail every tool has always written
+MAIN_THUMB = DerivativeSpec('_MAIN_MAIN_THUMB', 300, 0, (255, 255, 255), 'JPEG', 75)
+
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+
+# Function to parse "SUFFIX:SIZE[:PADDING[:RRGGBB[:FORMAT[:QUALITY]]]]" into a DerivativeSpec
+def parse_spec(text):
+    parts = text.split(':')
+    if len(parts) < 2:
+        raise ValueError(f"Derivative spec '{text}' needs at least SUFFIX:SIZE")
+    suffix, size = parts[0], int(parts[1])
+    padding = int(parts[2]) if len(parts) > 2 and parts[2] else 0
+    background = MAIN_THUMB.background
+    if len(parts) > 3 and parts[3]:
+        background = tuple(int(parts[3].lstrip('#')[i:i + 2], 16) for i in (0, 2, 4))
+    image_format = parts[4].upper() if len(parts) > 4 and parts[4] else 'JPEG'
+    if image_format not in FORMAT_EXTENSIONS:
+        raise ValueError(f"Unsupported derivative format '{image_format}'")
+    quality = int(parts[5]) if len(parts) > 5 and parts[5] else MAIN_THUMB.quality
+    if size <= 2 * padding:
+        raise ValueError(f"Derivative spec '{text}' leaves no room inside the padding")
+    return DerivativeSpec(suffix, size, padding, background, image_format, quality)
+
+# Function to parse a ';'-separated list of specs
+def parse_specs(text):
+    return [parse_spec(part.strip()) for part in text.split(';') if part.strip()]
+
+# Derivatives written by default; set BG_REMOVER_DERIVATIVES to e.g.
+# "_ZOOM:1500:30;_LISTING:600:20;_MAIN_MAIN_THUMB:300;_SWATCH:80:0:ffffff:PNG"
+DEFAULT_SPECS = parse_specs(os.environ.get('BG_REMOVER_DERIVATIVES', '')) or [MAIN_THUMB]
+
+# Function to crop a decoded image to its mask and composite it straight onto a background
+def composite_on_background(image, mask, background=(255, 255, 255)):
+    """Return the cropped RGB cutout, or None if the mask is empty"""
+    # Get the tight bounding box ignoring low alpha
+    bbox = get_tight_bbox(mask)
+    if not bbox:
+        return None
+
+    # Paste the cropped image onto the background using the cropped mask as alpha
+    canvas = Image.new("RGB", (bbox[2] - bbox[0], bbox[3] - bbox[1]), background)
+    canvas.paste(image.crop(bbox), mask=mask.crop(bbox))
+    return canvas
+
+# Function to centre a cutout in a square box of the spec's background
+def _place(cutout, spec):
+    canvas = Image.new("RGB", (spec.size, spec.size), spec.background)
+    if cutout is not None:
+        offset = ((spec.size - cutout.size[0]) // 2, (spec.size - cutout.size[1]) // 2)
+        canvas.paste(cutout, offset)
+    return canvas
+
+# Function to render every derivative from one decoded image and its mask
+def render_derivatives(image, mask, specs=None, cutouts=None):
+    """Return [(spec, image)] in the order of specs.
+
+    The cutout is composited once per background, then each size is resized
+    from the next larger one rather than from the full-resolution crop.
+    cutouts maps a background to a cutout the caller has already composited.
+    """
+    specs = specs or DEFAULT_SPECS
+    cutouts = cutouts or {}
+    rendered = {}
+    for background in {spec.background for spec in specs}:
+        if background in cutouts:
+            current = cutouts[background]
+        else:
+            current = composite_on_background(image, mask, background)
+        same_background = [spec for spec in specs if spec.background == background]
+        for spec in sorted(same_background, key=lambda s: s.size - 2 * s.padding, reverse=True):
+            box = spec.size - 2 * spec.padding
+            if current is not None:
+                resized = current.copy()
+                resized.thumbnail((box, box), Image.Resampling.LANCZOS)
+                current = resized
+            rendered[spec] = _place(current, spec)
+    return [(spec, rendered[spec]) for spec in specs]
+
+# Function to get the file a derivative is written to
+def derivative_path(output_base, spec):
+    return f"{output_base}{spec.suffix}{FORMAT_EXTENSIONS[spec.format]}"
+
+# Function to render and save every derivative next to output_base (folder + UPC)
+def save_derivatives(image, mask, output_base, specs=None):
+    output_paths = []
+    for spec, derivative in render_derivatives(image, mask, specs):
+        output_path = derivative_path(output_base, spec)
+        save_image(derivative, output_path, spec.format, quality=spec.quality)
+        output_paths.append(output_path)
+    return output_paths
@@ -0,0 +1,137 @@
+import os
+import threading
+import time
+import numpy as np
+from PIL import Image
+from write_behind import save_image
+
+# Set BG_REMOVER_EDGE_RECOVERY=1 to run edge recovery in the crop and storefront runs by default
+EDGE_RECOVERY_ENABLED = os.environ.get('BG_REMOVER_EDGE_RECOVERY', '0') == '1'
+# Folder for the per-image debug files; unset writes none
+EDGE_DEBUG_DIR = os.environ.get('BG_REMOVER_EDGE_DEBUG_DIR') or None
+
+# Canny thresholds (lowered for more recovery) and the dilation that widens the edges
+CANNY_LOW = 30
+CANNY_HIGH = 100
+DILATE_KERNEL = np.ones((5, 5), np.uint8)
+DILATE_ITERATIONS = 2
+
+# Square tiles the frame is checked in, and the context read around each one so
+# Canny and the dilations see the same neighbourhood they would on the full frame
+TILE_SIZE = 256
+TILE_MARGIN = 16
+
+class RecoveryStats:
+    """Images recovered, seconds spent and how many tiles the boundary band covered"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.images = 0
+        self.seconds = 0.0
+        self.tiles = 0
+        self.band_tiles = 0
+
+    def add(self, seconds, tiles, band_tiles):
+        with self._lock:
+            self.images += 1
+            self.seconds += seconds
+            self.tiles += tiles
+            self.band_tiles += band_tiles
+
+    def summary(self):
+        return {
+            'images': self.images,
+            'seconds': round(self.seconds, 3),
+            'mean_seconds': round(self.seconds / self.images, 4) if self.images else 0.0,
+            'band_fraction': round(self.band_tiles / self.tiles, 3) if self.tiles else 0.0,
+        }
+
+# Recovery counters for the current run in this process
+stats = RecoveryStats()
+
+# Function to tell whether Canny can find any edge in a tile: the 3x3 Sobel sum |gx| + |gy| is at most 8x its range
+def could_have_edges(values):
+    low, high = int(values.min()), int(values.max())
+    return 8 * (high - low) >= CANNY_LOW
+
+# Function to restore alpha along edges next to the mask boundary, without altering colours
+def recover_edges(image, mask):
+    """Return a new 'L' mask: the old one OR'd with the dilated Canny edges of the cutout.
+
+    Edges are found on the image premultiplied by the mask, as in rembg's
+    cutout. Only tiles in the band around the mask boundary are computed: a
+    tile whose neighbourhood is fully opaque cannot gain alpha, and one whose
+    cutout is too faint for any gradient to reach CANNY_LOW has no edges.
+    The result matches a full-frame run except where a weak edge connects
+    only to a strong one more than TILE_MARGIN pixels away.
+    """
+    # Imported here so tools that never recover edges start without OpenCV
+    import cv2
+    start = time.perf_counter()
+    alpha = np.array(mask.convert('L') if mask.mode != 'L' else mask)
+    height, width = alpha.shape
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGB')
+    gray_code = cv2.COLOR_RGBA2GRAY if image.mode == 'RGBA' else cv2.COLOR_RGB2GRAY
+
+    recovered = []
+    tiles = 0
+    for top in range(0, height, TILE_SIZE):
+        for left in range(0, width, TILE_SIZE):
+            tiles += 1
+            bottom, right = min(top + TILE_SIZE, height), min(left + TILE_SIZE, width)
+            outer_top, outer_left = max(0, top - TILE_MARGIN), max(0, left - TILE_MARGIN)
+            outer_bottom, outer_right = min(height, bottom + TILE_MARGIN), min(width, right + TILE_MARGIN)
+            region = alpha[outer_top:outer_bottom, outer_left:outer_right]
+            # Opaque throughout, or so faint that even a black-to-white cutout stays below CANNY_LOW
+            if region.min() == 255 or 8 * int(region.max()) < CANNY_LOW:
+                continue
+
+            # Only this tile's pixels are converted, never the whole frame
+            gray = cv2.cvtColor(np.asarray(image.crop((outer_left, outer_top, outer_right, outer_bottom))), gray_code)
+            gray = cv2.multiply(gray, region, scale=1 / 255)
+            if not could_have_edges(gray):
+                continue
+            edges = cv2.Canny(gray, CANNY_LOW, CANNY_HIGH)
+            edges = cv2.dilate(edges, DILATE_KERNEL, iterations=DILATE_ITERATIONS)
+            recovered.append((top, bottom, left, right,
+                              edges[top - outer_top:bottom - outer_top, left - outer_left:right - outer_left]))
+
+    # Applied after every tile is computed, so each one saw the original mask in its margin
+    for top, bottom, left, right, edges in recovered:
+        tile = alpha[top:bottom, left:right]
+        np.bitwise_or(tile, edges, out=tile)
+    stats.add(time.perf_counter() - start, tiles, len(recovered))
+    return Image.fromarray(alpha, mode='L')
+
+# Function to composite a cutout the way rembg does: colour premultiplied by the mask, mask as alpha
+def premultiplied_cutout(image, mask):
+    empty = Image.new('RGBA', image.size, (0, 0, 0, 0))
+    return Image.composite(image.convert('RGBA'), empty, mask)
+
+# Function to write the before and after cutouts of an image for inspection
+def save_debug_images(debug_dir, image_path, image, mask, recovered_mask):
+    os.makedirs(debug_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(image_path))[0]
+    save_image(image, os.path.join(debug_dir, f"{name}_input.png"), 'PNG', compress_level=1)
+    rembg_output = premultiplied_cutout(image, mask)
+    save_image(rembg_output, os.path.join(debug_dir, f"{name}_rembg_output.png"), 'PNG', compress_level=1)
+    # Encoded already, so the same pixels can take the recovered alpha
+    rembg_output.putalpha(recovered_mask)
+    save_image(rembg_output, os.path.join(debug_dir, f"{name}_recovered.png"), 'PNG', compress_level=1)
+
+# Function to recover an image's mask edges, writing debug files only when a folder is given
+def recover_mask(image_path, image, mask, debug_dir=EDGE_DEBUG_DIR):
+    recovered_mask = recover_edges(image, mask)
+    if debug_dir:
+        save_debug_images(debug_dir, image_path, image, mask, recovered_mask)
+    return recovered_mask
+
+# Function to wrap a pipeline save_output(image, mask, output_path) so it is handed the recovered mask
+def with_edge_recovery(save_output, debug_dir=EDGE_DEBUG_DIR):
+    def save_recovered(image, mask, output_path):
+        return save_output(image, recover_mask(output_path, image, mask, debug_dir), output_path)
+    return save_recovered
@@ -0,0 +1,142 @@
+import os
+from PIL import Image
+from batch_segment import load_image
+from derivatives import MAIN_THUMB, composite_on_background, derivative_path, save_derivatives
+from edge_recovery import recover_mask
+from mask_cache import segment_images
+from mask_store import get_store
+from output_layout import get_layout
+from rembg_session import remove_background
+from write_behind import save_image, write_bytes
+
+# Function to check whether an opened image carries any transparency
+def has_alpha(img):
+    return img.mode in ('RGBA', 'LA', 'PA', 'RGBa', 'La') or 'transparency' in img.info
+
+# Function to open an image for a thumbnail of the given box size, decoding JPEGs at reduced scale
+def open_for_thumbnail(image_path, size=MAIN_THUMB.size):
+    """Return the loaded image in RGBA if it has transparency, else RGB"""
+    with Image.open(image_path) as img:
+        if img.format == 'JPEG':
+            # Let the decoder scale by 1/2, 1/4 or 1/8 in the DCT domain, stopping at
+            # twice the box so the final LANCZOS resample still has detail to work with
+            img.draft('RGB', (size * 2, size * 2))
+        # Only pay for an alpha channel when the source has one
+        mode = 'RGBA' if has_alpha(img) else 'RGB'
+        if img.mode != mode:
+            return img.convert(mode)
+        img.load()
+        return img
+
+# Function to fit an image centred on a white square thumbnail
+def make_centered_thumbnail(img, size=MAIN_THUMB.size):
+    # Resize while maintaining aspect ratio
+    img.thumbnail((size, size), Image.Resampling.LANCZOS)
+    jpg_bg = Image.new("RGB", (size, size), (255, 255, 255))
+    offset = ((size - img.size[0]) // 2, (size - img.size[1]) // 2)
+    jpg_bg.paste(img, offset, mask=img.split()[3] if img.mode == 'RGBA' else None)
+    return jpg_bg
+
+# Function to paste an image centred on a 300x300 white JPG and save it
+def save_centered_thumbnail(img, output_image_path):
+    save_image(make_centered_thumbnail(img), output_image_path, 'JPEG')
+
+# Function to crop a decoded image to its mask and composite it straight onto white
+def composite_on_white(image, mask):
+    """Return the cropped RGB cutout on white, or None if the mask is empty"""
+    return composite_on_background(image, mask)
+
+# Function to crop a decoded image to its mask and save it on white as JPG
+def save_cropped_jpg(image, mask, output_path):
+    white_bg = composite_on_white(image, mask)
+    if white_bg is None:
+        # If no non-transparent pixels, create an empty white image
+        white_bg = Image.new("RGB", (1, 1), (255, 255, 255))
+    save_image(white_bg, output_path, 'JPEG')
+
+# Function to remove the background from an image file and save it as <name>_bgr.png
+def remove_to_png(image_path, model_name=None):
+    with open(image_path, 'rb') as img_file:
+        input_image = img_file.read()
+
+    output_image = remove_background(input_image, model_name=model_name)
+
+    new_image_path = os.path.splitext(image_path)[0] + '_bgr.png'
+    write_bytes(output_image, new_image_path)
+    return new_image_path
+
+# Function to get the JPG that overwrites an image in the crop-and-replace tools
+def crop_replace_output(image_path):
+    return os.path.splitext(image_path)[0] + '.jpg'
+
+# Function to get the UPC folder and name every derivative of an image is written under, creating its folders
+def derivative_base(image_path, dest_dir):
+    """Return <third_dir>/<UPC>, or None if the filename is not numeric with at least 13 digits"""
+    return get_layout(dest_dir).output_base(image_path)
+
+# Function to get the thumbnail path in the UPC folder tree, creating its folders
+def thumbnail_output(image_path, dest_dir):
+    """Return the thumbnail path, or None if the filename is not a UPC"""
+    output_base = derivative_base(image_path, dest_dir)
+    return derivative_path(output_base, MAIN_THUMB) if output_base else None
+
+# Function to segment a decoded image, recovering the mask's edges when asked
+def segment_one(image_path, image, model_name=None, recover=False, edge_debug_dir=None):
+    mask = segment_images([image_path], [image], model_name)[0]
+    if recover:
+        mask = recover_mask(image_path, image, mask, edge_debug_dir)
+    return mask
+
+# Function to remove the background from an image file, crop to content and overwrite it as JPG
+def crop_replace_jpg(image_path, model_name=None, recover=False, edge_debug_dir=None):
+    image = load_image(image_path)
+    mask = segment_one(image_path, image, model_name, recover, edge_debug_dir)
+    output_path = crop_replace_output(image_path)
+    save_cropped_jpg(image, mask, output_path)
+    return output_path
+
+# Function to remove the background and save every derivative size in the UPC folder tree
+def crop_derivatives(image_path, dest_dir, model_name=None, specs=None, recover=False, edge_debug_dir=None):
+    """Return the derivative paths, or None if the filename is not a UPC"""
+    output_base = derivative_base(image_path, dest_dir)
+    if output_base is None:
+        return None
+
+    image = load_image(image_path)
+    mask = segment_one(image_path, image, model_name, recover, edge_debug_dir)
+    return save_derivatives(image, mask, output_base, specs)
+
+# Function to resize an image into a 300x300 thumbnail in the UPC folder tree, without a model
+def resize_thumbnail(image_path, dest_dir, model_name=None):
+    """Return the thumbnail path, or None if the filename is not a UPC"""
+    output_image_path = thumbnail_output(image_path, dest_dir)
+    if output_image_path is None:
+        return None
+
+    img = open_for_thumbnail(image_path)
+
+    # Save the resized image in the third-level subdirectory
+    save_centered_thumbnail(img, output_image_path)
+    return output_image_path
+
+# Function to rebuild the derivatives from the original image and its stored mask, without a model
+def rederive_derivatives(image_path, dest_dir, store_dir=None, model_name=None, specs=None):
+    """Return the derivative paths, or None if the filename is not a UPC"""
+    output_base = derivative_base(image_path, dest_dir)
+    if output_base is None:
+        return None
+
+    store = get_store(store_dir)
+    mask = store.load(image_path)
+    if mask is None:
+        others = store.sources(os.path.splitext(os.path.basename(image_path))[0])
+        if others:
+            raise LookupError(f"No stored mask for the current content of {os.path.basename(image_path)}; "
+                              f"the store has masks for other content under that name, e.g. {others[0]}")
+        raise LookupError(f"No stored mask for {os.path.basename(image_path)}")
+
+    image = load_image(image_path)
+    if image.size != mask.size:
+        raise ValueError(f"Stored mask is {mask.size[0]}x{mask.size[1]} but the image is "
+                         f"{image.size[0]}x{image.size[1]}")
+    return save_derivatives(image, mask, output_base, specs)
@@ -1,96 +1,52 @@
-import os
+import functools
 import tkinter as tk
 from tkinter import filedialog, messagebox
-from PIL import Image
-from rembg import remove
-from io import BytesIO
+from rembg_session import THUMB_MODEL, get_session, timings
+from batch_segment import DEFAULT_BATCH_SIZE, iter_batches, load_image
+from mask_cache import segment_images, stats as cache_stats
+from derivatives import save_derivatives
+from image_jobs import crop_derivatives, derivative_base
+from output_layout import get_layout
+from pipeline import PIPELINE_ENABLED, format_stage_report, run_pipeline
+from write_behind import start_writer, stop_writer
 
-# Custom function to get tight bounding box ignoring low alpha pixels
-def get_tight_bbox(img, threshold=10):
-    data = list(img.getdata())
-    width, height = img.size
-    left = width
-    top = height
-    right = 0
-    bottom = 0
-    for y in range(height):
-        for x in range(width):
-            a = data[y * width + x][3]
-            if a >= threshold:
-                left = min(left, x)
-                right = max(right, x)
-                top = min(top, y)
-                bottom = max(bottom, y)
-    if left > right:
-        return None
-    return (left, top, right + 1, bottom + 1)
-
-# Function to remove the background from an image, crop to content, and save resized output
+# Function to remove the background from an image, crop to content, and save resized outputs
 def process_image(image_path, dest_dir):
-    # Get the base filename (without extension)
-    base_name = os.path.basename(os.path.splitext(image_path)[0])
-    
-    # Skip if filename is not numeric or has fewer than 13 digits
-    if not (base_name.isdigit() and len(base_name) >= 13):
+    try:
+        crop_derivatives(image_path, dest_dir, model_name=THUMB_MODEL)
+    except Exception:
+        # Skip any errors and continue processing the next file
         return
-    
-    # Extract subdirectory names based on filename digits
-    first_level = base_name[:3]  # First 3 digits
-    second_level = base_name[3:8]  # 4th to 8th digits
-    third_level = base_name[-5:]  # Last 5 digits
-    
-    # Create three-level subdirectory structure in destination directory
-    first_dir = os.path.join(dest_dir, first_level)
-    second_dir = os.path.join(first_dir, second_level)
-    third_dir = os.path.join(second_dir, third_level)
-    
-    # Check if subdirectories exist before creating
-    if not os.path.exists(first_dir):
-        os.makedirs(first_dir, exist_ok=True)
-    if not os.path.exists(second_dir):
-        os.makedirs(second_dir, exist_ok=True)
-    if not os.path.exists(third_dir):
-        os.makedirs(third_dir, exist_ok=True)
+
+# Function to remove the background from a batch of images with one inference and save their derivatives
+def process_batch(image_paths, dest_dir):
+    images = []
+    outputs = []
+    loaded_paths = []
+    for image_path in image_paths:
+        try:
+            # Skip if filename is not numeric or has fewer than 13 digits
+            output_base = derivative_base(image_path, dest_dir)
+            if output_base is None:
+                continue
+            images.append(load_image(image_path))
+            outputs.append(output_base)
+            loaded_paths.append(image_path)
+        except Exception:
+            # Skip any errors and continue processing the next file
+            continue
     
     try:
-        # Open the image
-        with open(image_path, 'rb') as img_file:
-            input_image = img_file.read()
-        
-        # Process image to remove background
-        output_image_bytes = remove(input_image)
-        
-        # Load the output as a PIL Image
-        output_img = Image.open(BytesIO(output_image_bytes))
-        
-        # Ensure it's in RGBA mode for transparency
-        if output_img.mode != 'RGBA':
-            output_img = output_img.convert('RGBA')
-        
-        # Get the tight bounding box ignoring low alpha
-        bbox = get_tight_bbox(output_img)
-        
-        if bbox:
-            # Crop the image to the bounding box
-            cropped_img = output_img.crop(bbox)
-            
-            # Resize to 300x300 for JPG output while maintaining aspect ratio
-            cropped_img.thumbnail((300, 300), Image.Resampling.LANCZOS)
-            jpg_bg = Image.new("RGB", (300, 300), (255, 255, 255))
-            offset = ((300 - cropped_img.size[0]) // 2, (300 - cropped_img.size[1]) // 2)
-            jpg_bg.paste(cropped_img, offset, mask=cropped_img.split()[3])
-            
-            # Save the resized image in the third-level subdirectory
-            output_image_path = os.path.join(third_dir, f"{base_name}_MAIN_MAIN_THUMB.jpg")
-            jpg_bg.save(output_image_path, 'JPEG')
-        else:
-            # If no non-transparent pixels, create an empty 300x300 white image
-            jpg_bg = Image.new("RGB", (300, 300), (255, 255, 255))
-            output_image_path = os.path.join(third_dir, f"{base_name}_MAIN_MAIN_THUMB.jpg")
-            jpg_bg.save(output_image_path, 'JPEG')
+        masks = segment_images(loaded_paths, images, THUMB_MODEL)
     except Exception:
-        # Skip any errors and continue processing the next file
         return
+    
+    for image, mask, output_base in zip(images, masks, outputs):
+        try:
+            # Every configured size comes from this one decode and mask
+            save_derivatives(image, mask, output_base)
+        except Exception:
+            continue
 
 # Function to select images and destination directory, then process them
 def select_files():
@@ -108,9 +64,30 @@ def select_files():
         filetypes=[("Image Files", "*.png *.jpg *.jpeg *.bmp *.tiff")])
 
     if file_paths:
-        for file_path in file_paths:
-            process_image(file_path, dest_dir)
+        # Load and warm the segmentation model once for the whole run; BG_REMOVER_THUMB_MODEL picks it
+        timings.reset()
+        cache_stats.reset()
+        get_session(THUMB_MODEL)
+        # Create every UPC folder the selection needs in one pass
+        get_layout(dest_dir).prepare(file_paths)
+        # Write the thumbnails on background threads so inference never waits on the share
+        start_writer()
+        if PIPELINE_ENABLED:
+            # Overlap reading, inference and writing on separate threads
+            _, stages = run_pipeline(list(file_paths), functools.partial(derivative_base, dest_dir=dest_dir),
+                                     save_derivatives, THUMB_MODEL)
+            print(format_stage_report(stages))
+        else:
+            # Send the images to the model in batches
+            for batch in iter_batches(list(file_paths), DEFAULT_BATCH_SIZE):
+                process_batch(batch, dest_dir)
+        write_failures = stop_writer()
+        print(timings.report())
+        print(f"Mask cache: {cache_stats.summary()}")
         
+        if write_failures:
+            shown = '\n'.join(f"{output_path}: {error}" for output_path, error in write_failures[:10])
+            messagebox.showerror("Error", f"{len(write_failures)} outputs could not be written:\n{shown}")
         messagebox.showinfo("Success", "Background removal and resizing completed successfully!")
     else:
         messagebox.showwarning("Warning", "No file selected. Please select image files to process.")
@@ -0,0 +1,218 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from PIL import Image
+from batch_segment import MODEL_INPUTS, segment_batch
+from mask_store import get_store
+from rembg_session import base_model, model_path, resolve_model_name
+from run_manifest import file_digest
+
+# Set BG_REMOVER_CACHE=0 to turn the mask cache off
+CACHE_ENABLED = os.environ.get('BG_REMOVER_CACHE', '1') != '0'
+CACHE_DIR = os.environ.get('BG_REMOVER_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'bg_remover', 'masks'))
+CACHE_MAX_BYTES = int(os.environ.get('BG_REMOVER_CACHE_MB', '4096')) * 1024 * 1024
+
+# Bump to invalidate every cached mask after a change to how masks are produced
+PROCESSING_VERSION = '1'
+
+class CacheStats:
+    """Hit and miss counters; workers of a process pool can share them through Values"""
+
+    def __init__(self):
+        self.shared = None
+        self.reset()
+
+    def reset(self):
+        self.hits = 0
+        self.misses = 0
+        if self.shared:
+            for value in self.shared:
+                value.value = 0
+
+    def add(self, hits=0, misses=0):
+        if self.shared:
+            with self.shared[0].get_lock():
+                self.shared[0].value += hits
+            with self.shared[1].get_lock():
+                self.shared[1].value += misses
+        else:
+            self.hits += hits
+            self.misses += misses
+
+    def summary(self):
+        hits, misses = ((self.shared[0].value, self.shared[1].value) if self.shared
+                        else (self.hits, self.misses))
+        total = hits + misses
+        return {'hits': hits, 'misses': misses, 'hit_rate': round(hits / total, 3) if total else 0.0}
+
+# Cache counters for the current run
+stats = CacheStats()
+
+# Function to get the version of a model: its own override, else the size and mtime of its ONNX file
+def model_version(model_name):
+    name = resolve_model_name(model_name)
+    override = os.environ.get('BG_REMOVER_MODEL_VERSION')
+    if override:
+        return override
+    try:
+        st = os.stat(model_path(name))
+    except OSError:
+        return 'unknown'
+    return f"{st.st_size}-{int(st.st_mtime)}"
+
+class MaskCache:
+    """Alpha masks on disk keyed by input content, model version and processing parameters.
+
+    Masks are stored as PNG files; a SQLite index tracks their size and last
+    use so the least recently used masks are evicted once the cap is reached.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, 'index.sqlite3'), timeout=30,
+                                   check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS masks (key TEXT PRIMARY KEY, model TEXT, "
+                         "version TEXT, size INTEGER, last_used REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS masks_last_used ON masks (last_used)")
+        # Total mask bytes in a one-row table, updated in the same transaction as every insert and removal,
+        # so the processes of a pool sharing the cache all evict against the same figure
+        self._db.execute("CREATE TABLE IF NOT EXISTS mask_total (id INTEGER PRIMARY KEY CHECK (id = 0), "
+                         "bytes INTEGER)")
+        self._db.execute("INSERT OR IGNORE INTO mask_total SELECT 0, COALESCE(SUM(size), 0) FROM masks")
+        self._db.commit()
+
+    def key(self, digest, model_name):
+        name = resolve_model_name(model_name)
+        params = f"{PROCESSING_VERSION}|{MODEL_INPUTS.get(base_model(name))}"
+        return hashlib.sha256(f"{digest}|{name}|{model_version(name)}|{params}".encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.png")
+
+    def get(self, digest, model_name):
+        key = self.key(digest, model_name)
+        try:
+            with Image.open(self._path(key)) as mask:
+                mask.load()
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self._db.execute("UPDATE masks SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+        return mask
+
+    def put(self, digest, model_name, mask):
+        name = resolve_model_name(model_name)
+        key = self.key(digest, name)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write under a temporary name so a crash never leaves a truncated mask behind
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        mask.save(tmp_path, 'PNG')
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            # Taken before the lookup so no other process changes the entry or the total in between
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                replaced = self._db.execute("SELECT size FROM masks WHERE key = ?", (key,)).fetchone()
+                self._db.execute("INSERT OR REPLACE INTO masks VALUES (?, ?, ?, ?, ?)",
+                                 (key, name, model_version(name), size, time.time()))
+                self._add_bytes(size - (replaced[0] if replaced else 0))
+                self._evict()
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+
+    def _total_bytes(self):
+        return self._db.execute("SELECT bytes FROM mask_total WHERE id = 0").fetchone()[0]
+
+    def _add_bytes(self, delta):
+        self._db.execute("UPDATE mask_total SET bytes = bytes + ? WHERE id = 0", (delta,))
+
+    def _evict(self):
+        total = self._total_bytes()
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used masks until back under 90% of the cap
+        for key, size in self._db.execute("SELECT key, size FROM masks ORDER BY last_used").fetchall():
+            if total <= self.max_bytes * 0.9:
+                break
+            self._remove(key, size)
+            total -= size
+
+    def _remove(self, key, size):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+        self._db.execute("DELETE FROM masks WHERE key = ?", (key,))
+        self._add_bytes(-size)
+
+    def invalidate(self, model_name=None, keep_current=False):
+        """Remove cached masks for a model (or all models); keep_current keeps the current model version"""
+        query, params = "SELECT key, model, version, size FROM masks", ()
+        if model_name:
+            query, params = query + " WHERE model = ?", (resolve_model_name(model_name),)
+        removed = 0
+        with self._lock:
+            for key, model, version, size in self._db.execute(query, params).fetchall():
+                if keep_current and version == model_version(model):
+                    continue
+                self._remove(key, size)
+                removed += 1
+            self._db.commit()
+        return removed
+
+    def usage(self):
+        count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM masks").fetchone()
+        return {'masks': count, 'bytes': total, 'max_bytes': self.max_bytes}
+
+# Cache shared by the threads of this process
+_cache = None
+
+# Function to get the process-wide cache, or None when caching is turned off
+def get_cache():
+    global _cache
+    if _cache is None and CACHE_ENABLED:
+        _cache = MaskCache()
+    return _cache
+
+# Function to segment images, reusing cached masks for inputs already seen with this model
+def segment_images(paths, images, model_name=None, providers=None, digests=None):
+    """Return one mask per image; masks are also kept in the mask store when one is configured.
+
+    digests are the SHA-256 of the files when the caller already has them, so they are not read again.
+    """
+    store = get_store()
+    if store is not None and digests is None:
+        # Hashed once here for both the cache and the store
+        digests = [file_digest(path) for path in paths]
+    masks = _segment_cached(paths, images, model_name, providers, digests)
+    if store is not None:
+        for path, mask, digest in zip(paths, masks, digests):
+            store.save(path, mask, resolve_model_name(model_name), digest)
+    return masks
+
+def _segment_cached(paths, images, model_name, providers, digests=None):
+    cache = get_cache()
+    if cache is None:
+        return segment_batch(images, model_name, providers)
+
+    digests = digests or [file_digest(path) for path in paths]
+    masks = [cache.get(digest, model_name) for digest in digests]
+    missing = [i for i, mask in enumerate(masks) if mask is None]
+    stats.add(hits=len(masks) - len(missing), misses=len(missing))
+    if missing:
+        new_masks = segment_batch([images[i] for i in missing], model_name, providers)
+        for i, mask in zip(missing, new_masks):
+            cache.put(digests[i], model_name, mask)
+            masks[i] = mask
+    return masks
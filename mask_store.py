@@ -0,0 +1,84 @@
+import os
+import sqlite3
+import threading
+import time
+from PIL import Image
+from alpha_bbox import get_tight_bbox
+from run_manifest import file_digest
+
+# Set BG_REMOVER_MASK_STORE to a folder to keep every mask for later re-deriving
+MASK_STORE_DIR = os.environ.get('BG_REMOVER_MASK_STORE') or None
+
+class MaskStore:
+    """Alpha masks kept per source image so crops and thumbnails can be rebuilt without the model.
+
+    Masks are keyed by the SHA-256 of the source file, so two shots with the
+    same name in different folders keep their own masks and a changed file is
+    never handed an old one; the filename (the UPC for named shots) is kept
+    as a lookup column. Each mask is cropped to its non-zero area and saved
+    as an optimised PNG; the SQLite manifest records the source image, full
+    size and crop offset.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(store_dir, 'manifest.sqlite3'), timeout=30,
+                                   check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS stored_masks (digest TEXT PRIMARY KEY, name TEXT, source TEXT, "
+                         "width INTEGER, height INTEGER, bbox TEXT, model TEXT, created REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS stored_masks_name ON stored_masks (name)")
+        self._db.commit()
+
+    def _path(self, digest):
+        return os.path.join(self.store_dir, f"{digest}.png")
+
+    def save(self, image_path, mask, model_name=None, digest=None):
+        """Keep the mask of an image; digest is the file's SHA-256 when the caller already has it"""
+        digest = digest or file_digest(image_path)
+        bbox = get_tight_bbox(mask, threshold=1)
+        if bbox:
+            tmp_path = f"{self._path(digest)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            mask.crop(bbox).save(tmp_path, 'PNG', optimize=True)
+            os.replace(tmp_path, self._path(digest))
+        width, height = mask.size
+        name = os.path.splitext(os.path.basename(image_path))[0]
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO stored_masks VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             (digest, name, os.path.abspath(image_path), width, height,
+                              ','.join(map(str, bbox)) if bbox else '', model_name, time.time()))
+            self._db.commit()
+
+    def load(self, image_path):
+        """Return the full-size 'L' mask stored for the image's current content, or None if there is none"""
+        digest = file_digest(image_path)
+        with self._lock:
+            row = self._db.execute("SELECT width, height, bbox FROM stored_masks WHERE digest = ?",
+                                   (digest,)).fetchone()
+        if row is None:
+            return None
+        width, height, bbox = row
+        mask = Image.new('L', (width, height), 0)
+        if bbox:
+            with Image.open(self._path(digest)) as cropped:
+                mask.paste(cropped, tuple(int(v) for v in bbox.split(',')[:2]))
+        return mask
+
+    def sources(self, name):
+        """Return the source paths of the masks kept for a filename, newest first"""
+        with self._lock:
+            return [row[0] for row in self._db.execute(
+                "SELECT source FROM stored_masks WHERE name = ? ORDER BY created DESC", (name,))]
+
+# Stores opened by this process, shared by its threads
+_stores = {}
+
+# Function to get a mask store (the configured one by default), or None when masks are not being kept
+def get_store(store_dir=None):
+    store_dir = store_dir or MASK_STORE_DIR
+    if not store_dir:
+        return None
+    if store_dir not in _stores:
+        _stores[store_dir] = MaskStore(store_dir)
+    return _stores[store_dir]
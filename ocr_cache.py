@@ -0,0 +1,61 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Set BG_REMOVER_OCR_CACHE=0 to OCR every image on every run
+OCR_CACHE_ENABLED = os.environ.get('BG_REMOVER_OCR_CACHE', '1') != '0'
+OCR_CACHE_PATH = os.environ.get('BG_REMOVER_OCR_CACHE_PATH',
+                                os.path.join(os.path.expanduser('~'), '.cache', 'bg_remover', 'ocr.sqlite3'))
+
+class OcrCache:
+    """OCR text lines keyed by the SHA-256 of the image file and the OCR settings used.
+
+    Keying by content means a result survives renames and copies of the
+    image; keying by settings means a fast-mode result is never handed out
+    for a full OCR (or for another language or direction setting).
+    """
+
+    def __init__(self, cache_path=OCR_CACHE_PATH):
+        self.cache_path = cache_path
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(cache_path, timeout=30, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS ocr (digest TEXT, settings TEXT, lines TEXT, path TEXT, "
+                         "created REAL, PRIMARY KEY (digest, settings))")
+        self._db.commit()
+
+    def get(self, digest, settings_key):
+        """Return the cached lines ([{'text', 'score', 'box'}]) or None"""
+        with self._lock:
+            row = self._db.execute("SELECT lines FROM ocr WHERE digest = ? AND settings = ?",
+                                   (digest, settings_key)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, digest, settings_key, lines, path):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO ocr VALUES (?, ?, ?, ?, ?)",
+                             (digest, settings_key, json.dumps(lines), os.path.abspath(path), time.time()))
+            self._db.commit()
+
+    def usage(self):
+        with self._lock:
+            images, = self._db.execute("SELECT COUNT(*) FROM ocr").fetchone()
+        return {'entries': images, 'hits': self.hits, 'misses': self.misses}
+
+# Cache shared by the threads of this process
+_cache = None
+
+# Function to get the process-wide OCR cache, or None when it is turned off
+def get_ocr_cache():
+    global _cache
+    if _cache is None and OCR_CACHE_ENABLED:
+        _cache = OcrCache()
+    return _cache
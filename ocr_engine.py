@@ -0,0 +1,244 @@
+import functools
+import json
+import math
+import os
+import signal
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image, ImageDraw, ImageOps
+from ocr_cache import get_ocr_cache
+from run_manifest import file_digest
+
+# OCR language; set BG_REMOVER_OCR_LANG to change it
+OCR_LANG = os.environ.get('BG_REMOVER_OCR_LANG', 'en')
+# Set BG_REMOVER_OCR_ANGLE_CLS=0 to skip the text direction classifier for upright pack shots
+OCR_ANGLE_CLS = os.environ.get('BG_REMOVER_OCR_ANGLE_CLS', '1') != '0'
+# Set BG_REMOVER_OCR_BOXES=0 to skip writing the boxed_ copy of each image
+OCR_BOXES = os.environ.get('BG_REMOVER_OCR_BOXES', '1') != '0'
+# Text lines sent to the recognition and direction models per run
+OCR_BATCH_SIZE = int(os.environ.get('BG_REMOVER_OCR_BATCH_SIZE', '6'))
+# Worker processes, each with its own engine; 1 runs in this process
+OCR_WORKERS = int(os.environ.get('BG_REMOVER_OCR_WORKERS', '1'))
+# Set BG_REMOVER_OCR_FAST=1 to read only the most prominent text, which is all product-name inference uses
+OCR_FAST = os.environ.get('BG_REMOVER_OCR_FAST', '0') == '1'
+
+# Fast mode: long side of the copy text is detected on, smallest decode the regions are cut from,
+# and how many of the largest, most central regions are recognised
+FAST_DETECT_SIDE = int(os.environ.get('BG_REMOVER_OCR_FAST_DETECT_SIDE', '960'))
+FAST_DECODE_SIDE = 2000
+FAST_REGIONS = int(os.environ.get('BG_REMOVER_OCR_FAST_REGIONS', '8'))
+# Text height the PP-OCR recognition models read at; larger crops are scaled down to it
+REC_TEXT_HEIGHT = 48
+
+# Bump when the OCR itself changes, so cached results are not reused
+OCR_VERSION = '1'
+
+# Settings an engine is created with and the mode it runs in; results are only comparable between equal settings
+OcrSettings = namedtuple('OcrSettings', 'lang angle_cls batch_size fast')
+DEFAULT_SETTINGS = OcrSettings(OCR_LANG, OCR_ANGLE_CLS, OCR_BATCH_SIZE, OCR_FAST)
+
+# Engines of this process keyed by settings (fast and full mode share one), created on first use
+_engines = {}
+# CPU threads each engine may use; set in pool workers so they share the cores
+_cpu_threads = None
+
+# Function to get the engine for some settings, loading the models on first use
+def get_engine(settings=DEFAULT_SETTINGS):
+    key = (settings.lang, settings.angle_cls, settings.batch_size)
+    engine = _engines.get(key)
+    if engine is None:
+        # Imported here so the GUI and the CLI start without waiting for Paddle
+        from paddleocr import PaddleOCR
+        options = {'use_angle_cls': settings.angle_cls, 'lang': settings.lang, 'show_log': False,
+                   'rec_batch_num': settings.batch_size, 'cls_batch_num': settings.batch_size}
+        if _cpu_threads:
+            options['cpu_threads'] = _cpu_threads
+        engine = PaddleOCR(**options)
+        _engines[key] = engine
+    return engine
+
+# Function to get the part of the settings that changes what is read, for the cache key
+def settings_key(settings):
+    mode = f"fast-{FAST_DETECT_SIDE}-{FAST_DECODE_SIDE}-{FAST_REGIONS}" if settings.fast else "full"
+    return f"{settings.lang}|cls={int(settings.angle_cls)}|{mode}|v{OCR_VERSION}"
+
+# Function to read the text lines in an image
+def read_text(image, settings=DEFAULT_SETTINGS):
+    """Return [(box, text, score)]; image is a path or an RGB array"""
+    result = get_engine(settings).ocr(image, cls=settings.angle_cls)
+    # One list per page, or [None] when no text is found
+    lines = result[0] if result and result[0] else []
+    return [(box, text, score) for box, (text, score) in lines]
+
+# Function to hand a PIL image to PaddleOCR, which reads arrays as OpenCV BGR
+def _to_bgr(image):
+    return np.ascontiguousarray(np.asarray(image)[:, :, ::-1])
+
+# Function to order detected boxes by prominence: large and near the centre of the pack first
+def rank_regions(boxes, size):
+    cx, cy = size[0] / 2, size[1] / 2
+    half_diagonal = math.hypot(cx, cy)
+
+    def prominence(box):
+        left, top, right, bottom = box_bounds(box)
+        distance = math.hypot((left + right) / 2 - cx, (top + bottom) / 2 - cy) / half_diagonal
+        return (right - left) * (bottom - top) * (1 - 0.5 * distance)
+    return sorted(boxes, key=prominence, reverse=True)
+
+# Function to read only the most prominent text: detect on a small copy, recognise the top regions
+def read_prominent_text(image_path, settings=DEFAULT_SETTINGS):
+    """Return [(box, text, score)] for at most FAST_REGIONS regions, boxes in full-image pixels"""
+    engine = get_engine(settings)
+    with Image.open(image_path) as img:
+        full_side = max(img.size)
+        if img.format == 'JPEG':
+            # Decode at 1/2, 1/4 or 1/8 scale, keeping enough pixels for small print in the chosen regions
+            img.draft('RGB', (FAST_DECODE_SIDE, FAST_DECODE_SIDE))
+        # Oriented the way PaddleOCR's own reader (OpenCV) orients it in full mode
+        image = ImageOps.exif_transpose(img).convert('RGB')
+
+    detect_scale = min(1.0, FAST_DETECT_SIDE / max(image.size))
+    small = image
+    if detect_scale < 1.0:
+        small = image.resize((max(1, round(image.size[0] * detect_scale)),
+                              max(1, round(image.size[1] * detect_scale))), Image.Resampling.BOX)
+    found = engine.ocr(_to_bgr(small), det=True, rec=False, cls=False)
+    boxes = found[0] if found and found[0] else []
+    regions = rank_regions(boxes, small.size)[:FAST_REGIONS]
+    # Recognise them top to bottom so the words come out in the order they sit on the pack
+    regions.sort(key=lambda box: (box_bounds(box)[1], box_bounds(box)[0]))
+
+    crops = []
+    for box in regions:
+        left, top, right, bottom = (value / detect_scale for value in box_bounds(box))
+        margin = 0.15 * (bottom - top)
+        crop = image.crop((max(0, int(left - margin)), max(0, int(top - margin)),
+                           min(image.size[0], int(right + margin) + 1), min(image.size[1], int(bottom + margin) + 1)))
+        # Large print is read at the height the model works at instead of at full resolution
+        if crop.size[1] > REC_TEXT_HEIGHT:
+            crop = crop.resize((max(1, round(crop.size[0] * REC_TEXT_HEIGHT / crop.size[1])), REC_TEXT_HEIGHT),
+                               Image.Resampling.BOX)
+        crops.append(_to_bgr(crop))
+    # A list of crops is recognised in batches of rec_batch_num, with no detection
+    texts = engine.ocr([crops], det=False, cls=settings.angle_cls)[0] if crops else []
+
+    to_full = full_side / max(small.size)
+    return [([[x * to_full, y * to_full] for x, y in box], text, score)
+            for box, (text, score) in zip(regions, texts)]
+
+# Function to get the (left, top, right, bottom) rectangle around a detected text box
+def box_bounds(box):
+    left = min(box[0][0], box[3][0])
+    top = min(box[0][1], box[1][1])
+    right = max(box[1][0], box[2][0])
+    bottom = max(box[2][1], box[3][1])
+    return left, top, right, bottom
+
+# Function to save a copy of an image with blue boxes around the detected text
+def save_boxed_copy(image_path, lines):
+    image = Image.open(image_path).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for box, _, _ in lines:
+        # Draw blue rectangle (outline only)
+        draw.rectangle(box_bounds(box), outline='blue', width=2)
+    output_path = os.path.join(os.path.dirname(image_path), f"boxed_{os.path.basename(image_path)}")
+    image.save(output_path)
+    return output_path
+
+# Function to turn the lines read from an image into its JSON result
+def make_result(image_path, lines, boxed_path=None):
+    return {
+        'path': image_path,
+        'text': ' '.join(text for _, text, _ in lines),
+        'lines': [{'text': text, 'score': round(float(score), 4),
+                   'box': [[round(float(x), 1), round(float(y), 1)] for x, y in box]}
+                  for box, text, score in lines],
+        'boxed': boxed_path,
+    }
+
+# Function to OCR one image file
+def ocr_image(image_path, settings=DEFAULT_SETTINGS, boxes=OCR_BOXES):
+    """Return {'path', 'text', 'lines', 'boxed', 'mode', 'cached', 'seconds'}.
+
+    Results are cached by image content and settings_key(settings), so an
+    image read before with the same settings is not OCR'd again.
+    """
+    start = time.perf_counter()
+    cache = get_ocr_cache()
+    cached = None
+    if cache is not None:
+        digest = file_digest(image_path)
+        cached = cache.get(digest, settings_key(settings))
+    if cached is not None:
+        lines = [(line['box'], line['text'], line['score']) for line in cached]
+    elif settings.fast:
+        lines = read_prominent_text(image_path, settings)
+    else:
+        lines = read_text(image_path, settings)
+    result = make_result(image_path, lines, save_boxed_copy(image_path, lines) if boxes else None)
+    if cache is not None and cached is None:
+        cache.put(digest, settings_key(settings), result['lines'], image_path)
+    result['mode'] = 'fast' if settings.fast else 'full'
+    result['cached'] = cached is not None
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+# Function to set up a pool worker: leave Ctrl-C to the parent and split the cores between engines
+def _init_worker(cpu_threads):
+    global _cpu_threads
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _cpu_threads = cpu_threads
+
+# Function to OCR one image in a worker; errors come back in the result so one bad file cannot stop the pool
+def _ocr_one(image_path, settings, boxes):
+    try:
+        return ocr_image(image_path, settings, boxes)
+    except Exception as e:
+        return {'path': image_path, 'error': str(e)}
+
+# Function to OCR a list of images, on a process pool when there is more than one worker
+def run_ocr(image_paths, workers=None, settings=DEFAULT_SETTINGS, boxes=OCR_BOXES, on_result=None,
+            results_file=None):
+    """Return one result per image in input order; failed images have an 'error' instead of text.
+
+    on_result(result) is called as each result arrives, and each one is
+    written to the open results_file as a JSON line.
+    """
+    workers = min(workers or OCR_WORKERS, len(image_paths))
+    results = []
+
+    def collect(result):
+        results.append(result)
+        if results_file is not None:
+            results_file.write(json.dumps(result) + '\n')
+            results_file.flush()
+        if on_result:
+            on_result(result)
+
+    if workers > 1:
+        cpu_threads = max(1, (os.cpu_count() or 1) // workers)
+        job = functools.partial(_ocr_one, settings=settings, boxes=boxes)
+        # Each task is a run of images so a worker keeps its engine busy between hand-offs
+        chunksize = max(1, len(image_paths) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(cpu_threads,)) as executor:
+            for result in executor.map(job, image_paths, chunksize=chunksize):
+                collect(result)
+    else:
+        for image_path in image_paths:
+            collect(_ocr_one(image_path, settings, boxes))
+    return results
+
+# Function to summarise a run's results: cache hit rate and mean seconds per image for each mode
+def ocr_report(results):
+    done = [result for result in results if 'error' not in result]
+    hits = sum(result['cached'] for result in done)
+    seconds = {}
+    for result in done:
+        seconds.setdefault(f"{result['mode']}-{'cached' if result['cached'] else 'ocr'}", []).append(result['seconds'])
+    return {
+        'cache_hits': hits,
+        'cache_hit_rate': round(hits / len(done), 3) if done else 0.0,
+        'seconds_per_image': {name: round(sum(values) / len(values), 3) for name, values in sorted(seconds.items())},
+    }
@@ -0,0 +1,87 @@
+import os
+import threading
+
+# Function to check that a filename is a UPC the output tree can be built from
+def is_upc_name(base_name):
+    return base_name.isdigit() and len(base_name) >= 13
+
+# Function to get the UPC (filename without extension) of an image path
+def upc_of(image_path):
+    return os.path.basename(os.path.splitext(image_path)[0])
+
+class UpcLayout:
+    """Maps UPCs to their three-level output folder and remembers which folders exist.
+
+    first_level is the first 3 digits, second_level the 4th to 8th digits and
+    third_level the last 5 digits. A folder is created at most once per
+    process, and parents already known to exist are never checked again, which
+    keeps round trips down on network shares.
+    """
+
+    def __init__(self, dest_dir):
+        self.dest_dir = dest_dir
+        self._created = set()
+        self._lock = threading.Lock()
+
+    def folder(self, base_name):
+        return os.path.join(self.dest_dir, base_name[:3], base_name[3:8], base_name[-5:])
+
+    def _make(self, directory):
+        if directory in self._created:
+            return
+        if directory == self.dest_dir:
+            os.makedirs(directory, exist_ok=True)
+        else:
+            self._make(os.path.dirname(directory))
+            try:
+                os.mkdir(directory)
+            except FileExistsError:
+                pass
+        with self._lock:
+            self._created.add(directory)
+
+    def ensure_folder(self, base_name):
+        """Return the output folder for a UPC, creating it if this process has not yet"""
+        directory = self.folder(base_name)
+        self._make(directory)
+        return directory
+
+    def output_base(self, image_path):
+        """Return <folder>/<UPC> that output suffixes are appended to, or None if the filename is not a UPC"""
+        base_name = upc_of(image_path)
+        if not is_upc_name(base_name):
+            return None
+        return os.path.join(self.ensure_folder(base_name), base_name)
+
+    def prepare(self, image_paths):
+        """Create every folder a known list of inputs needs in one pass; return how many there are"""
+        folders = sorted({self.folder(upc_of(path)) for path in image_paths if is_upc_name(upc_of(path))})
+        for directory in folders:
+            self._make(directory)
+        return len(folders)
+
+# Layouts used by this process, one per destination root
+_layouts = {}
+
+# Function to get the shared layout for a destination root
+def get_layout(dest_dir):
+    dest_dir = os.path.normpath(dest_dir)
+    if dest_dir not in _layouts:
+        _layouts[dest_dir] = UpcLayout(dest_dir)
+    return _layouts[dest_dir]
+
+# Function to get the temporary name an output is written under before it is renamed into place
+def _temp_path(path):
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+# Function to write bytes so readers only ever see the complete file
+def atomic_write(data, path):
+    tmp_path = _temp_path(path)
+    try:
+        with open(tmp_path, 'wb') as out_file:
+            out_file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
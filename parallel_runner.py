@@ -0,0 +1,160 @@
+import multiprocessing
+import os
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import session_profiles
+from rembg_session import get_session
+
+# Worker processes for directory runs; set BG_REMOVER_WORKERS to change it
+DEFAULT_WORKERS = int(os.environ.get('BG_REMOVER_WORKERS', str(os.cpu_count() or 1)))
+
+# Model the worker's session was created for
+_worker_model = None
+
+class RunResult:
+    """Outcome of a run: files processed, failures and whether it was cancelled"""
+
+    def __init__(self):
+        self.processed = 0
+        self.skipped = 0
+        self.failures = []  # (path, error message)
+        self.cancelled = False
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self._sources = {}  # output path -> input, to trace failed background writes
+
+    def record(self, path, output, error, on_result=None):
+        # A job returns None for inputs it deliberately skips (e.g. non-UPC filenames)
+        if error is not None:
+            self.failures.append((path, str(error)))
+        elif output is None:
+            self.skipped += 1
+        else:
+            self.processed += 1
+            for output_path in (output if isinstance(output, (list, tuple)) else [output]):
+                self._sources[output_path] = path
+        if on_result:
+            on_result(path, output, error)
+
+    def record_write_failures(self, write_failures, on_result=None):
+        """Turn outputs the write-behind writer could not persist into failures of their inputs"""
+        failed = {}
+        for output_path, error in write_failures:
+            failed.setdefault(self._sources.get(output_path, output_path), error)
+        for path, error in failed.items():
+            self.processed -= 1
+            self.record(path, None, error, on_result)
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    def summary(self):
+        return {
+            'processed': self.processed,
+            'skipped': self.skipped,
+            'failed': len(self.failures),
+            'failures': [{'path': path, 'error': error} for path, error in self.failures],
+            'cancelled': self.cancelled,
+            'wall_seconds': round(self.elapsed, 3),
+            'images_per_sec': round(self.processed / self.elapsed, 3) if self.elapsed else 0.0,
+        }
+
+# Function to set up a worker: leave Ctrl-C to the parent and warm its own session
+def _init_worker(model_name, threads, load_model, cache_counters):
+    global _worker_model
+    # Imported here so tools whose jobs never segment start without the segmentation modules
+    import mask_cache
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Count mask cache hits and misses in the parent's totals
+    mask_cache.stats.shared = cache_counters
+    # Split the cores between workers instead of every session using all of them
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    session_profiles.set_worker_threads(threads)
+    _worker_model = model_name
+    if load_model:
+        get_session(model_name)
+
+def _run_job(job, path):
+    return job(path, model_name=_worker_model)
+
+# Function to run job(path, model_name=...) for every path in this process
+def run_serial(job, paths, model_name=None, cancel_event=None, on_result=None, load_model=True):
+    result = RunResult()
+    try:
+        if load_model:
+            get_session(model_name)
+        for path in paths:
+            if cancel_event is not None and cancel_event.is_set():
+                result.cancelled = True
+                break
+            try:
+                output = job(path, model_name=model_name)
+            except Exception as e:
+                result.record(path, None, e, on_result)
+            else:
+                result.record(path, output, None, on_result)
+    except KeyboardInterrupt:
+        result.cancelled = True
+    return result.finish()
+
+# Function to run job(path, model_name=...) for every path on a pool of worker processes
+def run_parallel(job, paths, workers=None, model_name=None, cancel_event=None, on_result=None,
+                 load_model=True):
+    """Stream results back as workers finish and return a RunResult.
+
+    job must be a module-level function (or a functools.partial of one) so
+    it can be sent to the workers.
+    on_result(path, output, error) is called in the parent for every file.
+    Setting cancel_event, or Ctrl-C, stops handing out new files; files
+    already running are allowed to finish so no output is left half-written.
+    """
+    import mask_cache
+    workers = max(1, workers or DEFAULT_WORKERS)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    result = RunResult()
+    path_iter = iter(paths)
+    pending = {}
+    cache_counters = (multiprocessing.Value('q', 0), multiprocessing.Value('q', 0))
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                   initargs=(model_name, threads, load_model, cache_counters))
+    try:
+        while True:
+            # Keep a small queue per worker so cancelling does not wait on thousands of files
+            while not result.cancelled and len(pending) < workers * 2:
+                path = next(path_iter, None)
+                if path is None:
+                    break
+                pending[executor.submit(_run_job, job, path)] = path
+            if not pending:
+                break
+            done, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                try:
+                    output = future.result()
+                except Exception as e:
+                    result.record(path, None, e, on_result)
+                else:
+                    result.record(path, output, None, on_result)
+            if cancel_event is not None and cancel_event.is_set() and not result.cancelled:
+                result.cancelled = True
+                # Drop queued files that no worker has started yet
+                for future in [f for f in pending if f.cancel()]:
+                    del pending[future]
+    except KeyboardInterrupt:
+        result.cancelled = True
+        print("Cancelling: waiting for running files to finish...")
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        mask_cache.stats.add(hits=cache_counters[0].value, misses=cache_counters[1].value)
+    return result.finish()
+
+# Function to pick the pool for more than one worker and the current process otherwise
+def run_files(job, paths, workers=None, model_name=None, cancel_event=None, on_result=None,
+              load_model=True):
+    workers = workers or DEFAULT_WORKERS
+    if workers > 1 and len(paths) > 1:
+        return run_parallel(job, paths, workers, model_name, cancel_event, on_result, load_model)
+    return run_serial(job, paths, model_name, cancel_event, on_result, load_model)
@@ -0,0 +1,195 @@
+import os
+import queue
+import threading
+import time
+from batch_segment import DEFAULT_BATCH_SIZE, load_image
+from mask_cache import segment_images
+from parallel_runner import RunResult
+from rembg_session import get_session
+
+# Set BG_REMOVER_PIPELINE=1 to run the directory scripts as overlapped read/infer/write stages
+PIPELINE_ENABLED = os.environ.get('BG_REMOVER_PIPELINE', '0') == '1'
+
+# Threads per stage and items held between stages; each queued 24 MP frame is ~70 MB
+DEFAULT_READER_THREADS = int(os.environ.get('BG_REMOVER_READER_THREADS', '2'))
+DEFAULT_INFERENCE_THREADS = int(os.environ.get('BG_REMOVER_INFERENCE_THREADS', '1'))
+DEFAULT_WRITER_THREADS = int(os.environ.get('BG_REMOVER_WRITER_THREADS', '2'))
+DEFAULT_QUEUE_SIZE = int(os.environ.get('BG_REMOVER_QUEUE_SIZE', '4'))
+
+# Marks the end of a stage's input
+_DONE = object()
+
+class StageStats:
+    """Busy and idle (waiting on queues) time summed over a stage's threads"""
+
+    def __init__(self, name, threads):
+        self.name = name
+        self.threads = threads
+        self.busy = 0.0
+        self.idle = 0.0
+        self.items = 0
+        self._lock = threading.Lock()
+
+    def add(self, busy=0.0, idle=0.0, items=0):
+        with self._lock:
+            self.busy += busy
+            self.idle += idle
+            self.items += items
+
+    def report(self):
+        total = self.busy + self.idle
+        utilisation = self.busy / total * 100 if total else 0.0
+        return (f"{self.name}: {self.threads} threads, {self.items} items, busy {self.busy:.1f} s, "
+                f"idle {self.idle:.1f} s ({utilisation:.0f}% busy)")
+
+# Function to format the per-stage report so the bottleneck stage stands out
+def format_stage_report(stages):
+    return '\n'.join(stage.report() for stage in stages)
+
+# Function to run decode -> segment -> composite/encode as overlapped stages
+def run_pipeline(paths, output_path_for, save_output, model_name=None,
+                 reader_threads=None, inference_threads=None, writer_threads=None,
+                 queue_size=None, batch_size=DEFAULT_BATCH_SIZE, cancel_event=None, on_result=None,
+                 read_image=load_image, segment=segment_images):
+    """Return (RunResult, [StageStats]).
+
+    output_path_for(path) gives the output file for an input, or None to skip it.
+    read_image(path) decodes an input on a reader thread and segment(paths,
+    images, model_name) masks a batch of them. save_output(image, mask,
+    output_path) composites and writes one result; if it returns the files
+    it wrote (e.g. several derivatives) they are reported instead.
+    """
+    reader_threads = max(1, reader_threads or DEFAULT_READER_THREADS)
+    inference_threads = max(1, inference_threads or DEFAULT_INFERENCE_THREADS)
+    writer_threads = max(1, writer_threads or DEFAULT_WRITER_THREADS)
+    queue_size = max(1, queue_size or DEFAULT_QUEUE_SIZE)
+
+    result = RunResult()
+    result_lock = threading.Lock()
+    cancel_event = cancel_event or threading.Event()
+    stats = [StageStats('read', reader_threads), StageStats('inference', inference_threads),
+             StageStats('write', writer_threads)]
+    path_queue = queue.Queue()
+    decoded_queue = queue.Queue(maxsize=queue_size)
+    mask_queue = queue.Queue(maxsize=queue_size)
+
+    def record(path, output, error):
+        with result_lock:
+            result.record(path, output, error, on_result)
+
+    # Functions to wait on a queue and count the wait as idle time
+    def timed_get(q, stage):
+        start = time.perf_counter()
+        item = q.get()
+        stage.add(idle=time.perf_counter() - start)
+        return item
+
+    def timed_put(q, item, stage):
+        start = time.perf_counter()
+        q.put(item)
+        stage.add(idle=time.perf_counter() - start)
+
+    def reader():
+        stage = stats[0]
+        while True:
+            path = timed_get(path_queue, stage)
+            if path is _DONE:
+                return
+            if cancel_event.is_set():
+                continue
+            start = time.perf_counter()
+            try:
+                output_path = output_path_for(path)
+                item = (path, read_image(path), output_path) if output_path else None
+            except Exception as e:
+                record(path, None, e)
+                item = None
+            else:
+                if output_path is None:
+                    record(path, None, None)
+            stage.add(busy=time.perf_counter() - start, items=1)
+            if item is not None:
+                timed_put(decoded_queue, item, stage)
+
+    def inference():
+        stage = stats[1]
+        finished = False
+        while not finished:
+            # Take whatever is already decoded, up to batch_size, for one inference
+            batch = [timed_get(decoded_queue, stage)]
+            while len(batch) < batch_size and batch[-1] is not _DONE:
+                try:
+                    batch.append(decoded_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is _DONE:
+                batch.pop()
+                finished = True
+            if not batch:
+                continue
+            start = time.perf_counter()
+            try:
+                masks = segment([path for path, _, _ in batch], [image for _, image, _ in batch], model_name)
+            except Exception as e:
+                for path, _, _ in batch:
+                    record(path, None, e)
+                masks = []
+            stage.add(busy=time.perf_counter() - start, items=len(batch))
+            for (path, image, output_path), mask in zip(batch, masks):
+                timed_put(mask_queue, (path, image, mask, output_path), stage)
+
+    def writer():
+        stage = stats[2]
+        while True:
+            item = timed_get(mask_queue, stage)
+            if item is _DONE:
+                return
+            path, image, mask, output_path = item
+            start = time.perf_counter()
+            try:
+                written = save_output(image, mask, output_path)
+            except Exception as e:
+                record(path, None, e)
+            else:
+                record(path, output_path if written is None else written, None)
+            stage.add(busy=time.perf_counter() - start, items=1)
+
+    def start_threads(target, count):
+        threads = [threading.Thread(target=target, daemon=True) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def join_all(threads):
+        for thread in threads:
+            # Join in short steps so Ctrl-C reaches this thread
+            while thread.is_alive():
+                try:
+                    thread.join(0.5)
+                except KeyboardInterrupt:
+                    cancel_event.set()
+                    result.cancelled = True
+
+    # Warm the session before the clock on the stages starts
+    get_session(model_name)
+    for path in paths:
+        path_queue.put(path)
+    for _ in range(reader_threads):
+        path_queue.put(_DONE)
+
+    readers = start_threads(reader, reader_threads)
+    inferrers = start_threads(inference, inference_threads)
+    writers = start_threads(writer, writer_threads)
+
+    # Close each stage once the one feeding it has drained
+    join_all(readers)
+    for _ in range(inference_threads):
+        decoded_queue.put(_DONE)
+    join_all(inferrers)
+    for _ in range(writer_threads):
+        mask_queue.put(_DONE)
+    join_all(writers)
+
+    if cancel_event.is_set():
+        result.cancelled = True
+    return result.finish(), stats
@@ -0,0 +1,189 @@
+import os
+import time
+from PIL import Image
+from session_profiles import get_profile, session_options
+
+# Model names accepted in config, mapped to the rembg model they load
+MODEL_ALIASES = {
+    'u2net': 'u2net',
+    'u2netp': 'u2netp',
+    'isnet': 'isnet-general-use',
+    'silueta': 'silueta',
+}
+
+# Model used when none is given; set BG_REMOVER_MODEL to change it for every tool
+DEFAULT_MODEL = os.environ.get('BG_REMOVER_MODEL', 'u2net')
+# Model for the listing-thumbnail tools, where a lighter model's edges are lost in the downscale
+THUMB_MODEL = os.environ.get('BG_REMOVER_THUMB_MODEL', DEFAULT_MODEL)
+
+# Folder of locally stored models, e.g. INT8-quantised exports; set BG_REMOVER_MODEL_DIR to use them
+MODEL_DIR = os.environ.get('BG_REMOVER_MODEL_DIR') or None
+if MODEL_DIR:
+    # rembg finds the built-in models there too and only accepts custom model files under U2NET_HOME,
+    # so nothing is downloaded
+    os.environ.setdefault('U2NET_HOME', MODEL_DIR)
+
+# Architectures a local model file can hold, by file name prefix (u2netp before u2net):
+# (rembg session that loads a model file, built-in model whose preprocessing it uses)
+LOCAL_ARCHITECTURES = (
+    ('isnet', 'dis_custom', 'isnet-general-use'),
+    ('u2netp', 'u2net_custom', 'u2netp'),
+    ('silueta', 'u2net_custom', 'silueta'),
+    ('u2net', 'u2net_custom', 'u2net'),
+)
+
+class SessionTimings:
+    """Session setup and steady-state inference times for one run"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.session_seconds = {}
+        self.inference_seconds = 0.0
+        self.inference_count = 0
+
+    def add_session(self, model_name, seconds):
+        self.session_seconds[model_name] = self.session_seconds.get(model_name, 0.0) + seconds
+
+    def add_inference(self, seconds, count=1):
+        self.inference_seconds += seconds
+        self.inference_count += count
+
+    def summary(self):
+        mean = self.inference_seconds / self.inference_count if self.inference_count else 0.0
+        return {
+            'session_seconds': dict(self.session_seconds),
+            'inference_seconds': self.inference_seconds,
+            'inference_count': self.inference_count,
+            'inference_mean_seconds': mean,
+        }
+
+    def report(self):
+        summary = self.summary()
+        if summary['session_seconds']:
+            setup = ', '.join(f"{name} {seconds:.2f} s" for name, seconds in summary['session_seconds'].items())
+        else:
+            setup = "reused warm session"
+        return (f"Session setup: {setup}; inference: {summary['inference_count']} images, "
+                f"{summary['inference_seconds']:.2f} s total, {summary['inference_mean_seconds']:.3f} s/image")
+
+# Timings for the current run, shared by every entry point in this process
+timings = SessionTimings()
+
+# Warm sessions keyed by (model name, providers, session profile)
+_sessions = {}
+
+# Local models found in MODEL_DIR, read on first use
+_local_models = None
+
+# Function to list the local models: {name: (model file, rembg session name, base model)}
+def get_local_models():
+    """Every .onnx file in MODEL_DIR whose name starts with a known architecture.
+
+    A model is named by its file, so u2net_int8.onnx is the model
+    'u2net_int8'. Files named like a built-in model (u2net.onnx) are that
+    built-in model, which rembg then loads from MODEL_DIR.
+    """
+    global _local_models
+    if _local_models is None:
+        _local_models = {}
+        filenames = sorted(os.listdir(MODEL_DIR)) if MODEL_DIR and os.path.isdir(MODEL_DIR) else []
+        for filename in filenames:
+            name, ext = os.path.splitext(filename)
+            name = name.lower()
+            if ext.lower() != '.onnx' or name in MODEL_ALIASES or name in MODEL_ALIASES.values():
+                continue
+            for prefix, session_name, base in LOCAL_ARCHITECTURES:
+                if name.startswith(prefix):
+                    _local_models[name] = (os.path.join(MODEL_DIR, filename), session_name, base)
+                    break
+    return _local_models
+
+# Function to list every model name the tools accept
+def available_models():
+    return sorted(MODEL_ALIASES) + sorted(get_local_models())
+
+# Function to map a configured model name to the rembg model name, or the name of a local model
+def resolve_model_name(model_name=None):
+    name = (model_name or DEFAULT_MODEL).strip().lower()
+    if name in MODEL_ALIASES:
+        return MODEL_ALIASES[name]
+    if name in MODEL_ALIASES.values() or name in get_local_models():
+        return name
+    raise ValueError(f"Unknown model '{model_name}'. Choose one of: {', '.join(available_models())}")
+
+# Function to get the built-in model whose input size and normalisation a model uses
+def base_model(model_name=None):
+    name = resolve_model_name(model_name)
+    local = get_local_models().get(name)
+    return local[2] if local else name
+
+# Function to get the ONNX file a model is loaded from
+def model_path(model_name=None):
+    name = resolve_model_name(model_name)
+    local = get_local_models().get(name)
+    if local:
+        return local[0]
+    model_home = os.environ.get('U2NET_HOME', os.path.join(os.path.expanduser('~'), '.u2net'))
+    return os.path.join(model_home, f"{name}.onnx")
+
+# Function to keep the preferred execution providers this onnxruntime build has, falling back to the CPU
+def available_providers(preferred):
+    import onnxruntime
+    installed = onnxruntime.get_available_providers()
+    providers = [provider for provider in preferred if provider in installed]
+    if 'CPUExecutionProvider' not in providers:
+        providers.append('CPUExecutionProvider')
+    return providers
+
+# Function to create a rembg session whose onnxruntime session is built with the given options
+def new_session(session_name, sess_opts, **kwargs):
+    """Construct the rembg session class for session_name the way rembg's new_session does.
+
+    rembg's new_session builds its own SessionOptions and passes them to the
+    session class positionally, so most releases have no way to take ours;
+    the session classes themselves all take (model_name, sess_opts, ...).
+    """
+    # Imported here so tools that never segment start without rembg and onnxruntime
+    from rembg.sessions import sessions_class
+    for session_class in sessions_class:
+        if session_class.name() == session_name:
+            return session_class(session_name, sess_opts, **kwargs)
+    raise ValueError(f"rembg has no session for model '{session_name}'")
+
+# Function to get a warm session for a model, creating it on first use with this process's session profile
+def get_session(model_name=None, providers=None):
+    name = resolve_model_name(model_name)
+    profile = get_profile()
+    key = (name, tuple(providers) if providers else None, profile)
+    session = _sessions.get(key)
+    if session is None:
+        start = time.perf_counter()
+        options = {}
+        if providers:
+            options['providers'] = list(providers)
+        local = get_local_models().get(name)
+        if local:
+            # Loaded from its file by rembg's custom-model session; never downloaded
+            session = new_session(local[1], session_options(profile), model_path=local[0], **options)
+        else:
+            session = new_session(name, session_options(profile), **options)
+        # Run one dummy inference so the first real image does not pay for graph setup
+        session.predict(Image.new('RGB', (64, 64)))
+        timings.add_session(name, time.perf_counter() - start)
+        _sessions[key] = session
+    return session
+
+# Function to drop every warm session, freeing its memory
+def clear_sessions():
+    _sessions.clear()
+
+# Function to remove the background using the shared session for the model
+def remove_background(data, model_name=None, providers=None, **kwargs):
+    from rembg import remove
+    session = get_session(model_name, providers)
+    start = time.perf_counter()
+    output = remove(data, session=session, **kwargs)
+    timings.add_inference(time.perf_counter() - start)
+    return output
@@ -0,0 +1,100 @@
+import json
+import os
+import time
+
+# Journal file written into the folder the UPC rename tools process
+JOURNAL_NAME = '.upc_rename_journal.jsonl'
+
+# Function to get the journal path for a folder
+def journal_path(folder_path):
+    return os.path.join(folder_path, JOURNAL_NAME)
+
+class RenameJournal:
+    """Append-only JSON-lines record of one rename run.
+
+    The plan (every rename and move, with the barcode behind it) is written
+    and synced before the first file is touched. Each step then appends a
+    status line as soon as it has happened: 'done', 'failed' or, after an
+    undo, 'undone'. Steps held back because of a name collision are kept
+    in the plan with the reason and never applied.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.header = None
+        self.steps = []
+        self.status = {}
+        self._file = None
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as journal_file:
+                for line in journal_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A line torn by a crash mid-write
+                        continue
+                    if record['type'] == 'plan':
+                        self.header = record
+                    elif record['type'] == 'step':
+                        self.steps.append(record)
+                    else:
+                        self.status[record['seq']] = record
+        except FileNotFoundError:
+            pass
+
+    @classmethod
+    def create(cls, path, folder_path, recursive, steps):
+        """Write a new journal holding the plan; steps are dicts with kind, src, dst, barcode fields and blocked"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as journal_file:
+            journal_file.write(json.dumps({'type': 'plan', 'folder': os.path.abspath(folder_path),
+                                           'recursive': recursive, 'created': time.time()}) + '\n')
+            for seq, step in enumerate(steps):
+                journal_file.write(json.dumps(dict(step, type='step', seq=seq)) + '\n')
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        os.replace(tmp_path, path)
+        return cls(path)
+
+    def exists(self):
+        return self.header is not None
+
+    def unfinished(self):
+        """Return the planned steps that have no status yet, i.e. were cut off by a crash"""
+        return [step for step in self.steps if not step['blocked'] and step['seq'] not in self.status]
+
+    def pending(self):
+        """Return the steps a resume should apply: unfinished ones and those that failed"""
+        return [step for step in self.steps if not step['blocked']
+                and self.status.get(step['seq'], {}).get('status', 'failed') == 'failed']
+
+    def record(self, seq, status, error=None):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        record = {'type': 'status', 'seq': seq, 'status': status, 'time': time.time()}
+        if error is not None:
+            record['error'] = str(error)
+        self.status[seq] = record
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+
+    def archive(self):
+        """Move a finished journal aside, named by when its run was planned, so a new run can start"""
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(self.header['created']))
+        base = os.path.join(os.path.dirname(self.path), f"{JOURNAL_NAME[:-len('.jsonl')]}-{stamp}")
+        archived = base + '.jsonl'
+        count = 1
+        while os.path.exists(archived):
+            count += 1
+            archived = f"{base}-{count}.jsonl"
+        self.close()
+        os.replace(self.path, archived)
+        return archived
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
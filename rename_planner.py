@@ -0,0 +1,412 @@
+import functools
+import os
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from rename_journal import RenameJournal, journal_path
+from upc_barcode import BarcodeResult, infer_type_from_data, scan_barcode, stage_counts
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+NOT_DETECTABLE = "Not_detectable"
+
+# Processes decoding barcodes; shares BG_REMOVER_WORKERS with the background removal runs
+SCAN_WORKERS = int(os.environ.get('BG_REMOVER_WORKERS', str(os.cpu_count() or 1)))
+
+# One planned step: kind is 'front', 'back', 'single', 'skip' or 'move'; barcode is a BarcodeResult or None
+RenameAction = namedtuple('RenameAction', 'kind src dst barcode')
+
+# Function to list the sorted image files of each folder the rename tools process
+def collect_folders(folder_path, recursive=False):
+    """Return [(folder, sorted filenames)] in the order the folders are processed"""
+    if not recursive:
+        files = [f for f in os.listdir(folder_path) if f.lower().endswith(IMAGE_EXTENSIONS)]
+        return [(folder_path, sorted(files))]
+    not_detectable_folder = os.path.join(folder_path, NOT_DETECTABLE)
+    folders = []
+    for root, _, files in os.walk(folder_path):
+        # Skip the Not_detectable folder
+        if root == not_detectable_folder:
+            continue
+        folders.append((root, sorted(f for f in files if f.lower().endswith(IMAGE_EXTENSIONS))))
+    return folders
+
+# Function to decode one image in a worker; errors come back as messages so one bad file cannot stop the pool
+def _scan_one(image_path, legacy=False):
+    """Return (BarcodeResult or None, error message or None, the passes counted for it)"""
+    before = Counter(stage_counts)
+    try:
+        result, error = scan_barcode(image_path, legacy=legacy), None
+    except Exception as e:
+        result, error = None, f"Error detecting barcode in {image_path}: {str(e)}"
+    # What this image added to the pass counts: its decode pass, 'index' or 'none'
+    return result, error, stage_counts - before
+
+# Function to decode every image up front, on a process pool when there is more than one
+def scan_barcodes(paths, workers=None, legacy=False):
+    """Return {path: BarcodeResult or None}; legacy names codes as the Orlando tools do"""
+    workers = min(workers or SCAN_WORKERS, len(paths))
+    scan_one = functools.partial(_scan_one, legacy=legacy)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(scan_one, paths, chunksize=max(1, len(paths) // (workers * 8))))
+    else:
+        results = [scan_one(path) for path in paths]
+
+    barcodes = {}
+    for path, (result, error, counted) in zip(paths, results):
+        if error is not None:
+            print(error)
+        if workers > 1:
+            # Workers counted in their own processes; add every image's passes to this run's report
+            stage_counts.update(counted)
+        barcodes[path] = result
+    return barcodes
+
+# Function to plan the renames for every folder with the front/back pairing rules of the rename tools
+def plan_renames(folders, barcodes, folder_path, recursive=False):
+    """Return (actions, undetected paths) without touching the filesystem.
+
+    Files are taken in sorted order. When an image has a barcode and the image
+    before it has not been renamed (and is not already named by that code),
+    the earlier image is the front and this one the back: <UPC>_back, or
+    back_<UPC> in recursive mode. Flat mode leaves the image alone when the
+    previous file is already named by the code; recursive mode names it <UPC>.
+    Undetected images starting with a letter are moved to Not_detectable.
+    """
+    actions = []
+    renamed = set()
+    undetected = []
+    for root, image_files in folders:
+        for i, filename in enumerate(image_files):
+            full_path = os.path.join(root, filename)
+            if full_path in renamed:
+                continue
+            barcode = barcodes.get(full_path)
+            if barcode is None:
+                undetected.append(full_path)
+                continue
+
+            curr_ext = os.path.splitext(filename)[1]
+            single = RenameAction('single', full_path, os.path.join(root, f"{barcode.ean13}{curr_ext}"), barcode)
+            if i == 0:
+                # First image with barcode, rename it alone
+                actions.append(single)
+                renamed.add(full_path)
+                continue
+
+            prev_filename = image_files[i - 1]
+            prev_full_path = os.path.join(root, prev_filename)
+            prev_base_name, prev_ext = os.path.splitext(prev_filename)
+            if prev_full_path not in renamed and prev_base_name != barcode.ean13:
+                # Rename both previous (front) and current (back) pictures
+                back_name = f"back_{barcode.ean13}{curr_ext}" if recursive else f"{barcode.ean13}_back{curr_ext}"
+                actions.append(RenameAction('front', prev_full_path,
+                                            os.path.join(root, f"{barcode.ean13}{prev_ext}"), barcode))
+                actions.append(RenameAction('back', full_path, os.path.join(root, back_name), barcode))
+                renamed.update((prev_full_path, full_path))
+            elif recursive or prev_full_path in renamed:
+                # Previous picture already renamed (or named by this code in recursive mode), rename current only
+                actions.append(single)
+                renamed.add(full_path)
+            else:
+                actions.append(RenameAction('skip', prev_full_path, None, barcode))
+
+    # Undetected files starting with a letter go to Not_detectable, unless they were renamed as a front image
+    not_detectable_folder = os.path.join(folder_path, NOT_DETECTABLE)
+    for path in undetected:
+        filename = os.path.basename(path)
+        if path not in renamed and filename[0].isalpha():
+            actions.append(RenameAction('move', path, os.path.join(not_detectable_folder, filename), None))
+    return actions, undetected
+
+# Function to find planned renames that would overwrite another image, before anything is touched
+def find_collisions(actions, together=()):
+    """Return {action index: reason} for the renames and moves that must be held back.
+
+    The first image planned onto a name keeps it. A later image decoding to
+    the same UPC, or a name already taken on disk, is held back together
+    with the other half of its front/back pair. together lists further
+    groups of action indexes that are held back all or none. Only names
+    that are actually taken count: an image held back with its partner
+    leaves its name free for a later one.
+    """
+    def key(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    moved_from = {key(action.src): i for i, action in enumerate(actions)
+                  if action.dst is not None and key(action.dst) != key(action.src)}
+
+    # Front and back are renamed together or not at all, as is each group in together
+    unit_of = list(range(len(actions)))
+
+    def unit(i):
+        while unit_of[i] != i:
+            i = unit_of[i] = unit_of[unit_of[i]]
+        return i
+
+    for group in [(i, i + 1) for i, action in enumerate(actions) if action.kind == 'front'] + list(together):
+        for i in group[1:]:
+            unit_of[unit(i)] = unit(group[0])
+    units = {}
+    for i in range(len(actions)):
+        units.setdefault(unit(i), []).append(i)
+
+    # Decided in plan order; a unit only takes its names once all of it can go ahead
+    claimed = {}
+    blocked = {}
+    for members in sorted(units.values()):
+        names = {}
+        reason = None
+        for i in members:
+            action = actions[i]
+            if action.dst is None:
+                continue
+            dst = key(action.dst)
+            if dst in claimed or dst in names:
+                owner = claimed[dst] if dst in claimed else names[dst]
+                reason = f"{os.path.basename(owner)} is also named {os.path.basename(action.dst)}"
+                break
+            mover = moved_from.get(dst)
+            if dst != key(action.src) and os.path.exists(action.dst) and (mover is None or mover > i or mover in blocked):
+                reason = f"{action.dst} already exists"
+                break
+            names[dst] = action.src
+        if reason is None:
+            claimed.update(names)
+        else:
+            blocked.update((i, reason) for i in members)
+    return blocked
+
+# Function to add the renames of the files written in place of the planned images
+def _with_outputs(actions, output_for):
+    """Return (actions, [(original index, output index)]).
+
+    Each image's output file takes the same new name with its own extension,
+    so a PNG original ends up next to its JPG as when the tools run one
+    after the other. A front/back pair's outputs follow the pair, keeping
+    the two halves of each pair adjacent. Outputs never written, or that
+    are the original itself, add nothing.
+    """
+    mapped = []
+    twins = []
+    i = 0
+    while i < len(actions):
+        run = actions[i:i + 2] if actions[i].kind == 'front' else actions[i:i + 1]
+        start = len(mapped)
+        mapped.extend(run)
+        outputs = [(j, action._replace(src=output_for(action.src), dst=output_for(action.dst)))
+                   for j, action in enumerate(run) if action.dst is not None]
+        outputs = [(j, output) for j, output in outputs if output.src != run[j].src and os.path.exists(output.src)]
+        for j, output in outputs:
+            # Half a pair left on its own is renamed like a single image
+            twins.append((start + j, len(mapped)))
+            mapped.append(output if len(outputs) == len(run) else output._replace(kind='single'))
+        i += len(run)
+    return mapped, twins
+
+# Function to describe one step of a plan, as done or as it would be done
+def describe_action(action, dry_run=False):
+    if action.kind == 'move':
+        verb = "Would move" if dry_run else "Moved"
+        return (f"{verb} {os.path.basename(action.src)} from {os.path.dirname(action.src)} to {action.dst} "
+                f"(Not_detectable folder)")
+    verb = "Would rename" if dry_run else "Renamed"
+    label = {'front': "front image", 'back': "back image", 'single': "image"}[action.kind]
+    return (f"{verb} {label}: {os.path.basename(action.src)} -> {os.path.basename(action.dst)} "
+            f"(Barcode Type: {action.barcode.symbology}, Raw Data: {action.barcode.raw})")
+
+# Function to carry out a plan in order, reporting each step
+def apply_plan(actions, on_status=None):
+    """Return the set of source paths renamed or moved.
+
+    on_status(index, status, error=None) is called after each rename or move
+    with 'done' or 'failed', e.g. to record it in the journal.
+    """
+    done = set()
+    failed_front = False
+    for i, action in enumerate(actions):
+        barcode = action.barcode
+        if action.kind == 'skip':
+            inferred_type = infer_type_from_data(barcode.raw or barcode.ean13)
+            print(f"Skipping rename: {os.path.basename(action.src)} matches or already renamed with barcode "
+                  f"{barcode.ean13} (Detected Type: {barcode.symbology}, Inferred Type: {inferred_type})")
+            continue
+        if action.kind == 'back' and failed_front:
+            # Front and back are renamed together or not at all
+            if on_status:
+                on_status(i, 'failed', "front image was not renamed")
+            continue
+        try:
+            os.rename(action.src, action.dst)
+        except OSError as e:
+            failed_front = action.kind == 'front'
+            print(f"Error renaming {os.path.basename(action.src)}: {str(e)}")
+            if on_status:
+                on_status(i, 'failed', e)
+            continue
+        failed_front = False
+        done.add(action.src)
+        if on_status:
+            on_status(i, 'done')
+        print(describe_action(action))
+    return done
+
+# Function to turn a planned action into the dict the journal stores
+def _to_step(action, blocked=None):
+    barcode = action.barcode._asdict() if action.barcode else {}
+    return {'kind': action.kind, 'src': action.src, 'dst': action.dst, 'barcode': barcode, 'blocked': blocked}
+
+# Function to turn a journal step back into an action, without decoding the image again
+def _from_step(step):
+    barcode = BarcodeResult(**step['barcode']) if step['barcode'] else None
+    return RenameAction(step['kind'], step['src'], step['dst'], barcode)
+
+# Function to tell whether a step took effect on disk, for steps whose status line a crash cut off
+def _was_applied(step):
+    return step['src'] != step['dst'] and not os.path.exists(step['src']) and os.path.exists(step['dst'])
+
+# Function to scan, plan and rename the product images in a folder (and its subfolders when recursive)
+def rename_by_barcode(folder_path, recursive=False, workers=None, dry_run=False, legacy=False):
+    """Return (renamed source paths, undetected paths, [(held back source path, reason)]).
+
+    The plan is journalled in the folder before anything is renamed, so the
+    run can be resumed or undone with resume_renames / undo_renames. With
+    dry_run the plan is only printed and nothing is written. legacy names
+    the files as the Orlando tools do (see upc_barcode.convert_to_ean13).
+    """
+    check_journal(folder_path, dry_run)
+    folders = collect_folders(folder_path, recursive)
+    paths = [os.path.join(root, filename) for root, image_files in folders for filename in image_files]
+    barcodes = scan_barcodes(paths, workers, legacy)
+    applied, undetected, held_back = rename_scanned(folder_path, folders, barcodes, recursive, dry_run)
+    renamed = {action.src for action in applied if action.kind != 'move'}
+    return renamed, undetected, held_back
+
+# Function to refuse a new run while the folder's journal records one that was cut off
+def check_journal(folder_path, dry_run=False):
+    journal = RenameJournal(journal_path(folder_path))
+    if journal.unfinished() and not dry_run:
+        raise RuntimeError(f"{journal.path} records an unfinished run; resume or undo it first")
+    return journal
+
+# Function to plan, journal and apply the renames for images whose barcodes are already known
+def rename_scanned(folder_path, folders, barcodes, recursive=False, dry_run=False, output_for=None):
+    """Return ([applied RenameAction], undetected paths, [(held back source path, reason)]).
+
+    output_for(path) maps a planned image to a file written in its place,
+    e.g. its cropped JPG, which is renamed or moved along with it and keeps
+    its own extension.
+    """
+    journal = check_journal(folder_path, dry_run)
+    actions, undetected = plan_renames(folders, barcodes, folder_path, recursive)
+    twins = []
+    if output_for is not None:
+        actions, twins = _with_outputs(actions, output_for)
+    blocked = find_collisions(actions, twins)
+
+    for path in undetected:
+        base_name = os.path.splitext(os.path.basename(path))[0]
+        if base_name.isdigit() and len(base_name) in [12, 13]:
+            print(f"No barcode found in: {path} (Inferred Type from filename: {infer_type_from_data(base_name)})")
+        else:
+            print(f"No barcode found in: {path}")
+    held_back = [(actions[i].src, reason) for i, reason in sorted(blocked.items())]
+    for src, reason in held_back:
+        print(f"Not renaming {os.path.basename(src)}: {reason}")
+
+    # The journal holds every rename and move, held-back ones included; seq_of maps runnable ones to it
+    runnable = []
+    steps = []
+    seq_of = {}
+    for i, action in enumerate(actions):
+        if i not in blocked:
+            if action.kind != 'skip':
+                seq_of[len(runnable)] = len(steps)
+            runnable.append(action)
+        if action.kind != 'skip':
+            steps.append(_to_step(action, blocked.get(i)))
+    if dry_run:
+        for action in runnable:
+            if action.kind != 'skip':
+                print(describe_action(action, dry_run=True))
+        return [action for action in runnable if action.kind != 'skip'], undetected, held_back
+
+    # Create Not_detectable subfolder if it doesn't exist
+    os.makedirs(os.path.join(folder_path, NOT_DETECTABLE), exist_ok=True)
+    if journal.exists():
+        journal.archive()
+    journal = RenameJournal.create(journal_path(folder_path), folder_path, recursive, steps)
+    try:
+        done = apply_plan(runnable, lambda i, status, error=None: journal.record(seq_of[i], status, error))
+    finally:
+        journal.close()
+    return [action for action in runnable if action.kind != 'skip' and action.src in done], undetected, held_back
+
+# Function to tell whether a folder's journal records a run that was cut off
+def has_unfinished_run(folder_path):
+    return bool(RenameJournal(journal_path(folder_path)).unfinished())
+
+# Function to finish a run cut off by a crash, or retry its failed steps, from the journal alone
+def resume_renames(folder_path):
+    """Return (renamed or moved source paths, [(source path, error)] for steps that failed again)"""
+    journal = RenameJournal(journal_path(folder_path))
+    if not journal.exists():
+        raise RuntimeError(f"No rename journal in {folder_path}")
+    os.makedirs(os.path.join(folder_path, NOT_DETECTABLE), exist_ok=True)
+
+    applied = set()
+    pending = []
+    for step in journal.pending():
+        if step['seq'] not in journal.status and _was_applied(step):
+            # Renamed just before the crash; only its status line is missing
+            journal.record(step['seq'], 'done')
+            applied.add(step['src'])
+        else:
+            pending.append(step)
+    failures = []
+
+    def on_status(i, status, error=None):
+        journal.record(pending[i]['seq'], status, error)
+        if status == 'failed':
+            failures.append((pending[i]['src'], str(error)))
+
+    try:
+        applied |= apply_plan([_from_step(step) for step in pending], on_status)
+    finally:
+        journal.close()
+    return applied, failures
+
+# Function to put every file a journalled run renamed or moved back where it was, newest first
+def undo_renames(folder_path):
+    """Return (restored source paths, [(source path, reason)] for files that could not be restored)"""
+    journal = RenameJournal(journal_path(folder_path))
+    if not journal.exists():
+        raise RuntimeError(f"No rename journal in {folder_path}")
+
+    restored = set()
+    failures = []
+    try:
+        for step in reversed(journal.steps):
+            status = journal.status.get(step['seq'], {}).get('status')
+            if step['blocked'] or status in ('failed', 'undone'):
+                continue
+            if status is None and not _was_applied(step):
+                # Cut off by a crash before it ran; nothing to put back
+                journal.record(step['seq'], 'undone')
+                continue
+            if step['src'] != step['dst']:
+                if os.path.exists(step['src']):
+                    failures.append((step['src'], f"{step['src']} exists again"))
+                    print(f"Not restoring {os.path.basename(step['dst'])}: {step['src']} exists again")
+                    continue
+                try:
+                    os.rename(step['dst'], step['src'])
+                except OSError as e:
+                    failures.append((step['src'], str(e)))
+                    print(f"Error restoring {os.path.basename(step['dst'])}: {str(e)}")
+                    continue
+                print(f"Restored {step['dst']} -> {os.path.basename(step['src'])}")
+            journal.record(step['seq'], 'undone')
+            restored.add(step['src'])
+    finally:
+        journal.close()
+    return restored, failures
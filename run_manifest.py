@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import threading
+from write_behind import get_writer
+
+# Manifest file written into the folder a run processes
+MANIFEST_NAME = '.bg_remover_manifest.jsonl'
+
+# Function to walk a directory tree and return (path, size, mtime_ns) for each image
+def scan_images(src_dir, extensions):
+    """Uses os.scandir so sizes and mtimes come from the directory listing where the OS provides them"""
+    found = []
+    pending_dirs = [src_dir]
+    while pending_dirs:
+        current = pending_dirs.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending_dirs.append(entry.path)
+                    elif entry.name.lower().endswith(extensions):
+                        st = entry.stat()
+                        found.append((entry.path, st.st_size, st.st_mtime_ns))
+        except OSError:
+            continue
+    found.sort()
+    return found
+
+# Function to stat an explicit list of files the same way scan_images reports them
+def stat_paths(paths):
+    found = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        found.append((path, st.st_size, st.st_mtime_ns))
+    return found
+
+# Function to hash the bytes of an input file
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as img_file:
+        for chunk in iter(lambda: img_file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class RunManifest:
+    """Append-only JSON-lines record of every input a run has handled.
+
+    Each result is written and flushed as soon as it is known, so a crash
+    loses at most the files that were in flight. On the next run only inputs
+    that are new, changed (size or mtime) or previously failed are returned
+    by pending(); outputs are never stat'ed at startup.
+    """
+
+    def __init__(self, manifest_path):
+        self.path = manifest_path
+        self.entries = {}
+        self._inputs = {}
+        self._lock = threading.Lock()
+        lines = self._load()
+        # Rewrite the manifest once it holds mostly superseded records
+        if lines > 2 * len(self.entries) + 1000:
+            self._compact()
+        self._file = open(manifest_path, 'a', encoding='utf-8')
+
+    def _load(self):
+        lines = 0
+        try:
+            with open(self.path, encoding='utf-8') as manifest_file:
+                for line in manifest_file:
+                    lines += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A line torn by a crash mid-write
+                        continue
+                    self.entries[record['path']] = record
+        except FileNotFoundError:
+            pass
+        return lines
+
+    def _compact(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as manifest_file:
+            for record in self.entries.values():
+                manifest_file.write(json.dumps(record) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def pending(self, scanned):
+        """Return the paths from scan_images/stat_paths that still need processing"""
+        todo = []
+        for path, size, mtime_ns in scanned:
+            record = self.entries.get(path)
+            if (record is None or record['status'] == 'failed'
+                    or record['size'] != size or record['mtime_ns'] != mtime_ns):
+                self._inputs[path] = (size, mtime_ns)
+                todo.append(path)
+        return todo
+
+    def _write(self, record):
+        self.entries[record['path']] = record
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+
+    def record_result(self, path, output, error):
+        """Record one result; has the on_result(path, output, error) signature of the runners"""
+        writer = get_writer()
+        if (writer is not None and error is None and isinstance(output, str)
+                and writer.after_write(output, lambda: self.record_result(path, output, error))):
+            # Record it once the output has landed, so its size and mtime are the final ones
+            return
+        size, mtime_ns = self._inputs.get(path, (None, None))
+        with self._lock:
+            if error is not None:
+                self._write({'path': path, 'size': size, 'mtime_ns': mtime_ns, 'output': None,
+                             'status': 'failed', 'error': str(error)})
+                return
+            if output is None:
+                self._write({'path': path, 'size': size, 'mtime_ns': mtime_ns, 'output': None,
+                             'status': 'skipped'})
+                return
+            if isinstance(output, (list, tuple)):
+                # Several derivatives written into a separate output tree
+                self._write({'path': path, 'size': size, 'mtime_ns': mtime_ns, 'output': list(output),
+                             'status': 'done'})
+                return
+            try:
+                st = os.stat(output)
+                output_stat = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                output_stat = None
+            if os.path.abspath(output) == os.path.abspath(path):
+                # The input was overwritten in place; remember it as it is now
+                size, mtime_ns = output_stat or (size, mtime_ns)
+            elif output_stat:
+                # Outputs written next to the inputs must not look like new inputs next time
+                self._write({'path': output, 'size': output_stat[0], 'mtime_ns': output_stat[1],
+                             'output': output, 'status': 'output'})
+            self._write({'path': path, 'size': size, 'mtime_ns': mtime_ns, 'output': output,
+                         'status': 'done'})
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,149 @@
+import json
+import os
+import platform
+import time
+from collections import namedtuple
+
+# Profile every segmentation session uses: a built-in name, 'saved' for the one tune-session picked on
+# this machine, or 'auto' for the saved one when there is one and onnxruntime's defaults otherwise
+SESSION_PROFILE = os.environ.get('BG_REMOVER_SESSION_PROFILE', 'auto')
+SESSION_PROFILE_PATH = os.environ.get('BG_REMOVER_SESSION_PROFILE_PATH',
+                                      os.path.join(os.path.expanduser('~'), '.cache', 'bg_remover',
+                                                   'session_profile.json'))
+
+# ONNX Runtime settings for a session; 0 threads leaves the count to onnxruntime
+SessionProfile = namedtuple('SessionProfile', 'name intra_op_threads inter_op_threads execution_mode '
+                                              'graph_optimization cpu_mem_arena mem_pattern')
+
+EXECUTION_MODES = ('sequential', 'parallel')
+GRAPH_OPTIMIZATIONS = ('disable', 'basic', 'extended', 'all')
+
+_cores = os.cpu_count() or 1
+
+# Candidate profiles tune-session tries; 'default' is what rembg gets without any options
+PROFILES = {profile.name: profile for profile in (
+    SessionProfile('default', 0, 0, 'sequential', 'all', True, True),
+    SessionProfile('all-cores', _cores, 1, 'sequential', 'all', True, True),
+    # One thread per physical core on machines with two hardware threads per core
+    SessionProfile('half-cores', max(1, _cores // 2), 1, 'sequential', 'all', True, True),
+    SessionProfile('parallel', max(1, _cores // 2), 2, 'parallel', 'all', True, True),
+    SessionProfile('extended', _cores, 1, 'sequential', 'extended', True, True),
+    SessionProfile('lean-memory', _cores, 1, 'sequential', 'all', False, False),
+)}
+
+# Profile set for this process by use_profile, else loaded from the environment and the saved file
+_profile = None
+# Share of the cores a pool worker's sessions may use; None outside pool workers
+_worker_threads = None
+
+# Function to load the profile tune-session saved, or None if there is none for this machine
+def load_saved_profile(path=SESSION_PROFILE_PATH):
+    try:
+        with open(path, encoding='utf-8') as profile_file:
+            saved = json.load(profile_file)
+    except (FileNotFoundError, ValueError):
+        return None
+    # A home folder shared between render boxes must not hand one box's tuning to another
+    if saved.get('machine') != platform.node():
+        return None
+    return SessionProfile(*(saved['profile'][field] for field in SessionProfile._fields))
+
+# Function to save a profile as the fastest for this machine
+def save_profile(profile, images_per_sec, path=SESSION_PROFILE_PATH):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as profile_file:
+        json.dump({'machine': platform.node(), 'cpu_count': _cores, 'images_per_sec': images_per_sec,
+                   'saved': time.time(), 'profile': profile._asdict()}, profile_file, indent=2)
+    os.replace(tmp_path, path)
+
+# Function to look up a profile by name: a built-in one or 'saved'
+def resolve_profile(name):
+    if name in PROFILES:
+        return PROFILES[name]
+    if name in ('saved', 'auto'):
+        saved = load_saved_profile()
+        if saved is None and name == 'saved':
+            raise ValueError(f"No saved session profile for this machine in {SESSION_PROFILE_PATH}; "
+                             f"run the tune-session command first")
+        return saved or PROFILES['default']
+    raise ValueError(f"Unknown session profile '{name}'. Choose one of: {', '.join(PROFILES)}, saved, auto")
+
+# Function to get the profile sessions of this process are created with
+def get_profile():
+    global _profile
+    if _profile is None:
+        _profile = resolve_profile(SESSION_PROFILE)
+    return _profile
+
+# Function to make this process create its sessions with another profile
+def use_profile(profile):
+    global _profile
+    _profile = profile
+
+# Function to mark this process as a pool worker whose sessions may use only some of the cores
+def set_worker_threads(threads):
+    global _worker_threads
+    _worker_threads = threads
+
+# Function to turn a profile into onnxruntime session options
+def session_options(profile):
+    """Return an onnxruntime.SessionOptions for the profile.
+
+    In pool workers, which split the cores between processes, the
+    profile's thread counts are capped at the worker's share.
+    """
+    # Imported here so the profile settings can be read without loading onnxruntime
+    import onnxruntime
+    options = onnxruntime.SessionOptions()
+    intra, inter = profile.intra_op_threads, profile.inter_op_threads
+    if _worker_threads:
+        intra, inter = min(intra or _worker_threads, _worker_threads), min(inter or _worker_threads, _worker_threads)
+    options.intra_op_num_threads = intra
+    options.inter_op_num_threads = inter
+    options.execution_mode = (onnxruntime.ExecutionMode.ORT_PARALLEL if profile.execution_mode == 'parallel'
+                              else onnxruntime.ExecutionMode.ORT_SEQUENTIAL)
+    options.graph_optimization_level = {
+        'disable': onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        'basic': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        'extended': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        'all': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }[profile.graph_optimization]
+    options.enable_cpu_mem_arena = profile.cpu_mem_arena
+    options.enable_mem_pattern = profile.mem_pattern
+    return options
+
+# Function to time segmentation of some decoded images under each profile
+def benchmark_profiles(images, profiles, model_name=None, repeat=3, on_result=None):
+    """Return [(profile, images_per_sec)], fastest first.
+
+    Each profile gets a fresh, warmed session and segments the images
+    repeat times the way the batch tools do; the best pass counts, so a
+    pass slowed by other work on the machine does not decide the result.
+    on_result(profile, images_per_sec) is called after each profile.
+    """
+    # Imported here to keep this module loadable without rembg
+    from batch_segment import DEFAULT_BATCH_SIZE, iter_batches, segment_batch
+    from rembg_session import clear_sessions, get_session
+    previous = get_profile()
+    results = []
+    try:
+        for profile in profiles:
+            use_profile(profile)
+            clear_sessions()
+            get_session(model_name)
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for batch in iter_batches(images, DEFAULT_BATCH_SIZE):
+                    segment_batch(batch, model_name)
+                seconds = time.perf_counter() - start
+                best = seconds if best is None else min(best, seconds)
+            images_per_sec = round(len(images) / best, 3) if best else 0.0
+            results.append((profile, images_per_sec))
+            if on_result:
+                on_result(profile, images_per_sec)
+    finally:
+        use_profile(previous)
+        clear_sessions()
+    return sorted(results, key=lambda result: result[1], reverse=True)
@@ -0,0 +1,160 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from io import BytesIO
+from PIL import Image
+from batch_segment import load_image
+from derivatives import DEFAULT_SPECS, composite_on_background, derivative_path, render_derivatives
+from edge_recovery import with_edge_recovery
+from image_jobs import crop_replace_output
+from mask_cache import segment_images
+from output_layout import get_layout
+from pipeline import run_pipeline
+from rename_planner import check_journal, collect_folders, rename_scanned
+from upc_barcode import scan_barcode
+from write_behind import encode_image, save_image, start_writer, stop_writer, write_bytes
+
+WHITE = (255, 255, 255)
+# Folder under dest_dir the derivatives wait in until the rename plan says where they go
+SPOOL_DIR_NAME = '.storefront_spool'
+
+class StepTimes:
+    """Seconds spent in each step of the fused run, summed over the threads running it"""
+
+    def __init__(self):
+        self.seconds = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, start):
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + elapsed
+
+# Function to take a shoot folder to renamed, cropped JPGs and UPC-tree derivatives, reading each image once
+def run_storefront(folder_path, dest_dir, recursive=True, specs=None, model_name=None, reader_threads=None,
+                   inference_threads=None, writer_threads=None, queue_size=None, on_result=None, recover=False,
+                   edge_debug_dir=None):
+    """Return (RunResult, [StageStats], summary dict).
+
+    Does what the rename, crop-and-replace and thumbnail tools do one after
+    the other. Each image is read and decoded once; its barcode and mask
+    come from those pixels and the cropped JPG is written over it as the
+    crop tool does, while its derivatives are rendered and spooled to a
+    folder under dest_dir. Once every barcode is known the renames are
+    planned, journalled and applied as the rename tool does, and the
+    derivatives of each image that ends up named by its UPC are moved into
+    the UPC tree under dest_dir; the rest are deleted with the spool.
+    With recover, each mask has its edges recovered before the crop.
+    """
+    specs = specs or DEFAULT_SPECS
+    check_journal(folder_path)
+    folders = collect_folders(folder_path, recursive)
+    paths = [os.path.join(root, filename) for root, image_files in folders for filename in image_files]
+
+    steps = StepTimes()
+    barcodes = {}
+    digests = {}
+    rendered = {}  # crop output path -> [(spec, spooled file)]
+    spooled_from = {}  # spooled file -> crop output path, to trace failed writes
+    spool_dir = os.path.join(dest_dir, SPOOL_DIR_NAME)
+
+    def read_image(path):
+        start = time.perf_counter()
+        with open(path, 'rb') as img_file:
+            data = img_file.read()
+        digests[path] = hashlib.sha256(data).hexdigest()
+        image = load_image(BytesIO(data))
+        steps.add('decode', start)
+        start = time.perf_counter()
+        try:
+            # Named as 1orlando_upc_rename_code names them; the UPC tree has always been built from those names
+            barcodes[path] = scan_barcode(image, path, digests[path], legacy=True)
+        except Exception as e:
+            print(f"Error detecting barcode in {path}: {str(e)}")
+            barcodes[path] = None
+        steps.add('barcode', start)
+        return image
+
+    def segment(batch_paths, images, model_name):
+        start = time.perf_counter()
+        masks = segment_images(batch_paths, images, model_name, digests=[digests[path] for path in batch_paths])
+        steps.add('segment', start)
+        return masks
+
+    def save_output(image, mask, output_path):
+        start = time.perf_counter()
+        cutout = composite_on_background(image, mask)
+        # If no non-transparent pixels, write an empty white image as the crop tool does
+        save_image(cutout if cutout is not None else Image.new("RGB", (1, 1), WHITE), output_path, 'JPEG')
+        steps.add('crop', start)
+        start = time.perf_counter()
+        # The derivatives are resized from the crop just made; where they go depends on the rename plan,
+        # so they are written to the spool rather than held in memory for the whole run
+        spool_base = os.path.join(spool_dir, hashlib.sha256(output_path.encode('utf-8')).hexdigest())
+        spooled = []
+        for spec, derivative in render_derivatives(image, mask, specs, {WHITE: cutout}):
+            spool_path = derivative_path(spool_base, spec)
+            spooled_from[spool_path] = output_path
+            write_bytes(encode_image(derivative, spec.format, quality=spec.quality), spool_path)
+            spooled.append((spec, spool_path))
+        rendered[output_path] = spooled
+        steps.add('derivatives', start)
+
+    def rename_and_publish(result):
+        start = time.perf_counter()
+        applied, undetected, held_back = rename_scanned(folder_path, folders, barcodes, recursive,
+                                                        output_for=crop_replace_output)
+        steps.add('rename', start)
+        final_names = {action.src: action.dst for action in applied}
+        # Images renamed, not files: a PNG original and its JPG are one image
+        originals = set(paths)
+        summary.update(renamed=sum(action.kind != 'move' and action.src in originals for action in applied),
+                       undetected=len(undetected), held_back=held_back)
+
+        start = time.perf_counter()
+        layout = get_layout(dest_dir)
+        failures = []
+        for output_path, derivatives in rendered.items():
+            # The crop failed, or one of its derivatives never reached the spool
+            if output_path in failed_outputs:
+                continue
+            output_base = layout.output_base(final_names.get(output_path, output_path))
+            if output_base is None:
+                continue
+            try:
+                for spec, spool_path in derivatives:
+                    os.replace(spool_path, derivative_path(output_base, spec))
+            except OSError as e:
+                failures.append((output_path, e))
+                continue
+            summary['published'] += 1
+        result.record_write_failures(failures, on_result)
+        steps.add('publish', start)
+
+    save = save_output
+    if recover:
+        save = with_edge_recovery(save_output, edge_debug_dir)
+
+    summary = {'renamed': 0, 'undetected': 0, 'held_back': [], 'published': 0}
+    failed_outputs = set()
+    os.makedirs(spool_dir, exist_ok=True)
+    start_writer()
+    try:
+        result, stages = run_pipeline(paths, crop_replace_output, save, model_name, reader_threads,
+                                      inference_threads, writer_threads, queue_size, on_result=on_result,
+                                      read_image=read_image, segment=segment)
+        # Every crop and spooled derivative has landed before any file is renamed; a derivative that
+        # never landed fails the image it was made from
+        write_failures = [(spooled_from.get(path, path), error) for path, error in stop_writer()]
+        failed_outputs.update(path for path, _ in write_failures)
+        result.record_write_failures(write_failures, on_result)
+        # A cancelled run has not seen every barcode, so nothing is renamed or published
+        if not result.cancelled:
+            rename_and_publish(result)
+    finally:
+        stop_writer()
+        shutil.rmtree(spool_dir, ignore_errors=True)
+    summary['steps'] = {name: round(seconds, 3) for name, seconds in steps.seconds.items()}
+    return result.finish(), stages, summary
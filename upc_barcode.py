@@ -0,0 +1,199 @@
+import os
+from collections import Counter, namedtuple
+from PIL import Image
+from pyzbar.pyzbar import ZBarSymbol, decode
+from barcode_index import get_index
+from run_manifest import file_digest
+
+# Only retail linear codes are searched for; skipping QR, DataMatrix, Code 128 etc. is faster on busy packaging
+RETAIL_SYMBOLS = [ZBarSymbol.EAN13, ZBarSymbol.EAN8, ZBarSymbol.UPCA, ZBarSymbol.UPCE]
+
+# Long side of the downscaled passes tried before the full-resolution image, smallest first
+PASS_SIDES = tuple(int(side) for side in os.environ.get('BG_REMOVER_BARCODE_SIDES', '1500,3000').split(','))
+# Tiles tried last, at full resolution, and how much neighbouring tiles overlap
+TILE_SIZE = 1500
+TILE_OVERLAP = 300
+
+# How many images each pass (or the index) has answered during this run
+stage_counts = Counter()
+
+# A decoded product code: normalised EAN-13, the digits as printed, zbar symbology and the pass that found it
+BarcodeResult = namedtuple('BarcodeResult', 'ean13 raw symbology stage')
+
+# Function to calculate the EAN-13 check digit for a 12-digit barcode
+def calculate_ean13_check_digit(barcode_12):
+    """Return the check digit as a string, or None if barcode_12 is not 12 digits
+
+    >>> calculate_ean13_check_digit('400638133393')
+    '1'
+    """
+    if len(barcode_12) != 12 or not barcode_12.isdigit():
+        return None
+    even_sum = sum(int(barcode_12[i]) for i in range(1, 12, 2)) * 3  # Even positions * 3
+    odd_sum = sum(int(barcode_12[i]) for i in range(0, 12, 2))       # Odd positions
+    return str((10 - ((odd_sum + even_sum) % 10)) % 10)
+
+# Function to turn decoded digits into the 13-digit code product images are named by
+def convert_to_ean13(barcode_data, legacy=False):
+    """Return the 13-digit name for a code, or None if it is not numeric.
+
+    A valid EAN-13 is kept as it is. Otherwise the check digit is dropped and
+    the rest padded to 13 digits; when that leaves a non-zero second digit a
+    fresh EAN-13 check digit is appended.
+
+    >>> convert_to_ean13('4006381333931')
+    '4006381333931'
+    >>> convert_to_ean13('012345678905')
+    '0001234567890'
+    >>> convert_to_ean13('0012345678905')
+    '0001234567890'
+    >>> convert_to_ean13('96385074')
+    '0000009638507'
+
+    With legacy, the Orlando tools' naming is used instead: the last digit
+    is always dropped and the rest padded to 13 digits. Their output tree is
+    built from these names.
+
+    >>> convert_to_ean13('4006381333931', legacy=True)
+    '0400638133393'
+    >>> convert_to_ean13('012345678905', legacy=True)
+    '0001234567890'
+    >>> convert_to_ean13('0012345678905', legacy=True)
+    '0001234567890'
+    >>> convert_to_ean13('96385074', legacy=True)
+    '0000009638507'
+    >>> convert_to_ean13('CODE-128', legacy=True) is None
+    True
+    """
+    if not barcode_data.isdigit():
+        return None
+    if legacy:
+        return barcode_data[:-1].zfill(13)
+    if len(barcode_data) == 13 and int(barcode_data[0]) > 0:
+        if calculate_ean13_check_digit(barcode_data[:-1]) == barcode_data[-1]:
+            return barcode_data
+
+    barcode_padded = barcode_data[:-1].zfill(13)
+    if int(barcode_padded[1]) > 0:
+        barcode_12 = barcode_padded[-12:]
+        return barcode_12 + calculate_ean13_check_digit(barcode_12)
+    return barcode_padded
+
+# Function to infer a barcode type from its digits
+def infer_type_from_data(barcode_data):
+    if not barcode_data.isdigit():
+        return "Unknown"
+    length = len(barcode_data)
+    if length == 13 and int(barcode_data[1]) > 0:
+        return "EAN13"
+    elif length == 12 or (length == 13 and int(barcode_data[1]) == 0):
+        return "UPC-A"
+    return "Unknown"
+
+# Function to decode an image file straight to grayscale, once
+def load_grayscale(image_path):
+    with Image.open(image_path) as img:
+        if img.format == 'JPEG':
+            # Have libjpeg decode only the luma plane instead of converting RGB afterwards
+            img.draft('L', img.size)
+        return img.convert('L')
+
+# Function to shrink an image so its long side is at most long_side
+def _downscale(gray, long_side):
+    scale = long_side / max(gray.size)
+    size = (max(1, round(gray.size[0] * scale)), max(1, round(gray.size[1] * scale)))
+    return gray.resize(size, Image.Resampling.BOX)
+
+# Function to get the start offsets of overlapping tiles along one side
+def _tile_starts(length):
+    if length <= TILE_SIZE:
+        return [0]
+    step = TILE_SIZE - TILE_OVERLAP
+    starts = list(range(0, length - TILE_SIZE, step))
+    return starts + [length - TILE_SIZE]
+
+# Function to yield (stage, image) for each pass: downscaled, full resolution, then tiles
+def iter_passes(gray):
+    for long_side in sorted(PASS_SIDES):
+        if long_side < max(gray.size):
+            yield f"scale-{long_side}", _downscale(gray, long_side)
+    yield "full", gray
+    if max(gray.size) > TILE_SIZE:
+        for top in _tile_starts(gray.size[1]):
+            for left in _tile_starts(gray.size[0]):
+                yield "tile", gray.crop((left, top, min(left + TILE_SIZE, gray.size[0]),
+                                         min(top + TILE_SIZE, gray.size[1])))
+
+# Function to run the passes on an image until one yields a code accept() takes
+def find_barcode(image, accept, symbols=RETAIL_SYMBOLS):
+    """Return (accepted value, pyzbar result, stage), or (None, None, None) if no pass finds one.
+
+    image is a path or a PIL image. accept(result) returns the value to use
+    (e.g. the normalised EAN-13) or None to keep looking. Only the given
+    zbar symbologies are decoded; pass symbols=None for all of them.
+    """
+    gray = load_grayscale(image) if isinstance(image, str) else image.convert('L')
+    for stage, candidate in iter_passes(gray):
+        for result in decode(candidate, symbols=symbols):
+            value = accept(result)
+            if value is not None:
+                stage_counts[stage] += 1
+                return value, result, stage
+    stage_counts['none'] += 1
+    return None, None, None
+
+# Function to get the product code from a decoded barcode, or None if it cannot name an image
+def _usable_code(result):
+    raw = result.data.decode('utf-8')
+    ean13 = convert_to_ean13(raw)
+    if ean13 is None or len(ean13) != 13:
+        return None
+    return ean13, raw, result.type
+
+# Function to find the retail barcode in an image
+def scan_barcode(image, image_path=None, digest=None, legacy=False):
+    """Return a BarcodeResult, or None if no EAN-13/EAN-8/UPC-A/UPC-E code is found.
+
+    For image files the barcode index is checked first, so an image already
+    scanned (under any name) is not decoded again. An image decoded by the
+    caller uses the index too when its file path (and, if already known,
+    the SHA-256 of the file) is given. With legacy the code is named as the
+    Orlando tools name it (see convert_to_ean13); the index always keeps the
+    standard name.
+    """
+    if isinstance(image, str):
+        image_path = image
+    index = get_index() if image_path is not None else None
+    if index is not None:
+        digest = digest or file_digest(image_path)
+        known = index.get(digest)
+        if known is not None:
+            stage_counts['index'] += 1
+            return _named(BarcodeResult(*known), legacy) if known[0] else None
+
+    code, _, stage = find_barcode(image, _usable_code)
+    if index is not None:
+        if code is None:
+            index.put(digest, image_path)
+        else:
+            index.put(digest, image_path, *code, stage)
+    if code is None:
+        return None
+    return _named(BarcodeResult(*code, stage), legacy)
+
+# Function to rename a scan result the Orlando tools' way when legacy is set
+def _named(result, legacy):
+    # Any retail code has 8 to 13 digits, so both namings give 13 digits for the same codes
+    return result._replace(ean13=convert_to_ean13(result.raw, legacy=True)) if legacy else result
+
+# Function to detect the barcode in an image file, as the UPC tools use it
+def detect_barcode(image_path):
+    """Return (EAN-13, symbology, raw data), or (None, None, None) if no code is found or the image is unreadable"""
+    try:
+        result = scan_barcode(image_path)
+    except Exception as e:
+        print(f"Error detecting barcode in {image_path}: {str(e)}")
+        return None, None, None
+    if result is None:
+        return None, None, None
+    return result.ean13, result.symbology, result.raw
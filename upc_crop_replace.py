@@ -1,63 +1,20 @@
-import os
 import tkinter as tk
 from tkinter import filedialog, messagebox
-from PIL import Image
-from rembg import remove
-from io import BytesIO
-
-# Custom function to get tight bounding box ignoring low alpha pixels
-def get_tight_bbox(img, threshold=10):
-    data = list(img.getdata())
-    width, height = img.size
-    left = width
-    top = height
-    right = 0
-    bottom = 0
-    for y in range(height):
-        for x in range(width):
-            a = data[y * width + x][3]
-            if a >= threshold:
-                left = min(left, x)
-                right = max(right, x)
-                top = min(top, y)
-                bottom = max(bottom, y)
-    if left > right:
-        return None
-    return (left, top, right + 1, bottom + 1)
+from rembg_session import get_session, timings
+from batch_segment import load_image
+from mask_cache import segment_images
+from image_jobs import save_cropped_jpg
 
 # Function to remove the background from an image and crop to content
 def process_image(image_path):
     # Open the image
-    with open(image_path, 'rb') as img_file:
-        input_image = img_file.read()
-    
-    # Process image to remove background
-    output_image_bytes = remove(input_image)
-    
-    # Load the output as a PIL Image
-    output_img = Image.open(BytesIO(output_image_bytes))
-    
-    # Ensure it's in RGBA mode for transparency
-    if output_img.mode != 'RGBA':
-        output_img = output_img.convert('RGBA')
+    image = load_image(image_path)
     
-    # Get the tight bounding box ignoring low alpha
-    bbox = get_tight_bbox(output_img)
+    # Get the alpha mask of the foreground, kept in memory as a decoded image
+    mask = segment_images([image_path], [image])[0]
     
-    if bbox:
-        # Crop the image to the bounding box
-        cropped_img = output_img.crop(bbox)
-        
-        # Create a white background for JPG
-        white_bg = Image.new("RGB", cropped_img.size, (255, 255, 255))
-        white_bg.paste(cropped_img, mask=cropped_img.split()[3])  # Use alpha as mask
-        
-        # Save the image overwriting the original file as JPG
-        white_bg.save(image_path, 'JPEG')
-    else:
-        # If no non-transparent pixels, create an empty white image
-        white_bg = Image.new("RGB", (1, 1), (255, 255, 255))
-        white_bg.save(image_path, 'JPEG')
+    # Crop to the mask, composite onto white and save overwriting the original file as JPG
+    save_cropped_jpg(image, mask, image_path)
 
 # Function to select images and process them
 def select_files():
@@ -67,12 +24,16 @@ def select_files():
         filetypes=[("Image Files", "*.png *.jpg *.jpeg *.bmp *.tiff")])
 
     if file_paths:
+        # Load and warm the segmentation model once for the whole run
+        timings.reset()
+        get_session()
         for file_path in file_paths:
             try:
                 process_image(file_path)
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to process {file_path}: {str(e)}")
         
+        print(timings.report())
         messagebox.showinfo("Success", "Background removal completed successfully!")
     else:
         messagebox.showwarning("Warning", "No file selected. Please select image files to process.")
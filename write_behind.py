@@ -0,0 +1,144 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from output_layout import atomic_write
+
+# Set BG_REMOVER_WRITE_BEHIND=0 to write every output inline
+WRITE_BEHIND_ENABLED = os.environ.get('BG_REMOVER_WRITE_BEHIND', '1') != '0'
+
+# Threads persisting outputs and encoded bytes allowed in flight before producers wait
+DEFAULT_WRITE_THREADS = int(os.environ.get('BG_REMOVER_WRITE_THREADS', '4'))
+DEFAULT_WRITE_BUDGET = int(os.environ.get('BG_REMOVER_WRITE_BUDGET_MB', '256')) * 1024 * 1024
+DEFAULT_WRITE_RETRIES = 3
+
+class WriteBehindWriter:
+    """Persists finished, encoded outputs on a few background threads.
+
+    submit() returns as soon as the bytes are queued, so slow storage (a NAS
+    share) no longer holds up decoding and inference. It only blocks once the
+    queued bytes would exceed the budget. Failed writes are retried with
+    backoff; those that still fail are returned by flush().
+    """
+
+    def __init__(self, threads=DEFAULT_WRITE_THREADS, max_bytes=DEFAULT_WRITE_BUDGET,
+                 retries=DEFAULT_WRITE_RETRIES, retry_delay=0.5):
+        self.max_bytes = max_bytes
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.pid = os.getpid()
+        self.failures = []  # (output path, error)
+        self.written = 0
+        self._in_flight = 0
+        self._futures = set()
+        self._pending = {}  # output path -> queued writes
+        self._callbacks = {}  # output path -> functions to run once it has landed
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix='write-behind')
+
+    def submit(self, data, path):
+        with self._condition:
+            # Always admit one buffer, even one larger than the whole budget
+            while self._in_flight and self._in_flight + len(data) > self.max_bytes:
+                self._condition.wait()
+            self._in_flight += len(data)
+            self._pending[path] = self._pending.get(path, 0) + 1
+            future = self._executor.submit(self._write, data, path)
+            self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+
+    def _write(self, data, path):
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    atomic_write(data, path)
+                    with self._condition:
+                        self.written += 1
+                    return
+                except Exception as e:
+                    # Only I/O errors are worth another attempt
+                    if attempt == self.retries or not isinstance(e, OSError):
+                        print(f"Failed to write {path}: {e}", file=sys.stderr)
+                        self.failures.append((path, e))
+                        return
+                    print(f"Write to {path} failed ({e}), retrying", file=sys.stderr)
+                    time.sleep(self.retry_delay * 2 ** attempt)
+        finally:
+            callbacks = []
+            with self._condition:
+                self._in_flight -= len(data)
+                self._pending[path] -= 1
+                if not self._pending[path]:
+                    del self._pending[path]
+                    callbacks = self._callbacks.pop(path, [])
+                self._condition.notify_all()
+            for callback in callbacks:
+                callback()
+
+    def after_write(self, path, callback):
+        """Run callback once a queued write to path has finished; return False if none is queued"""
+        with self._condition:
+            if path not in self._pending:
+                return False
+            self._callbacks.setdefault(path, []).append(callback)
+            return True
+
+    def flush(self):
+        """Wait for every queued write and return the ones that failed"""
+        while self._futures:
+            for future in list(self._futures):
+                future.result()
+        return list(self.failures)
+
+    def close(self):
+        failures = self.flush()
+        self._executor.shutdown()
+        return failures
+
+# Writer for the run in progress in this process
+_writer = None
+
+# Function to start writing outputs behind the processing threads for the rest of a run
+def start_writer(threads=None, max_bytes=None):
+    """Return the new writer, or None when write-behind is turned off"""
+    global _writer
+    if _writer is not None:
+        stop_writer()
+    if not WRITE_BEHIND_ENABLED:
+        return None
+    _writer = WriteBehindWriter(threads or DEFAULT_WRITE_THREADS, max_bytes or DEFAULT_WRITE_BUDGET)
+    return _writer
+
+# Function to get the active writer, or None when outputs are written inline
+def get_writer():
+    # A worker process forked from the parent inherits the object but not its threads
+    if _writer is not None and _writer.pid == os.getpid():
+        return _writer
+    return None
+
+# Function to flush and stop the active writer; returns [(output path, error)] for writes that failed
+def stop_writer():
+    global _writer
+    writer = get_writer()
+    _writer = None
+    return writer.close() if writer else []
+
+# Function to encode a PIL image into the bytes of an output file
+def encode_image(image, image_format, **params):
+    buffer = BytesIO()
+    image.save(buffer, image_format, **params)
+    return buffer.getvalue()
+
+# Function to hand encoded bytes to the writer, or write them now when none is running
+def write_bytes(data, path):
+    writer = get_writer()
+    if writer is None:
+        atomic_write(data, path)
+    else:
+        writer.submit(data, path)
+
+# Function to encode an image on this thread and persist it behind it
+def save_image(image, path, image_format, **params):
+    write_bytes(encode_image(image, image_format, **params), path)